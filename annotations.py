@@ -0,0 +1,191 @@
+"""
+Per-workspace annotation databases
+
+The scripture corpus (scripture, bible_versions and the indexes built from
+them) lives in the shared verseindex.db. A request that names a workspace
+(X-Workspace header or ?workspace=) works against annotations/<name>.db
+instead, which holds that workspace's own topics, scripture_topics and
+scripture_tags. Each workspace connection opens the workspace file as its
+main database and attaches the corpus read-only as "corpus". Unqualified
+table names resolve to main first, so the existing queries join a
+workspace's tags against the shared scripture text unchanged, and writes
+only ever lock the workspace's own file.
+
+A workspace's database is created by its first write; reads of a
+workspace that doesn't exist yet are refused by the app rather than
+creating an empty file.
+
+Connections are pooled per workspace in a bounded LRU: close() hands a
+connection back to the pool, and the least recently used idle handles are
+really closed once more than max_handles are open.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+from topic_tree import ensure_topic_tree
+
+ANNOTATION_DIR = 'annotations'
+DEFAULT_MAX_HANDLES = 32
+
+_WORKSPACE_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Annotation tables as in the shared schema (after migration 3); the topic
+# hierarchy (migration 7) is added by ensure_topic_tree
+ANNOTATION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS topics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS scripture_topics (
+        scripture_id INTEGER,
+        topic_id INTEGER,
+        PRIMARY KEY (scripture_id, topic_id),
+        FOREIGN KEY (topic_id) REFERENCES topics (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS scripture_tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        topic_id INTEGER,
+        version TEXT NOT NULL,
+        start_position TEXT NOT NULL,
+        end_position TEXT NOT NULL,
+        start_key INTEGER,
+        end_key INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_scripture_tags_topic_key ON scripture_tags (topic_id, version, start_key)',
+    'CREATE INDEX IF NOT EXISTS idx_scripture_tags_version_key ON scripture_tags (version, start_key)',
+]
+
+
+def valid_workspace(name):
+    return bool(name) and _WORKSPACE_RE.match(name) is not None
+
+
+def workspace_path(annotation_dir, workspace):
+    return os.path.join(annotation_dir, f'{workspace}.db')
+
+
+def ensure_workspace(annotation_dir, workspace):
+    """Create the workspace database and its tables if needed; returns its path"""
+    os.makedirs(annotation_dir, exist_ok=True)
+    path = workspace_path(annotation_dir, workspace)
+    conn = sqlite3.connect(path)
+    try:
+        for statement in ANNOTATION_SCHEMA:
+            conn.execute(statement)
+        ensure_topic_tree(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() returns it to its pool"""
+
+    pool = None
+    workspace = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class AnnotationPool:
+    """Bounded LRU of open workspace connections with the corpus attached"""
+
+    def __init__(self, corpus, annotation_dir=ANNOTATION_DIR, max_handles=DEFAULT_MAX_HANDLES):
+        self.corpus = corpus
+        self.annotation_dir = annotation_dir
+        self.max_handles = max_handles
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()  # workspace -> idle connections, least recently used first
+        self._open = 0
+        self._known = set()
+
+    def _connect(self, workspace):
+        conn = sqlite3.connect(
+            self.path(workspace), factory=PooledConnection,
+            check_same_thread=False, timeout=10, uri=True
+        )
+        corpus_uri = 'file:' + quote(os.path.abspath(self.corpus)) + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS corpus', (corpus_uri,))
+        conn.workspace = workspace
+        conn.pool = self
+        return conn
+
+    def exists(self, workspace):
+        """Whether the workspace database has been created"""
+        return workspace in self._known or os.path.exists(workspace_path(self.annotation_dir, workspace))
+
+    def path(self, workspace):
+        """Path of a workspace database, creating it on first use"""
+        if workspace not in self._known:
+            ensure_workspace(self.annotation_dir, workspace)
+            self._known.add(workspace)
+        return workspace_path(self.annotation_dir, workspace)
+
+    def acquire(self, workspace):
+        """Get a connection for a workspace; close() it when done"""
+        with self._lock:
+            idle = self._idle.get(workspace)
+            if idle:
+                conn = idle.pop()
+                if not idle:
+                    del self._idle[workspace]
+                return conn
+            self._open += 1
+        try:
+            return self._connect(workspace)
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(conn.workspace, []).append(conn)
+            self._idle.move_to_end(conn.workspace)
+            while self._open > self.max_handles and self._idle:
+                workspace, idle = next(iter(self._idle.items()))
+                evicted.append(idle.pop(0))
+                if not idle:
+                    del self._idle[workspace]
+                self._open -= 1
+        for handle in evicted:
+            handle.really_close()
+
+    def open_handles(self):
+        with self._lock:
+            return self._open
+
+    def close_all(self):
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn in idle:
+            conn.really_close()
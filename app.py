@@ -1,17 +1,194 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, has_request_context, render_template, jsonify, request, stream_with_context
 import sqlite3
 import os
+import functools
+import threading
 from datetime import datetime
+from bible_books import (BOOKS, BOOKS_BY_NAME, MAX_VERSE, book_abbreviation, book_number, canonical_book_name,
+                         chapters_between, find_book, format_range, parse_position, parse_reference, position_key,
+                         position_string_key)
+from migrations import run_migrations
+from compact_tags import compact_tags
+from topic_index import DEFAULT_LIMIT, TopicPrefixIndex
+import concordance
+import topic_graph
+import topic_export
+import backup
+import auto_tag
+import topic_tree
+import corpus_manifest
+import catalog
+import jobs
+import tag_depth
+import verse_topics
+from write_queue import WriteQueue
+from annotations import AnnotationPool, valid_workspace
+from query_trace import DEFAULT_REPEAT_THRESHOLD, RequestTrace, TraceStore, TracedConnection
+from coalesce import AdmissionLimiter, Overloaded, SingleFlight
+from text_store import ChapterTextCache
+from result_cache import ResultCache
 
 app = Flask(__name__)
 app.config['DATABASE'] = 'verseindex.db'
+app.config['BACKUP_DIR'] = 'backups'
+app.config['ANNOTATION_DIR'] = 'annotations'
+# Record every SQL statement per request (debug only; see query_trace.py)
+app.config['QUERY_TRACE'] = os.environ.get('VERSEINDEX_QUERY_TRACE') == '1'
+app.config['QUERY_TRACE_REPEAT_THRESHOLD'] = DEFAULT_REPEAT_THRESHOLD
+# Hot chapter reads: how many may query at once, how many may wait, for how long
+app.config['MAX_CONCURRENT_READS'] = 16
+app.config['READ_QUEUE_SIZE'] = 64
+app.config['READ_QUEUE_TIMEOUT'] = 5.0
+app.config['RETRY_AFTER'] = 2
+# Result cache for the list/chapter reads (entries, bytes, seconds)
+app.config['RESULT_CACHE_ENTRIES'] = 1024
+app.config['RESULT_CACHE_BYTES'] = 32 * 1024 * 1024
+app.config['RESULT_CACHE_TTL'] = 300
+# Async entry point (asgi.py): pool threads for reads and writes, how many
+# requests may wait for one, and how many /api/events clients may connect
+app.config['ASGI_READ_WORKERS'] = 32
+app.config['ASGI_WRITE_WORKERS'] = 4
+app.config['ASGI_QUEUE_SIZE'] = 1024
+app.config['ASGI_MAX_EVENT_CLIENTS'] = 10000
+# Worker processes for background jobs (see jobs.py)
+app.config['JOB_WORKERS'] = jobs.DEFAULT_WORKERS
 
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(app.config['DATABASE'])
+    """Get database connection (the workspace's annotations if one was named)"""
+    workspace = g.get('workspace') if has_request_context() else None
+    if workspace:
+        conn = get_annotation_pool().acquire(workspace)
+    else:
+        conn = sqlite3.connect(app.config['DATABASE'])
     conn.row_factory = sqlite3.Row
+    trace = g.get('query_trace') if has_request_context() else None
+    if trace is not None:
+        conn = TracedConnection(conn, trace)
     return conn
 
+_annotation_pool = None
+_write_queues = {}
+_pool_lock = threading.Lock()
+
+def get_annotation_pool():
+    """Get the pool of workspace connections for the configured database"""
+    global _annotation_pool
+    with _pool_lock:
+        if (_annotation_pool is None or _annotation_pool.corpus != app.config['DATABASE']
+                or _annotation_pool.annotation_dir != app.config['ANNOTATION_DIR']):
+            _annotation_pool = AnnotationPool(app.config['DATABASE'], app.config['ANNOTATION_DIR'])
+        return _annotation_pool
+
+def get_write_queue():
+    """Get the group-commit writer for the current workspace's database"""
+    workspace = g.get('workspace') if has_request_context() else None
+    database = get_annotation_pool().path(workspace) if workspace else app.config['DATABASE']
+    with _pool_lock:
+        if database not in _write_queues:
+            _write_queues[database] = WriteQueue(database)
+        return _write_queues[database]
+
+_job_schedulers = {}
+
+def get_job_scheduler():
+    """Get the background job scheduler for the configured database, starting it on first use"""
+    database = app.config['DATABASE']
+    with _pool_lock:
+        if database not in _job_schedulers:
+            scheduler = jobs.JobScheduler(database, app.config['JOB_WORKERS'])
+            scheduler.add_listener(job_finished)
+            scheduler.start()
+            _job_schedulers[database] = scheduler
+        return _job_schedulers[database]
+
+def queue_refresh(job_type, dirty):
+    """Queue a refresh job if its inputs changed and none is waiting; True while one is queued or running"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    if dirty and not jobs.list_jobs(conn, 'queued', job_type, limit=1):
+        get_job_scheduler().submit(job_type)
+    pending = jobs.is_pending(conn, job_type)
+    conn.close()
+    return pending
+
+def job_finished(job_type, status, result):
+    """Drop cached reads a finished job may have changed (cancelled jobs may have committed some work)"""
+    changes = jobs.JOB_TYPES[job_type].changes
+    if changes == 'annotations':
+        topic_suggestions.invalidate()
+        topic_graph.mark_dirty()
+        tag_depth.mark_dirty()
+    if changes:
+        result_cache.clear()
+
+@app.before_request
+def select_workspace():
+    """Read the optional workspace from the X-Workspace header or ?workspace="""
+    workspace = request.headers.get('X-Workspace') or request.args.get('workspace')
+    if workspace and not valid_workspace(workspace):
+        return jsonify({'error': 'workspace may only contain letters, digits, "-" and "_"'}), 400
+    # Only writes create a workspace; reading one that doesn't exist is a 404
+    if workspace and request.method in ('GET', 'HEAD') and not get_annotation_pool().exists(workspace):
+        return jsonify({'error': 'Workspace not found'}), 404
+    g.workspace = workspace
+
+query_traces = TraceStore()
+
+@app.before_request
+def start_query_trace():
+    """Start recording SQL for this request when query tracing is on"""
+    if app.config['QUERY_TRACE'] and request.path.startswith('/api/') and not request.path.startswith('/api/debug/'):
+        query_traces.threshold = app.config['QUERY_TRACE_REPEAT_THRESHOLD']
+        g.query_trace = RequestTrace(request.method, request.full_path.rstrip('?'),
+                                     request.headers.get('X-Page-Load'),
+                                     request.url_rule.rule if request.url_rule else None)
+
+@app.after_request
+def finish_query_trace(response):
+    """Summarize the request's SQL in response headers and flag repeats"""
+    trace = g.get('query_trace')
+    if trace is None:
+        return response
+    
+    page_repeats = query_traces.add(trace)
+    summary = trace.summary(query_traces.threshold)
+    response.headers['X-Query-Trace-Id'] = trace.id
+    response.headers['X-Query-Count'] = str(summary['queries'])
+    response.headers['X-Query-Time-Ms'] = f"{summary['total_ms']:.2f}"
+    
+    repeated = summary['repeated'] or page_repeats
+    if repeated:
+        scope = 'request' if summary['repeated'] else 'page load'
+        worst = repeated[0]
+        response.headers['X-Query-Repeated'] = f"{worst['count']}x per {scope}: {worst['sql'][:200]}"
+        # Page-load repeats are logged once, when they first cross the threshold
+        if summary['repeated'] or worst['count'] == query_traces.threshold + 1:
+            app.logger.warning('Possible N+1 in %s %s: %dx per %s: %s',
+                               trace.method, trace.path, worst['count'], scope, worst['sql'])
+    return response
+
+@app.route('/api/debug/queries', methods=['GET'])
+def get_query_traces():
+    """Get summaries of the most recent traced requests"""
+    if not app.config['QUERY_TRACE']:
+        return jsonify({'error': 'Query tracing is off (set VERSEINDEX_QUERY_TRACE=1)'}), 404
+    return jsonify(query_traces.recent(int(request.args.get('limit', 50))))
+
+@app.route('/api/debug/queries/<trace_id>', methods=['GET'])
+def get_query_trace(trace_id):
+    """Get every statement one traced request ran"""
+    trace = query_traces.get(trace_id) if app.config['QUERY_TRACE'] else None
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    return jsonify(trace)
+
+@app.route('/api/debug/page-loads/<page_id>', methods=['GET'])
+def get_page_load_trace(page_id):
+    """Get statement counts across all requests of one page load"""
+    page = query_traces.page_load(page_id) if app.config['QUERY_TRACE'] else None
+    if page is None:
+        return jsonify({'error': 'Page load not found'}), 404
+    return jsonify(page)
+
 def init_db():
     """Initialize the database with schema"""
     conn = sqlite3.connect(app.config['DATABASE'])
@@ -68,6 +245,8 @@ def init_db():
     # Scripture tags table
     # Allows tagging specific word ranges that can span across verses
     # Positions are stored as "Gen 1:1.0" format (book chapter:verse.word)
+    # start_key/end_key hold the same positions as sortable integers
+    # (see bible_books.position_key)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS scripture_tags (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -75,6 +254,8 @@ def init_db():
             version TEXT NOT NULL,
             start_position TEXT NOT NULL,
             end_position TEXT NOT NULL,
+            start_key INTEGER,
+            end_key INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
         )
@@ -82,6 +263,45 @@ def init_db():
     
     conn.commit()
     conn.close()
+    
+    # Bring the new schema up to the latest migration version
+    run_migrations(app.config['DATABASE'], verbose=False)
+
+def load_topic_usage(database=None):
+    """Get (id, name, usage count) for every topic of a database (default: shared), for the suggest index"""
+    conn = sqlite3.connect(database or app.config['DATABASE'])
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT t.id, t.name, COALESCE(tags.n, 0) + COALESCE(links.n, 0) AS usage
+        FROM topics t
+        LEFT JOIN (
+            SELECT topic_id, COUNT(*) AS n FROM scripture_tags
+            WHERE topic_id IS NOT NULL GROUP BY topic_id
+        ) tags ON tags.topic_id = t.id
+        LEFT JOIN (
+            SELECT topic_id, COUNT(*) AS n FROM scripture_topics GROUP BY topic_id
+        ) links ON links.topic_id = t.id
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+topic_suggestions = TopicPrefixIndex(load_topic_usage)
+_workspace_suggestions = {}
+
+def get_topic_suggestions():
+    """Get the suggest index of the current workspace's topics (or the shared ones)"""
+    workspace = g.get('workspace') if has_request_context() else None
+    if not workspace:
+        return topic_suggestions
+    database = get_annotation_pool().path(workspace)
+    with _pool_lock:
+        if database not in _workspace_suggestions:
+            _workspace_suggestions[database] = TopicPrefixIndex(functools.partial(load_topic_usage, database))
+        return _workspace_suggestions[database]
+
+# Decompressed chapters of versions stored with text_store.py
+chapter_texts = ChapterTextCache()
 
 def check_db_tables():
     """Check if database tables exist"""
@@ -98,17 +318,206 @@ def check_db_tables():
     except:
         return False
 
+hot_reads = SingleFlight()
+_read_admission = None
+
+def get_read_admission():
+    """Get the admission limiter for hot reads, built from the current config"""
+    global _read_admission
+    limits = (app.config['MAX_CONCURRENT_READS'], app.config['READ_QUEUE_SIZE'], app.config['READ_QUEUE_TIMEOUT'])
+    with _pool_lock:
+        if _read_admission is None or (
+                _read_admission.max_concurrent, _read_admission.max_queue, _read_admission.timeout) != limits:
+            _read_admission = AdmissionLimiter(*limits)
+        return _read_admission
+
+def overloaded_response():
+    """503 telling the client when to try again"""
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['RETRY_AFTER'])
+    return response
+
+def shared_only(view):
+    """Reject workspace requests to routes that only cover the shared annotations"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.get('workspace'):
+            return jsonify({'error': 'Only available for the shared annotations; call it without a workspace'}), 400
+        return view(*args, **kwargs)
+    return wrapper
+
+def coalesced(view):
+    """Share one computation between concurrent identical requests, under admission control"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (
+            request.endpoint,
+            g.get('workspace'),
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True)))
+        )
+        
+        def compute():
+            with get_read_admission().slot():
+                response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+        
+        try:
+            (body, status, headers), shared = hot_reads.do(key, compute, app.config['READ_QUEUE_TIMEOUT'])
+        except Overloaded:
+            return overloaded_response()
+        
+        response = Response(body, status=status, headers=headers)
+        if shared:
+            response.headers['X-Coalesced'] = '1'
+        return response
+    return wrapper
+
+# One instance for the life of the process, so invalidation listeners stay
+# registered; get_result_cache() applies the current config to it
+result_cache = ResultCache()
+
+def get_result_cache():
+    """Get the result cache with the limits from the current config"""
+    limits = (app.config['RESULT_CACHE_ENTRIES'], app.config['RESULT_CACHE_BYTES'], app.config['RESULT_CACHE_TTL'])
+    if (result_cache.max_entries, result_cache.max_bytes, result_cache.ttl) != limits:
+        result_cache.configure(*limits)
+    return result_cache
+
+def annotations_tag(*parts):
+    """Cache dependency on the current workspace's annotations (or the shared ones)"""
+    return ('annotations', g.get('workspace')) + parts
+
+def scripture_tag(*parts):
+    """Cache dependency on the shared scripture corpus"""
+    return ('scripture',) + parts
+
+def chapter_tags(book, chapter):
+    return [annotations_tag('chapter', canonical_book_name(book or ''), str(chapter))]
+
+def span_chapter_tags(start_position, end_position):
+    """Chapter dependency tags for every chapter a tag span such as "Jn 3:16.0" - "Jn 4:2.5" crosses"""
+    start, end = parse_position(start_position), parse_position(end_position)
+    if not start or not end:
+        return [tag for parsed in (start, end) if parsed for tag in chapter_tags(parsed[0].name, parsed[1])]
+    tags = []
+    for book, chapter in chapters_between(start[0], start[1], end[0], end[1]):
+        tags.extend(chapter_tags(book.name, chapter))
+    return tags
+
+def cached(dependencies):
+    """
+    Serve successful responses from the result cache. dependencies(**kwargs)
+    returns the tags whose invalidation must drop the entry.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (
+                request.endpoint,
+                g.get('workspace'),
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(request.args.items(multi=True)))
+            )
+            cache = get_result_cache()
+            entry = cache.get(key)
+            if entry is not None:
+                body, headers = entry
+                response = Response(body, status=200, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            
+            tags = dependencies(**kwargs)
+            snapshot = cache.snapshot(tags)
+            response = app.make_response(view(*args, **kwargs))
+            # A coalesced response was computed by another request, possibly
+            # before our snapshot was taken, so only that request stores it
+            if response.status_code == 200 and not response.is_streamed and 'X-Coalesced' not in response.headers:
+                body = response.get_data()
+                cache.put(key, (body, list(response.headers.items())), len(body), tags, snapshot)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorate
+
 @app.route('/')
 def index():
     """Render the main page"""
     return render_template('index.html')
 
+# Lists up to this size are looked up with a plain IN (...); longer lists
+# go through a temp table so we stay under SQLite's bound-parameter limit.
+MAX_IN_CLAUSE_IDS = 500
+
+def parse_id_list(values):
+    """Parse verse ids from a comma separated string or a JSON list"""
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    return [int(value) for value in values]
+
+def topic_scope():
+    """(topic_id, include_descendants) from the query string; topic_id may be None"""
+    topic_id = request.args.get('topic_id', None)
+    include_descendants = request.args.get('include_descendants', '').lower() in ('1', 'true', 'yes')
+    return (int(topic_id) if topic_id else None), include_descendants
+
+def resolve_versions(cursor, value):
+    """
+    [(id, abbreviation)] for a comma separated list of version abbreviations,
+    in the order given; every version when the list is empty
+    """
+    cursor.execute('SELECT id, abbreviation FROM bible_versions ORDER BY id')
+    all_versions = [(row['id'], row['abbreviation']) for row in cursor.fetchall()]
+    
+    requested = [abbr.strip() for abbr in value.split(',') if abbr.strip()]
+    if not requested:
+        return all_versions
+    by_abbreviation = {abbr.upper(): (version_id, abbr) for version_id, abbr in all_versions}
+    unknown = [abbr for abbr in requested if abbr.upper() not in by_abbreviation]
+    if unknown:
+        raise ValueError(f"Unknown versions: {', '.join(unknown)}")
+    return list(dict.fromkeys(by_abbreviation[abbr.upper()] for abbr in requested))
+
+def fetch_verses_by_ids(cursor, verse_ids):
+    """Fetch verses for a list of ids with one query, returned in request order"""
+    unique_ids = list(dict.fromkeys(verse_ids))
+    if not unique_ids:
+        return []
+
+    if len(unique_ids) <= MAX_IN_CLAUSE_IDS:
+        placeholders = ', '.join('?' * len(unique_ids))
+        cursor.execute(f'SELECT * FROM scripture WHERE id IN ({placeholders})', unique_ids)
+        rows = cursor.fetchall()
+    else:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS requested_ids (id INTEGER PRIMARY KEY)')
+        cursor.execute('DELETE FROM requested_ids')
+        cursor.executemany('INSERT INTO requested_ids (id) VALUES (?)', [(i,) for i in unique_ids])
+        cursor.execute('SELECT s.* FROM requested_ids r JOIN scripture s ON s.id = r.id')
+        rows = cursor.fetchall()
+        cursor.execute('DROP TABLE requested_ids')
+
+    verses = {row['id']: dict(row) for row in rows}
+    chapter_texts.fill(cursor, verses.values())
+    return [verses[verse_id] for verse_id in verse_ids if verse_id in verses]
+
 @app.route('/api/scripture', methods=['GET'])
 def get_scripture():
-    """Get all scripture verses"""
+    """Get all scripture verses, or specific verses with ?ids=1,2,3"""
     conn = get_db()
     cursor = conn.cursor()
     
+    ids = request.args.get('ids', None)
+    if ids is not None:
+        try:
+            verse_ids = parse_id_list(ids)
+        except ValueError:
+            conn.close()
+            return jsonify({'error': 'ids must be a comma separated list of integers'}), 400
+        scripture = fetch_verses_by_ids(cursor, verse_ids)
+        conn.close()
+        return jsonify(scripture)
+    
     # Get optional search parameters
     book = request.args.get('book', '')
     chapter = request.args.get('chapter', '')
@@ -127,12 +536,32 @@ def get_scripture():
     query += ' ORDER BY book, chapter, verse'
     
     cursor.execute(query, params)
-    scripture = [dict(row) for row in cursor.fetchall()]
+    scripture = chapter_texts.fill(cursor, [dict(row) for row in cursor.fetchall()])
+    conn.close()
+    
+    return jsonify(scripture)
+
+@app.route('/api/scripture/batch', methods=['POST'])
+def get_scripture_batch():
+    """Get verses for a long list of ids, returned in request order"""
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be an object like {"ids": [1, 2, 3]}'}), 400
+    
+    try:
+        verse_ids = parse_id_list(data.get('ids', []))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ids must be a list of integers'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    scripture = fetch_verses_by_ids(cursor, verse_ids)
     conn.close()
     
     return jsonify(scripture)
 
 @app.route('/api/scripture/book/<book_name>', methods=['GET'])
+@coalesced
 def get_scripture_by_book(book_name):
     """Get all verses for a specific book"""
     chapter = request.args.get('chapter', None)
@@ -159,29 +588,96 @@ def get_scripture_by_book(book_name):
     query += ' ORDER BY s.chapter, s.verse'
     
     cursor.execute(query, params)
-    scripture = [dict(row) for row in cursor.fetchall()]
+    scripture = chapter_texts.fill(cursor, [dict(row) for row in cursor.fetchall()])
     conn.close()
     
     return jsonify(scripture)
 
+@app.route('/api/compare/<book_name>/<int:chapter>', methods=['GET'])
+@coalesced
+def compare_chapter(book_name, chapter):
+    """Get a chapter in several versions side by side, aligned by verse, with each version's tags"""
+    book = canonical_book_name(book_name)
+    number = book_number(book)
+    if number is None:
+        return jsonify({'error': f'Unknown book: {book_name}'}), 404
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        versions = resolve_versions(cursor, request.args.get('versions', ''))
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    
+    version_ids = [version_id for version_id, _ in versions]
+    placeholders = ', '.join('?' * len(version_ids))
+    cursor.execute(f'''
+        SELECT id, version_id, book, chapter, verse, text, format_type
+        FROM scripture
+        WHERE book = ? AND chapter = ? AND version_id IN ({placeholders})
+        ORDER BY verse, version_id
+    ''', [book, chapter] + version_ids)
+    verses = chapter_texts.fill(cursor, [dict(row) for row in cursor.fetchall()])
+    if not verses:
+        conn.close()
+        return jsonify({'error': 'Chapter not found'}), 404
+    
+    # Tags overlapping the chapter, including ones that start or end outside it
+    abbreviations = {version_id: abbr for version_id, abbr in versions}
+    cursor.execute(f'''
+        SELECT * FROM scripture_tags
+        WHERE version IN ({placeholders})
+          AND start_key <= ? AND end_key >= ?
+        ORDER BY start_key
+    ''', list(abbreviations.values()) + [
+        position_key(number, chapter, MAX_VERSE, 999), position_key(number, chapter, 0)
+    ])
+    tags = {abbr: [] for abbr in abbreviations.values()}
+    for row in cursor.fetchall():
+        tags[row['version']].append(dict(row))
+    conn.close()
+    
+    rows = {}
+    for verse in verses:
+        row = rows.setdefault(verse['verse'], {
+            'verse': verse['verse'],
+            'texts': {abbr: None for abbr in abbreviations.values()}
+        })
+        row['texts'][abbreviations[verse['version_id']]] = {
+            'id': verse['id'], 'text': verse['text'], 'format_type': verse['format_type']
+        }
+    for row in rows.values():
+        row['missing'] = [abbr for abbr, text in row['texts'].items() if text is None]
+    
+    return jsonify({
+        'book': book,
+        'chapter': chapter,
+        'versions': list(abbreviations.values()),
+        'rows': list(rows.values()),
+        'tags': tags
+    })
+
 @app.route('/api/scripture/book/<book_name>/chapters', methods=['GET'])
+@cached(lambda book_name: [scripture_tag('book', canonical_book_name(book_name))])
 def get_chapters_for_book(book_name):
     """Get list of chapters available for a book"""
     version_id = request.args.get('version_id', None)
     conn = get_db()
     cursor = conn.cursor()
     
+    # The catalog has one row per loaded (version, book, chapter)
     if version_id:
         cursor.execute('''
-            SELECT DISTINCT chapter 
-            FROM scripture 
+            SELECT chapter 
+            FROM scripture_catalog 
             WHERE book = ? AND version_id = ?
             ORDER BY chapter
         ''', (book_name, version_id))
     else:
         cursor.execute('''
             SELECT DISTINCT chapter 
-            FROM scripture 
+            FROM scripture_catalog 
             WHERE book = ? 
             ORDER BY chapter
         ''', (book_name,))
@@ -191,7 +687,18 @@ def get_chapters_for_book(book_name):
     
     return jsonify(chapters)
 
+@app.route('/api/catalog', methods=['GET'])
+@cached(lambda: [scripture_tag('catalog')])
+def get_catalog():
+    """Get the loaded books in canonical order with their chapters and verse counts"""
+    version_id = request.args.get('version_id', type=int)
+    conn = get_db()
+    books = catalog.version_catalog(conn, version_id)
+    conn.close()
+    return jsonify(books)
+
 @app.route('/api/versions', methods=['GET'])
+@cached(lambda: [scripture_tag('versions')])
 def get_versions():
     """Get all Bible versions"""
     conn = get_db()
@@ -201,6 +708,101 @@ def get_versions():
     conn.close()
     return jsonify(versions)
 
+@app.route('/api/books', methods=['GET'])
+def get_books():
+    """Get the canonical book table (names, abbreviations, chapter counts)"""
+    return jsonify([{
+        'number': book.number,
+        'name': book.name,
+        'abbreviation': book.abbreviation,
+        'chapters': book.chapters,
+        'testament': book.testament
+    } for book in BOOKS])
+
+@app.route('/api/passage', methods=['GET'])
+def get_passage():
+    """Get the verses for a reference such as "Jn 3:16-4:2; Rom 8" """
+    reference = request.args.get('ref', '')
+    version_id = request.args.get('version_id', None)
+
+    try:
+        ranges = parse_reference(reference)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        version_id = int(version_id) if version_id else None
+    except ValueError:
+        return jsonify({'error': 'version_id must be an integer'}), 400
+
+    conn = get_db()
+    cursor = conn.cursor()
+
+    # All ranges go into one VALUES list joined against scripture, so each
+    # range is an indexed (version_id, book, chapter, verse) range scan and
+    # the whole reference costs a single query per version.
+    range_values = ', '.join(['(?, ?, ?, ?, ?, ?)'] * len(ranges))
+    query = f'''
+        WITH ranges(idx, book, start_chapter, start_verse, end_chapter, end_verse) AS (
+            VALUES {range_values}
+        )
+        SELECT r.idx as range_index, s.*, bv.abbreviation as version_abbr, bv.name as version_name
+        FROM ranges r
+        CROSS JOIN bible_versions bv
+        JOIN scripture s ON s.version_id = bv.id
+            AND s.book = r.book
+            AND (s.chapter, s.verse) >= (r.start_chapter, r.start_verse)
+            AND (s.chapter, s.verse) <= (r.end_chapter, r.end_verse)
+    '''
+    params = []
+    for idx, passage in enumerate(ranges):
+        params.extend([
+            idx, passage.book, passage.start_chapter, passage.start_verse,
+            passage.end_chapter, passage.end_verse or MAX_VERSE
+        ])
+
+    if version_id is not None:
+        query += ' WHERE bv.id = ?'
+        params.append(version_id)
+
+    query += ' ORDER BY r.idx, bv.name, s.chapter, s.verse'
+
+    cursor.execute(query, params)
+    passages = [{'reference': format_range(passage), 'verses': []} for passage in ranges]
+    for row in cursor.fetchall():
+        verse = dict(row)
+        passages[verse.pop('range_index')]['verses'].append(verse)
+    for passage in passages:
+        chapter_texts.fill(cursor, passage['verses'])
+    conn.close()
+
+    return jsonify({
+        'reference': '; '.join(passage['reference'] for passage in passages),
+        'passages': passages
+    })
+
+@app.route('/api/passages/hot', methods=['GET'])
+@shared_only
+def get_hot_passages():
+    """The word ranges covered by the most tags (optional book, version, limit)"""
+    book = None
+    if request.args.get('book'):
+        book = find_book(request.args['book'])
+        if book is None:
+            return jsonify({'error': f"Unknown or ambiguous book: {request.args['book']}"}), 400
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    # Serve the last sweep; tags added since are swept by a background job
+    refreshing = queue_refresh('tag_depth', tag_depth.take_dirty())
+    
+    conn = sqlite3.connect(app.config['DATABASE'])
+    passages = tag_depth.hot_passages(conn, book, request.args.get('version'), limit)
+    conn.close()
+    
+    return jsonify({'passages': passages, 'refreshing': refreshing})
+
 @app.route('/api/scripture/<int:verse_id>', methods=['GET'])
 def get_verse(verse_id):
     """Get a specific verse by ID"""
@@ -208,10 +810,12 @@ def get_verse(verse_id):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM scripture WHERE id = ?', (verse_id,))
     verse = cursor.fetchone()
+    if verse:
+        verse = chapter_texts.fill(cursor, [dict(verse)])[0]
     conn.close()
     
     if verse:
-        return jsonify(dict(verse))
+        return jsonify(verse)
     return jsonify({'error': 'Verse not found'}), 404
 
 @app.route('/api/scripture/<int:verse_id>/topics', methods=['GET'])
@@ -234,6 +838,11 @@ def get_verse_topics(verse_id):
     return jsonify(topics)
 
 @app.route('/api/scripture/topics', methods=['GET'])
+@cached(lambda: [
+    annotations_tag('topics'),
+    scripture_tag('book', canonical_book_name(request.args.get('book', ''))),
+] + chapter_tags(request.args.get('book'), request.args.get('chapter')))
+@coalesced
 def get_chapter_topics():
     """Get all topics related to verses in a chapter"""
     book = request.args.get('book', None)
@@ -243,6 +852,11 @@ def get_chapter_topics():
     if not book or not chapter:
         return jsonify({'error': 'book and chapter are required'}), 400
     
+    try:
+        topic_id, include_descendants = topic_scope()
+    except ValueError:
+        return jsonify({'error': 'topic_id must be an integer'}), 400
+    
     conn = get_db()
     cursor = conn.cursor()
     
@@ -283,52 +897,22 @@ def get_chapter_topics():
             WHERE st.topic_id IS NOT NULL
     '''
     # Match positions like "Gen 1:" or "Ex 1:" for the chapter
-    # Build proper book abbreviation patterns based on the book name
-    book_abbr_patterns = []
-    # Try first 3 characters with space
-    book_abbr_patterns.append(f'{book[:3]} {chapter}:')
-    # Try common abbreviations
-    if book.startswith('Genesis'):
-        book_abbr_patterns.append(f'Gen {chapter}:')
-    elif book.startswith('Exodus'):
-        book_abbr_patterns.append(f'Ex {chapter}:')
-    elif book.startswith('Leviticus'):
-        book_abbr_patterns.append(f'Lev {chapter}:')
-    elif book.startswith('Numbers'):
-        book_abbr_patterns.append(f'Num {chapter}:')
-    elif book.startswith('Deuteronomy'):
-        book_abbr_patterns.append(f'Deut {chapter}:')
-    elif 'Samuel' in book:
-        book_abbr_patterns.append(f'{book[:2]} Sam {chapter}:')
-    elif 'Kings' in book:
-        book_abbr_patterns.append(f'{book[:2]} Kgs {chapter}:')
-    elif 'Chronicles' in book:
-        book_abbr_patterns.append(f'{book[:2]} Chr {chapter}:')
-    elif 'Corinthians' in book:
-        book_abbr_patterns.append(f'{book[:2]} Cor {chapter}:')
-    elif 'Thessalonians' in book:
-        book_abbr_patterns.append(f'{book[:2]} Thess {chapter}:')
-    elif 'Timothy' in book:
-        book_abbr_patterns.append(f'{book[:2]} Tim {chapter}:')
-    elif 'Peter' in book:
-        book_abbr_patterns.append(f'{book[:2]} Pet {chapter}:')
-    elif 'John' in book and book != 'John':
-        book_abbr_patterns.append(f'{book[:2]} John {chapter}:')
-    
-    # Build LIKE conditions for all patterns
-    like_conditions = []
-    for pattern in book_abbr_patterns:
-        like_conditions.append(f'st.start_position LIKE ?')
-        like_conditions.append(f'st.end_position LIKE ?')
-        params.extend([f'{pattern}%', f'{pattern}%'])
-    
-    query += ' AND (' + ' OR '.join(like_conditions) + ')'
+    chapter_pattern = f'{book_abbreviation(book)} {chapter}:'
+    query += ' AND (st.start_position LIKE ? OR st.end_position LIKE ?)'
+    params.extend([f'{chapter_pattern}%', f'{chapter_pattern}%'])
     
     if version_abbr:
         query += ' AND st.version = ?'
         params.append(version_abbr)
     
-    query += ') ORDER BY t.name'
+    query += ')'
+    
+    # Optionally limit to one topic, or to everything under it
+    if topic_id is not None:
+        query += ' AND ' + topic_tree.topic_filter('t.id', include_descendants)
+        params.append(topic_id)
+    
+    query += ' ORDER BY t.name'
     
     cursor.execute(query, params)
     topics = [dict(row) for row in cursor.fetchall()]
@@ -336,13 +920,68 @@ def get_chapter_topics():
     
     return jsonify(topics)
 
+def chapter_topic_bitsets(conn, book, chapter, version_id):
+    """verse_topics.chapter_bitsets for a Book's chapter, through the result cache"""
+    key = ('verse_topics', g.get('workspace'), book.name, chapter, version_id)
+    cache = get_result_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    tags = chapter_tags(book.name, chapter) + [scripture_tag('book', book.name)]
+    snapshot = cache.snapshot(tags)
+    entry = verse_topics.chapter_bitsets(conn, book, chapter, version_id)
+    topic_ids, bitsets = entry
+    cache.put(key, entry, 64 + 8 * len(topic_ids) + 32 * len(bitsets), tags, snapshot)
+    return entry
+
+def fetch_topics_by_ids(cursor, topic_ids):
+    """{id: topic dict} for the given topic ids"""
+    topics = {}
+    ids = list(topic_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(f'SELECT id, name, description FROM topics WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+        topics.update((row['id'], dict(row)) for row in cursor.fetchall())
+    return topics
+
+@app.route('/api/scripture/topic-bitsets', methods=['GET'])
+@cached(lambda: [annotations_tag('topics')] + chapter_tags(request.args.get('book'), request.args.get('chapter')))
+@coalesced
+def get_chapter_topic_bitsets():
+    """Get each verse's topics in a chapter as a bitset over the chapter's topic list"""
+    book = find_book(request.args.get('book', ''))
+    chapter = request.args.get('chapter', type=int)
+    version_id = request.args.get('version_id', type=int)
+    
+    if not book or not chapter:
+        return jsonify({'error': 'book and chapter are required'}), 400
+    
+    conn = get_db()
+    topic_ids, bitsets = chapter_topic_bitsets(conn, book, chapter, version_id)
+    topics = fetch_topics_by_ids(conn.cursor(), topic_ids)
+    conn.close()
+    
+    return jsonify({
+        'book': book.name,
+        'chapter': chapter,
+        'topics': [topics.get(topic_id, {'id': topic_id, 'name': None, 'description': None})
+                   for topic_id in topic_ids],
+        'verses': verse_topics.encode_bitsets(bitsets)
+    })
+
 @app.route('/api/scripture/tags', methods=['GET'])
+@coalesced
 def get_tags():
     """Get all tags for scripture in a given range"""
     book = request.args.get('book', None)
     chapter = request.args.get('chapter', None)
     version_id = request.args.get('version_id', None)
     
+    try:
+        topic_id, include_descendants = topic_scope()
+    except ValueError:
+        return jsonify({'error': 'topic_id must be an integer'}), 400
+    
     conn = get_db()
     cursor = conn.cursor()
     
@@ -360,8 +999,7 @@ def get_tags():
     # Filter by book and chapter using position strings
     if book and chapter:
         # Match positions like "Gen 1:" for Genesis chapter 1
-        book_abbr = book[:3] + ' '  # Simple abbreviation matching
-        chapter_pattern = f'{book_abbr}{chapter}:'
+        chapter_pattern = f'{book_abbreviation(book)} {chapter}:'
         query += ' AND (start_position LIKE ? OR end_position LIKE ?)'
         params.extend([f'{chapter_pattern}%', f'{chapter_pattern}%'])
     
@@ -369,6 +1007,10 @@ def get_tags():
         query += ' AND version = ?'
         params.append(version_abbr)
     
+    if topic_id is not None:
+        query += ' AND ' + topic_tree.topic_filter('topic_id', include_descendants)
+        params.append(topic_id)
+    
     query += ' ORDER BY start_position'
     
     cursor.execute(query, params)
@@ -381,8 +1023,6 @@ def get_tags():
 def create_tag():
     """Create a new tag"""
     data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
     
     try:
         # Validate required fields
@@ -392,25 +1032,326 @@ def create_tag():
         if 'version' not in data:
             return jsonify({'error': 'version is required'}), 400
         
-        cursor.execute('''
-            INSERT INTO scripture_tags 
-            (topic_id, version, start_position, end_position)
-            VALUES (?, ?, ?, ?)
-        ''', (
+        params = (
             data.get('topic_id'),
             data['version'],
             data['start_position'],
-            data['end_position']
-        ))
-        conn.commit()
-        tag_id = cursor.lastrowid
-        conn.close()
+            data['end_position'],
+            position_string_key(data['start_position']),
+            position_string_key(data['end_position'])
+        )
+        tag_id = get_write_queue().execute(lambda conn: conn.execute('''
+            INSERT INTO scripture_tags 
+            (topic_id, version, start_position, end_position, start_key, end_key)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', params).lastrowid)
+        get_topic_suggestions().invalidate()
+        topic_graph.mark_dirty()
+        tag_depth.mark_dirty()
+        result_cache.invalidate(*span_chapter_tags(data['start_position'], data['end_position']))
         return jsonify({'id': tag_id, 'message': 'Tag created successfully'}), 201
     except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/manifest', methods=['GET'])
+def get_manifest():
+    """Get the chapter hash manifest of ?version=, or the hash of every version"""
+    conn = get_db()
+    cursor = conn.cursor()
+    abbreviation = request.args.get('version', None)
+    
+    if abbreviation:
+        cursor.execute('SELECT id, abbreviation FROM bible_versions WHERE abbreviation = ?', (abbreviation,))
+        version = cursor.fetchone()
+        if not version:
+            conn.close()
+            return jsonify({'error': f'Unknown version: {abbreviation}'}), 404
+        manifest = corpus_manifest.version_manifest(cursor, version['id'], version['abbreviation'])
         conn.close()
+        return jsonify(manifest)
+    
+    cursor.execute('SELECT id, abbreviation FROM bible_versions ORDER BY id')
+    versions = []
+    for version_id, abbr in [tuple(row) for row in cursor.fetchall()]:
+        manifest = corpus_manifest.version_manifest(cursor, version_id, abbr)
+        versions.append({
+            'version': abbr,
+            'hash': manifest['hash'],
+            'chapters': sum(len(book['chapters']) for book in manifest['books'].values())
+        })
+    conn.close()
+    return jsonify(versions)
+
+@app.route('/api/concordance', methods=['GET'])
+def get_concordance():
+    """Get every occurrence of a word, with counts per book"""
+    word = request.args.get('word', '')
+    version_id = request.args.get('version_id', None)
+    
+    if not concordance.normalize_word(word):
+        return jsonify({'error': 'word is required'}), 400
+    
+    try:
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+        version_id = int(version_id) if version_id else None
+    except ValueError:
+        return jsonify({'error': 'limit, offset and version_id must be integers'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    results = concordance.lookup(conn, word, version_id)
+    cursor.execute('SELECT id, abbreviation FROM bible_versions')
+    version_abbrs = {row['id']: row['abbreviation'] for row in cursor.fetchall()}
+    building = jobs.is_pending(conn, 'concordance')
+    conn.close()
+    
+    return jsonify({
+        'word': concordance.normalize_word(word),
+        'building': building,
+        'versions': [{
+            'version_id': result['version_id'],
+            'version': version_abbrs.get(result['version_id']),
+            'total': len(result['keys']),
+            'books': concordance.counts_by_book(result['keys']),
+            'occurrences': [concordance.occurrence(key) for key in result['keys'][offset:offset + limit]]
+        } for result in results]
+    })
+
+@app.route('/api/admin/concordance/rebuild', methods=['POST'])
+def rebuild_concordance():
+    """Queue a concordance rebuild as a background job"""
+    data = request.json or {}
+    
+    try:
+        version_id = data.get('version_id')
+        version_id = int(version_id) if version_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'version_id must be an integer'}), 400
+    
+    job_id = get_job_scheduler().submit('concordance', {'version_id': version_id})
+    return jsonify({'message': 'Concordance build queued', 'job_id': job_id}), 202
+
+@app.route('/api/admin/backup', methods=['POST'])
+def start_backup():
+    """Queue an online backup job (optional body: incremental, compress, keep)"""
+    data = request.json or {}
+    
+    try:
+        keep = int(data.get('keep', backup.DEFAULT_KEEP))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'keep must be an integer'}), 400
+    
+    job_id = get_job_scheduler().submit('backup', {
+        'backup_dir': app.config['BACKUP_DIR'],
+        'incremental': bool(data.get('incremental', False)),
+        'compress': bool(data.get('compress', False)),
+        'keep': keep
+    })
+    return jsonify({'message': 'Backup queued', 'job_id': job_id}), 202
+
+@app.route('/api/admin/backups', methods=['GET'])
+def list_backups():
+    """List snapshots in the backup directory and the state of the last run"""
+    manifest = backup.load_manifest(app.config['BACKUP_DIR'])
+    conn = sqlite3.connect(app.config['DATABASE'])
+    running = bool(jobs.list_jobs(conn, 'running', 'backup', limit=1))
+    finished = [job for job in jobs.list_jobs(conn, job_type='backup', limit=10) if job['status'] in jobs.FINISHED]
+    conn.close()
+    last = None
+    if finished:
+        last = finished[0]['result'] or {'error': finished[0]['error'] or finished[0]['status']}
+    return jsonify({
+        'running': running,
+        'last': last,
+        'snapshots': manifest['snapshots']
+    })
+
+@app.route('/api/admin/cache', methods=['GET'])
+def get_cache_stats():
+    """Result cache size and hit/miss counters"""
+    return jsonify(get_result_cache().stats())
+
+@app.route('/api/admin/cache/clear', methods=['POST'])
+def clear_result_cache():
+    """Drop every cached result, e.g. after editing the database by hand"""
+    result_cache.clear()
+    return jsonify({'message': 'Cache cleared'})
+
+@app.route('/api/admin/tags/compact', methods=['POST'])
+@shared_only
+def compact_scripture_tags():
+    """Merge overlapping tags per topic and version (as a background job with "background": true)"""
+    data = request.json or {}
+    
+    if data.get('background'):
+        try:
+            topic_id = data.get('topic_id')
+            params = {
+                'topic_id': int(topic_id) if topic_id is not None else None,
+                'version': data.get('version'),
+                'dry_run': bool(data.get('dry_run', False))
+            }
+        except (TypeError, ValueError):
+            return jsonify({'error': 'topic_id must be an integer'}), 400
+        job_id = get_job_scheduler().submit('compact_tags', params)
+        return jsonify({'message': 'Compaction queued', 'job_id': job_id}), 202
+    
+    try:
+        topic_id = data.get('topic_id')
+        stats = compact_tags(
+            app.config['DATABASE'],
+            topic_id=int(topic_id) if topic_id is not None else None,
+            version=data.get('version'),
+            dry_run=bool(data.get('dry_run', False))
+        )
+    except (TypeError, ValueError):
+        return jsonify({'error': 'topic_id must be an integer'}), 400
+    
+    topic_suggestions.invalidate()
+    topic_graph.mark_dirty()
+    tag_depth.mark_dirty()
+    result_cache.clear()
+    return jsonify(stats)
+
+@app.route('/api/admin/tag-rules', methods=['GET'])
+@shared_only
+def get_tag_rules():
+    """List auto-tagging rules"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT r.*, t.name AS topic_name
+        FROM tag_rules r
+        JOIN topics t ON t.id = r.topic_id
+        ORDER BY r.id
+    ''')
+    rules = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return jsonify(rules)
+
+@app.route('/api/admin/tag-rules', methods=['POST'])
+@shared_only
+def add_tag_rule():
+    """Add an auto-tagging rule (topic_id, pattern, optional regex, version, book)"""
+    data = request.json or {}
+    
+    try:
+        topic_id = int(data.get('topic_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'topic_id must be an integer'}), 400
+    
+    try:
+        rule_id = auto_tag.add_rule(
+            app.config['DATABASE'],
+            topic_id,
+            data.get('pattern', ''),
+            is_regex=bool(data.get('regex', False)),
+            version=data.get('version'),
+            book=data.get('book')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'id': rule_id, 'message': 'Rule added successfully'}), 201
+
+@app.route('/api/admin/tag-rules/run', methods=['POST'])
+@shared_only
+def run_tag_rules():
+    """Queue an auto-tagging job over the corpus (optional body: rule_id)"""
+    data = request.json or {}
+    
+    try:
+        rule_id = data.get('rule_id')
+        rule_id = int(rule_id) if rule_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'rule_id must be an integer'}), 400
+    
+    job_id = get_job_scheduler().submit('auto_tag', {'rule_id': rule_id})
+    return jsonify({'message': 'Auto-tagging queued', 'job_id': job_id}), 202
+
+# Parameters HTTP clients may pass to each job type. Anything naming a
+# location (backup_dir, an import source) stays with the server's config
+# and the command line.
+JOB_PARAMS = {
+    'concordance': {'version_id'},
+    'compact_tags': {'topic_id', 'version', 'dry_run'},
+    'auto_tag': {'rule_id'},
+    'manifest': {'version_id'},
+    'migrate': set(),
+    'backup': {'incremental', 'compress', 'keep'},
+    'import': {'version', 'books'},
+    'tag_depth': {'version', 'full'},
+    'topic_graph': {'full'},
+}
+
+@app.route('/api/jobs', methods=['POST'])
+@shared_only
+def create_job():
+    """Queue a background job ({"type": "concordance", "params": {"version_id": 1}})"""
+    data = request.json or {}
+    job_type = data.get('type')
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params must be an object'}), 400
+    if job_type in JOB_PARAMS:
+        unknown = sorted(set(params) - JOB_PARAMS[job_type])
+        if unknown:
+            return jsonify({'error': f"Unsupported params for {job_type}: {', '.join(unknown)}"}), 400
+    if job_type == 'backup':
+        params['backup_dir'] = app.config['BACKUP_DIR']
+    
+    try:
+        job_id = get_job_scheduler().submit(job_type, params)
+    except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    
+    conn = sqlite3.connect(app.config['DATABASE'])
+    job = jobs.job_status(conn, job_id)
+    conn.close()
+    return jsonify(job), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """List recent jobs (optional status, type and limit)"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    conn = sqlite3.connect(app.config['DATABASE'])
+    job_list = jobs.list_jobs(conn, request.args.get('status'), request.args.get('type'), limit)
+    conn.close()
+    return jsonify(job_list)
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get a job's status, progress, rate and ETA, and its result once finished"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    job = jobs.job_status(conn, job_id)
+    conn.close()
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    job = jobs.job_status(conn, job_id)
+    if job is None:
+        conn.close()
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] in jobs.FINISHED:
+        conn.close()
+        return jsonify({'error': f"Job already {job['status']}"}), 409
+    
+    jobs.cancel_job(app.config['DATABASE'], job_id)
+    job = jobs.job_status(conn, job_id)
+    conn.close()
+    return jsonify(job)
 
 @app.route('/api/topics', methods=['GET'])
+@cached(lambda: [annotations_tag('topics')])
 def get_topics():
     """Get all topics"""
     conn = get_db()
@@ -420,9 +1361,143 @@ def get_topics():
     conn.close()
     return jsonify(topics)
 
+# Longest window /api/topics/in-range will union, in chapters
+MAX_RANGE_CHAPTERS = 150
+
+@app.route('/api/topics/in-range', methods=['GET'])
+@coalesced
+def get_topics_in_range():
+    """Get the topics covering any verse from ?from= to ?to= (e.g. "Jn 3:1" to "Jn 3:20")"""
+    try:
+        start = parse_reference(request.args.get('from', ''))[0]
+        end = parse_reference(request.args.get('to') or request.args.get('from', ''))[-1]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    version_id = request.args.get('version_id', type=int)
+    
+    start_book, end_book = BOOKS_BY_NAME[start.book], BOOKS_BY_NAME[end.book]
+    end_verse = end.end_verse or MAX_VERSE
+    if (end_book.number, end.end_chapter, end_verse) < (start_book.number, start.start_chapter, start.start_verse):
+        return jsonify({'error': 'to must not come before from'}), 400
+    chapters = list(chapters_between(start_book, start.start_chapter, end_book, end.end_chapter))
+    if len(chapters) > MAX_RANGE_CHAPTERS:
+        return jsonify({'error': f'Range spans more than {MAX_RANGE_CHAPTERS} chapters'}), 400
+    
+    conn = get_db()
+    found = set()
+    for book, chapter in chapters:
+        topic_ids, bitsets = chapter_topic_bitsets(conn, book, chapter, version_id)
+        first = start.start_verse if (book, chapter) == chapters[0] else 1
+        last = end_verse if (book, chapter) == chapters[-1] else MAX_VERSE
+        found.update(verse_topics.window_topics(topic_ids, bitsets, first, last))
+    topics = sorted(fetch_topics_by_ids(conn.cursor(), found).values(), key=lambda topic: topic['name'])
+    conn.close()
+    
+    return jsonify(topics)
+
+@app.route('/api/topics/suggest', methods=['GET'])
+def suggest_topics():
+    """Get the most used topics whose name (or a word in it) starts with ?q="""
+    query = request.args.get('q', '')
+    
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    return jsonify(get_topic_suggestions().suggest(query, limit))
+
+@app.route('/api/topics/<int:topic_id>/tree', methods=['GET'])
+def get_topic_tree(topic_id):
+    """Get a topic's ancestors and descendants (optional ?max_depth=)"""
+    try:
+        max_depth = request.args.get('max_depth', None)
+        max_depth = int(max_depth) if max_depth else None
+    except ValueError:
+        return jsonify({'error': 'max_depth must be an integer'}), 400
+    
+    conn = get_db()
+    topic = conn.execute('SELECT id, name, parent_id FROM topics WHERE id = ?', (topic_id,)).fetchone()
+    if not topic:
+        conn.close()
+        return jsonify({'error': 'Topic not found'}), 404
+    
+    ancestors = [dict(row) for row in topic_tree.ancestors(conn, topic_id)]
+    descendants = [dict(row) for row in topic_tree.descendants(conn, topic_id, max_depth)]
+    conn.close()
+    
+    return jsonify({'topic': dict(topic), 'ancestors': ancestors, 'descendants': descendants})
+
+@app.route('/api/topics/<int:topic_id>/related', methods=['GET'])
+@shared_only
+def get_related_topics(topic_id):
+    """Get the topics that most often share verses with a topic"""
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    # Serve what is stored now; changes since the last refresh are picked
+    # up by a background job
+    refreshing = queue_refresh('topic_graph', topic_graph.take_dirty())
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name FROM topics WHERE id = ?', (topic_id,))
+    topic = cursor.fetchone()
+    if not topic:
+        conn.close()
+        return jsonify({'error': 'Topic not found'}), 404
+    
+    cursor.execute('''
+        SELECT t.id, t.name, r.shared_verses, r.score
+        FROM topic_related r
+        JOIN topics t ON t.id = r.related_topic_id
+        WHERE r.topic_id = ?
+        ORDER BY r.score DESC, r.shared_verses DESC, t.id
+        LIMIT ?
+    ''', (topic_id, limit))
+    related = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    
+    return jsonify({'topic': dict(topic), 'related': related, 'refreshing': refreshing})
+
+@app.route('/api/topics/<int:topic_id>/export', methods=['GET'])
+def export_topic(topic_id):
+    """Stream every passage tagged under a topic, with text in each requested version"""
+    fmt = request.args.get('format', 'md')
+    if fmt not in topic_export.FORMATS:
+        return jsonify({'error': 'format must be one of: ' + ', '.join(topic_export.FORMATS)}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name, description FROM topics WHERE id = ?', (topic_id,))
+    topic = cursor.fetchone()
+    if not topic:
+        conn.close()
+        return jsonify({'error': 'Topic not found'}), 404
+    
+    try:
+        versions = resolve_versions(cursor, request.args.get('versions', ''))
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    conn.close()
+    
+    filename = '-'.join(topic['name'].lower().split()) or f'topic-{topic_id}'
+    body = topic_export.export_topic(get_db, dict(topic), versions, fmt)
+    return Response(
+        stream_with_context(body),
+        mimetype=topic_export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'}
+    )
+
 @app.route('/api/scripture', methods=['POST'])
 def add_scripture():
     """Add a new scripture verse"""
+    if g.workspace:
+        return jsonify({'error': 'Scripture is shared; add it without a workspace'}), 400
+    
     data = request.json
     conn = get_db()
     cursor = conn.cursor()
@@ -435,9 +1510,14 @@ def add_scripture():
             INSERT INTO scripture (version_id, book, chapter, verse, text, format_type)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (version_id, data['book'], data['chapter'], data['verse'], data['text'], format_type))
-        conn.commit()
         verse_id = cursor.lastrowid
+        # Make the new words searchable right away
+        concordance.index_verse(conn, verse_id, version_id, data['book'],
+                                int(data['chapter']), int(data['verse']), data['text'])
+        corpus_manifest.update_chapter(conn, version_id, data['book'], int(data['chapter']))
+        conn.commit()
         conn.close()
+        result_cache.invalidate(scripture_tag('book', canonical_book_name(data['book'])), scripture_tag('catalog'))
         return jsonify({'id': verse_id, 'message': 'Scripture added successfully'}), 201
     except sqlite3.IntegrityError:
         conn.close()
@@ -447,22 +1527,57 @@ def add_scripture():
 def add_topic():
     """Add a new topic"""
     data = request.json
-    conn = get_db()
-    cursor = conn.cursor()
+    parent_id = data.get('parent_id')
+    params = (data['name'], data.get('description', ''), parent_id)
+    
+    def insert(conn):
+        if parent_id is not None and not conn.execute(
+                'SELECT 1 FROM topics WHERE id = ?', (parent_id,)).fetchone():
+            raise LookupError('Parent topic not found')
+        return conn.execute('''
+            INSERT INTO topics (name, description, parent_id)
+            VALUES (?, ?, ?)
+        ''', params).lastrowid
     
     try:
-        cursor.execute('''
-            INSERT INTO topics (name, description)
-            VALUES (?, ?)
-        ''', (data['name'], data.get('description', '')))
-        conn.commit()
-        topic_id = cursor.lastrowid
-        conn.close()
+        topic_id = get_write_queue().execute(insert)
+        get_topic_suggestions().invalidate()
+        result_cache.invalidate(annotations_tag('topics'))
         return jsonify({'id': topic_id, 'message': 'Topic added successfully'}), 201
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Topic name already exists'}), 400
 
+@app.route('/api/topics/<int:topic_id>/parent', methods=['POST'])
+def move_topic(topic_id):
+    """Move a topic (and its subtree) under another topic, or to the top with parent_id null"""
+    data = request.json or {}
+    if 'parent_id' not in data:
+        return jsonify({'error': 'parent_id is required'}), 400
+    parent_id = data['parent_id']
+    
+    conn = get_db()
+    exists = conn.execute('SELECT 1 FROM topics WHERE id = ?', (topic_id,)).fetchone()
+    conn.close()
+    if not exists:
+        return jsonify({'error': 'Topic not found'}), 404
+    
+    def move(conn):
+        if parent_id is not None and not conn.execute(
+                'SELECT 1 FROM topics WHERE id = ?', (parent_id,)).fetchone():
+            raise LookupError('Parent topic not found')
+        conn.execute('UPDATE topics SET parent_id = ? WHERE id = ?', (parent_id, topic_id))
+    
+    try:
+        get_write_queue().execute(move)
+        result_cache.invalidate(annotations_tag('topics'))
+        return jsonify({'message': 'Topic moved successfully'})
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.IntegrityError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/scripture/<int:verse_id>/topics', methods=['POST'])
 def link_topic_to_verse(verse_id):
     """Link a topic to a scripture verse"""
@@ -472,19 +1587,25 @@ def link_topic_to_verse(verse_id):
     if not topic_id:
         return jsonify({'error': 'topic_id is required'}), 400
     
+    # Looked up on a read connection: workspace writers don't attach the corpus
     conn = get_db()
-    cursor = conn.cursor()
+    verse = conn.execute('SELECT book, chapter FROM scripture WHERE id = ?', (verse_id,)).fetchone()
+    conn.close()
     
-    try:
-        cursor.execute('''
+    def link(conn):
+        conn.execute('''
             INSERT INTO scripture_topics (scripture_id, topic_id)
             VALUES (?, ?)
         ''', (verse_id, topic_id))
-        conn.commit()
-        conn.close()
+    
+    try:
+        get_write_queue().execute(link)
+        get_topic_suggestions().invalidate()
+        topic_graph.mark_dirty()
+        if verse:
+            result_cache.invalidate(*chapter_tags(verse[0], verse[1]))
         return jsonify({'message': 'Topic linked successfully'}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'This relationship already exists'}), 400
 
 if __name__ == '__main__':
@@ -492,6 +1613,8 @@ if __name__ == '__main__':
     if not os.path.exists(app.config['DATABASE']) or not check_db_tables():
         init_db()
         print("Database initialized!")
+    else:
+        run_migrations(app.config['DATABASE'])
     
     # Run the app
     app.run(debug=True, host='0.0.0.0', port=5001)
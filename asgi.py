@@ -0,0 +1,355 @@
+"""
+ASGI entry point: the same API served from an event loop
+
+Every Flask route keeps its URL, JSON and headers: requests are handed to
+the WSGI app on a bounded thread pool. Reads (GET/HEAD) and writes get
+separate pools, so a burst of slow writes can't starve reads. A request
+waits for a free thread on the event loop rather than in a thread of its
+own; once ASGI_QUEUE_SIZE requests are waiting, or one has waited
+READ_QUEUE_TIMEOUT seconds, it gets the usual 503 with Retry-After.
+Streamed responses (topic exports) keep their thread until they finish,
+since their generators hold a SQLite connection; a slow reader pauses the
+generator through a small buffer rather than piling up chunks in memory.
+
+GET /api/events exists only here. It is a Server-Sent Events stream of
+result cache invalidations (which chapters, books or lists changed, for the
+requested workspace), so open viewers can refresh instead of polling. An
+idle subscriber is a parked coroutine and a small queue, so thousands of
+them need no threads.
+
+Usage:
+    pip install uvicorn
+    uvicorn asgi:app --port 5001
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from app import app as flask_app, check_db_tables, init_db, result_cache
+from annotations import valid_workspace
+from coalesce import Overloaded
+from migrations import run_migrations
+
+READ_METHODS = ('GET', 'HEAD')
+HEARTBEAT_SECONDS = 15
+EVENT_QUEUE_SIZE = 256
+# Response chunks buffered between a pool thread and a slow client
+STREAM_BUFFER = 8
+
+
+class ThreadGate:
+    """Bounded thread pool whose callers wait for a thread on the event loop"""
+
+    def __init__(self, workers, max_queue, timeout, name):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.rejected = 0
+
+    async def admit(self):
+        """Wait for a free thread, or raise Overloaded if the queue is full or the wait times out"""
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded()
+        finally:
+            self.waiting -= 1
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the thread admit() reserved; the future frees it when done"""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args):
+        await self._slots.acquire()
+        return await self.submit(fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class Subscriber:
+    """One /api/events client: the changes it still has to be sent"""
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.lost = False
+
+    def offer(self, tags):
+        if tags is None:
+            event = {'event': 'clear'}
+        else:
+            changes = []
+            for tag in tags:
+                if tag[0] == 'scripture':
+                    changes.append(list(tag))
+                elif tag[0] == 'annotations' and tag[1] == self.workspace:
+                    changes.append(['annotations'] + list(tag[2:]))
+            if not changes:
+                return
+            event = {'event': 'invalidate', 'changes': changes}
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind to replay; tell the client to refresh everything
+            self.lost = True
+
+    async def next_event(self):
+        if self.lost:
+            self.lost = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return {'event': 'clear'}
+        return await self.queue.get()
+
+
+class EventHub:
+    """Fans result cache invalidations out to the /api/events subscribers"""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self.loop = None
+        self.subscribers = set()
+
+    def publish(self, tags):
+        """Result cache listener; called from whichever thread did the write"""
+        if self.loop is not None and self.subscribers:
+            self.loop.call_soon_threadsafe(self._fan_out, tags)
+
+    def _fan_out(self, tags):
+        for subscriber in list(self.subscribers):
+            subscriber.offer(tags)
+
+
+read_gate = None
+write_gate = None
+events = EventHub(flask_app.config['ASGI_MAX_EVENT_CLIENTS'])
+result_cache.add_listener(events.publish)
+
+
+def prepare_database():
+    """Create or migrate the database, as python app.py does"""
+    database = flask_app.config['DATABASE']
+    if not os.path.exists(database) or not check_db_tables():
+        init_db()
+    else:
+        run_migrations(database, verbose=False)
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI http scope"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def run_wsgi(environ, loop, queue, stop):
+    """
+    Run the Flask app on a pool thread and hand its response to the event
+    loop through queue. A streamed response is iterated on this one thread
+    (its generator may hold a SQLite connection) and waits while the queue
+    is full, so a slow client slows the producer instead of buffering.
+    """
+    def emit(message):
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        emit(('start', int(status.split(' ', 1)[0]), headers))
+        return lambda data: None
+
+    try:
+        iterable = flask_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if stop.is_set():
+                    break
+                if chunk:
+                    emit(('body', chunk))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+    finally:
+        emit(('end',))
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                   + [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def serve_flask(scope, receive, send):
+    """Run one request through the Flask app on the read or write pool"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+
+    gate = read_gate if scope['method'] in READ_METHODS else write_gate
+    try:
+        await gate.admit()
+    except Overloaded:
+        await send_json(send, 503, {'error': 'Server is busy, please retry shortly'},
+                        [('Retry-After', str(flask_app.config['RETRY_AFTER']))])
+        return
+
+    queue = asyncio.Queue(STREAM_BUFFER)
+    stop = threading.Event()
+    job = gate.submit(run_wsgi, wsgi_environ(scope, body), asyncio.get_running_loop(), queue, stop)
+    started = False
+    try:
+        while True:
+            message = await queue.get()
+            if message[0] == 'start':
+                started = True
+                await send({
+                    'type': 'http.response.start',
+                    'status': message[1],
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in message[2]],
+                })
+            elif message[0] == 'body':
+                await send({'type': 'http.response.body', 'body': message[1], 'more_body': True})
+            else:
+                break
+        if started:
+            await send({'type': 'http.response.body', 'body': b''})
+        else:
+            await job  # Raises whatever stopped the app from answering
+    finally:
+        # Let the pool thread finish if the client went away mid-response
+        stop.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+async def stream_events(scope, receive, send):
+    """GET /api/events: Server-Sent Events of cache invalidations"""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    workspace = headers.get('x-workspace') or (query.get('workspace') or [None])[0]
+    if workspace and not valid_workspace(workspace):
+        await send_json(send, 400, {'error': 'workspace may only contain letters, digits, "-" and "_"'})
+        return
+    if len(events.subscribers) >= events.max_clients:
+        await send_json(send, 503, {'error': 'Too many event subscribers, please retry shortly'},
+                        [('Retry-After', str(flask_app.config['RETRY_AFTER']))])
+        return
+
+    subscriber = Subscriber(workspace)
+    events.subscribers.add(subscriber)
+
+    async def pump():
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.next_event(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                chunk = b': keep-alive\n\n'
+            else:
+                chunk = f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode('utf-8')
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    pumping = asyncio.ensure_future(pump())
+    try:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    finally:
+        pumping.cancel()
+        events.subscribers.discard(subscriber)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await read_gate.run(prepare_database)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            read_gate.shutdown()
+            write_gate.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    global read_gate, write_gate
+    if events.loop is None:
+        # Bound to the server's loop on first use
+        config = flask_app.config
+        events.loop = asyncio.get_running_loop()
+        read_gate = ThreadGate(config['ASGI_READ_WORKERS'], config['ASGI_QUEUE_SIZE'],
+                               config['READ_QUEUE_TIMEOUT'], 'asgi-read')
+        write_gate = ThreadGate(config['ASGI_WRITE_WORKERS'], config['ASGI_QUEUE_SIZE'],
+                                config['READ_QUEUE_TIMEOUT'], 'asgi-write')
+
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        if scope['path'] == '/api/events' and scope['method'] == 'GET':
+            await stream_events(scope, receive, send)
+        else:
+            await serve_flask(scope, receive, send)
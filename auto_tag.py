@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Rule-based auto-tagging
+
+A rule tags every match of a phrase (or a regular expression) with a topic,
+optionally limited to one version and/or one book. The corpus is scanned in
+parallel worker processes, one task per (version, book). Each match becomes
+a tag whose start and end positions are the first and last words it covers,
+using the same whitespace word split as the client. Tags are bulk-inserted
+in one transaction, skipping any that already exist for the same topic,
+version and range, so rerunning rules is safe.
+
+Usage:
+    python auto_tag.py add --topic-id 3 --pattern covenant [--regex] [--version WEB] [--book Genesis]
+    python auto_tag.py list
+    python auto_tag.py run [--rule-id N] [--workers N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bible_books import book_number, canonical_book_name, format_position, position_key
+from migrations import run_migrations
+from text_store import ChapterTextCache
+
+DATABASE = 'verseindex.db'
+
+# New tags are inserted and committed this many at a time, so the app's
+# writer is never locked out for a whole run
+INSERT_BATCH = 1000
+# Seconds to wait for the app's writer to release the database
+BUSY_TIMEOUT = 30
+
+_WORD_RE = re.compile(r'\S+')
+
+
+def compile_rule(pattern, is_regex):
+    """Compile a rule; plain phrases match whole words, case-insensitively"""
+    if not pattern or not pattern.strip():
+        raise ValueError('pattern is required')
+    if is_regex:
+        try:
+            return re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Invalid regular expression: {e}')
+    words = [re.escape(word) for word in pattern.split()]
+    return re.compile(r'(?<!\w)' + r'\s+'.join(words) + r'(?!\w)', re.IGNORECASE)
+
+
+def match_words(regex, text):
+    """Yield (first_word, last_word) indexes for every match in text"""
+    starts = [match.start() for match in _WORD_RE.finditer(text)]
+    if not starts:
+        return
+    for match in regex.finditer(text):
+        if match.end() == match.start():
+            continue
+        # A word contains offset i if it is the last word starting at or before i
+        first = _word_at(starts, match.start())
+        last = _word_at(starts, match.end() - 1)
+        yield first, last
+
+
+def _word_at(starts, offset):
+    low, high = 0, len(starts)
+    while low < high:
+        middle = (low + high) // 2
+        if starts[middle] <= offset:
+            low = middle + 1
+        else:
+            high = middle
+    return max(low - 1, 0)
+
+
+def _scan_partition(task):
+    """Worker: match every rule against one book of one version"""
+    database, version_id, version, book, rules = task
+    number = book_number(book)
+    if number is None:
+        return [], 0
+
+    compiled = [(topic_id, compile_rule(pattern, is_regex)) for topic_id, pattern, is_regex in rules]
+    conn = sqlite3.connect(database)
+    try:
+        texts = ChapterTextCache(max_chapters=1)
+        verses = [
+            (chapter, verse, texts.text(conn, version_id, book, chapter, verse, text))
+            for chapter, verse, text in conn.execute('''
+                SELECT chapter, verse, text FROM scripture
+                WHERE version_id = ? AND book = ?
+                ORDER BY chapter, verse
+            ''', (version_id, book)).fetchall()
+        ]
+    finally:
+        conn.close()
+
+    tags = []
+    for chapter, verse, text in verses:
+        for topic_id, regex in compiled:
+            for first, last in match_words(regex, text):
+                start_key = position_key(number, chapter, verse, first)
+                end_key = position_key(number, chapter, verse, last)
+                tags.append((topic_id, version, format_position(start_key),
+                             format_position(end_key), start_key, end_key))
+    return tags, len(verses)
+
+
+def load_rules(conn, rule_id=None):
+    query = 'SELECT id, topic_id, pattern, is_regex, version, book FROM tag_rules'
+    params = []
+    if rule_id is not None:
+        query += ' WHERE id = ?'
+        params.append(rule_id)
+    return conn.execute(query + ' ORDER BY id', params).fetchall()
+
+
+def add_rule(database, topic_id, pattern, is_regex=False, version=None, book=None):
+    """Validate and store a rule. Returns its id."""
+    compile_rule(pattern, is_regex)
+    if book:
+        if book_number(book) is None:
+            raise ValueError(f'Unknown book: {book}')
+        book = canonical_book_name(book)
+    conn = sqlite3.connect(database)
+    try:
+        if conn.execute('SELECT 1 FROM topics WHERE id = ?', (topic_id,)).fetchone() is None:
+            raise ValueError(f'Unknown topic: {topic_id}')
+        cursor = conn.execute('''
+            INSERT INTO tag_rules (topic_id, pattern, is_regex, version, book)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (topic_id, pattern, 1 if is_regex else 0, version or None, book or None))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def run_rules(database=DATABASE, rule_id=None, workers=None, progress=None):
+    """
+    Apply rules across the corpus and insert the new tags.
+
+    progress, if given, is called with (partitions_done, partitions_total).
+    Returns stats: rules, partitions, verses_scanned, matches, tags_created
+    and seconds.
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(database)
+    try:
+        rules = load_rules(conn, rule_id)
+        partitions = conn.execute('''
+            SELECT DISTINCT s.version_id, bv.abbreviation, s.book
+            FROM scripture s JOIN bible_versions bv ON bv.id = s.version_id
+        ''').fetchall()
+    finally:
+        conn.close()
+
+    tasks = []
+    for version_id, version, book in partitions:
+        applicable = [
+            (topic_id, pattern, is_regex)
+            for _, topic_id, pattern, is_regex, rule_version, rule_book in rules
+            if (rule_version is None or rule_version == version)
+            and (rule_book is None or rule_book == book)
+        ]
+        if applicable:
+            tasks.append((database, version_id, version, book, applicable))
+
+    tags = []
+    verses_scanned = 0
+    if tasks:
+        # spawn, not fork: callers may have other threads holding locks
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for index, (partition_tags, verses) in enumerate(pool.map(_scan_partition, tasks), 1):
+                tags.extend(partition_tags)
+                verses_scanned += verses
+                if progress:
+                    progress(index, len(tasks))
+
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+    try:
+        before = conn.total_changes
+        for start in range(0, len(tags), INSERT_BATCH):
+            conn.executemany('''
+                INSERT INTO scripture_tags
+                (topic_id, version, start_position, end_position, start_key, end_key)
+                SELECT ?1, ?2, ?3, ?4, ?5, ?6
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM scripture_tags
+                    WHERE topic_id = ?1 AND version = ?2 AND start_key = ?5 AND end_key = ?6
+                )
+            ''', tags[start:start + INSERT_BATCH])
+            conn.commit()
+        created = conn.total_changes - before
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'rules': len(rules),
+        'partitions': len(tasks),
+        'verses_scanned': verses_scanned,
+        'matches': len(tags),
+        'tags_created': created,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tag every match of a phrase or regex with a topic')
+    parser.add_argument('--database', default=DATABASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='add a rule')
+    add.add_argument('--topic-id', type=int, required=True)
+    add.add_argument('--pattern', required=True)
+    add.add_argument('--regex', action='store_true', help='treat the pattern as a regular expression')
+    add.add_argument('--version', help='only this version, e.g. WEB')
+    add.add_argument('--book', help='only this book')
+
+    commands.add_parser('list', help='list rules')
+
+    run = commands.add_parser('run', help='apply rules and create tags')
+    run.add_argument('--rule-id', type=int)
+    run.add_argument('--workers', type=int, help='worker processes (default: CPU count)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+    run_migrations(args.database)
+
+    if args.command == 'add':
+        try:
+            rule_id = add_rule(args.database, args.topic_id, args.pattern, args.regex, args.version, args.book)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Added rule {rule_id}.")
+    elif args.command == 'list':
+        conn = sqlite3.connect(args.database)
+        for rule_id, topic_id, pattern, is_regex, version, book in load_rules(conn):
+            kind = 'regex' if is_regex else 'phrase'
+            print(f"{rule_id:4d}  topic {topic_id}  {kind} {pattern!r}  "
+                  f"version={version or 'all'}  book={book or 'all'}")
+        conn.close()
+    else:
+        stats = run_rules(args.database, args.rule_id, args.workers)
+        print(f"Scanned {stats['verses_scanned']} verses in {stats['partitions']} book/version partitions "
+              f"with {stats['rules']} rule(s) in {stats['seconds']}s")
+        print(f"{stats['matches']} matches, {stats['tags_created']} new tags")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Online backups of the VerseIndex database
+
+Copies use sqlite3's backup API a few hundred pages at a time with a short
+sleep between steps, so the app keeps reading and writing while a backup
+runs and the copy is always consistent (never a torn file copy).
+
+A full snapshot is the whole database. An incremental snapshot is taken the
+same way but only the pages that changed since the previous snapshot are
+kept, using page hashes recorded in the backup directory's manifest.
+Snapshots can be gzip-compressed, and only the newest `keep` full snapshots
+(with the incrementals built on them) are retained.
+
+Usage:
+    python backup.py [--incremental] [--compress] [--keep N] [--dir backups]
+    python backup.py --list
+    python backup.py --restore backups/<snapshot> --output restored.db
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+DATABASE = 'verseindex.db'
+BACKUP_DIR = 'backups'
+MANIFEST = 'manifest.json'
+
+# Pages copied per backup step, and the pause between steps
+DEFAULT_PAGES = 256
+DEFAULT_SLEEP = 0.05
+
+# Full snapshots to keep (incrementals go with their full snapshot)
+DEFAULT_KEEP = 7
+
+
+def _open(path, mode):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+
+def load_manifest(backup_dir):
+    path = os.path.join(backup_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'snapshots': [], 'page_hashes': None}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(backup_dir, manifest):
+    path = os.path.join(backup_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def online_copy(database, target, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP, progress=None):
+    """Copy a live database to target in page-limited steps"""
+    source = sqlite3.connect(database)
+    destination = sqlite3.connect(target)
+    try:
+        source.backup(destination, pages=pages, sleep=sleep, progress=progress)
+        page_size = destination.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        destination.close()
+        source.close()
+    return page_size
+
+
+def _page_hashes(path, page_size):
+    hashes = []
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            hashes.append(hashlib.blake2b(page, digest_size=16).hexdigest())
+    return hashes
+
+
+def _write_incremental(copy_path, target, page_size, changed, page_count):
+    """Write a JSON header line followed by the changed pages"""
+    header = {'page_size': page_size, 'page_count': page_count, 'pages': changed}
+    with open(copy_path, 'rb') as source, _open(target, 'wb') as out:
+        out.write(json.dumps(header).encode() + b'\n')
+        for number in changed:
+            source.seek(number * page_size)
+            out.write(source.read(page_size))
+
+
+def create_backup(database=DATABASE, backup_dir=BACKUP_DIR, incremental=False, compress=False,
+                  keep=DEFAULT_KEEP, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP, progress=None):
+    """
+    Take a snapshot and rotate old ones. Returns the manifest entry.
+
+    incremental falls back to a full snapshot when there is nothing to build
+    on or the page size changed.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = load_manifest(backup_dir)
+    previous = manifest['snapshots'][-1] if manifest['snapshots'] else None
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    name = os.path.splitext(os.path.basename(database))[0]
+    copy_path = os.path.join(backup_dir, f'.{name}-{stamp}.partial')
+
+    try:
+        page_size = online_copy(database, copy_path, pages, sleep, progress)
+        hashes = _page_hashes(copy_path, page_size)
+
+        if incremental and previous and manifest['page_hashes'] and previous['page_size'] == page_size:
+            old = manifest['page_hashes']
+            changed = [i for i, h in enumerate(hashes) if i >= len(old) or old[i] != h]
+            filename = f'{name}-{stamp}.inc' + ('.gz' if compress else '')
+            _write_incremental(copy_path, os.path.join(backup_dir, filename), page_size, changed, len(hashes))
+            entry = {'file': filename, 'type': 'incremental', 'base': previous['file'],
+                     'pages_written': len(changed)}
+        else:
+            filename = f'{name}-{stamp}.db' + ('.gz' if compress else '')
+            if compress:
+                with open(copy_path, 'rb') as source, gzip.open(os.path.join(backup_dir, filename), 'wb') as out:
+                    shutil.copyfileobj(source, out)
+            else:
+                os.replace(copy_path, os.path.join(backup_dir, filename))
+            entry = {'file': filename, 'type': 'full', 'base': None, 'pages_written': len(hashes)}
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+
+    entry.update({
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'page_size': page_size,
+        'page_count': len(hashes),
+        'bytes': os.path.getsize(os.path.join(backup_dir, entry['file'])),
+    })
+    manifest['snapshots'].append(entry)
+    manifest['page_hashes'] = hashes
+    rotate(backup_dir, manifest, keep)
+    _save_manifest(backup_dir, manifest)
+    return entry
+
+
+def rotate(backup_dir, manifest, keep=DEFAULT_KEEP):
+    """Drop the oldest full snapshots, and their incrementals, beyond keep"""
+    fulls = [i for i, entry in enumerate(manifest['snapshots']) if entry['type'] == 'full']
+    keep = max(keep, 1)
+    if len(fulls) <= keep:
+        return []
+    cutoff = fulls[-keep]
+    removed = manifest['snapshots'][:cutoff]
+    for entry in removed:
+        path = os.path.join(backup_dir, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+    manifest['snapshots'] = manifest['snapshots'][cutoff:]
+    return removed
+
+
+def restore(backup_dir, snapshot_file, output):
+    """Rebuild the database as of a snapshot into output"""
+    snapshots = {entry['file']: entry for entry in load_manifest(backup_dir)['snapshots']}
+    if snapshot_file not in snapshots:
+        raise ValueError(f'{snapshot_file} is not in the backup manifest')
+
+    chain = []
+    entry = snapshots[snapshot_file]
+    while entry is not None:
+        chain.append(entry)
+        entry = snapshots.get(entry['base']) if entry['base'] else None
+    chain.reverse()
+    if chain[0]['type'] != 'full':
+        raise ValueError(f'The full snapshot under {snapshot_file} has been rotated away')
+
+    partial = output + '.partial'
+    with _open(os.path.join(backup_dir, chain[0]['file']), 'rb') as source, open(partial, 'wb') as out:
+        shutil.copyfileobj(source, out)
+
+    with open(partial, 'r+b') as out:
+        for entry in chain[1:]:
+            with _open(os.path.join(backup_dir, entry['file']), 'rb') as source:
+                header = json.loads(source.readline())
+                page_size = header['page_size']
+                for number in header['pages']:
+                    out.seek(number * page_size)
+                    out.write(source.read(page_size))
+                out.truncate(header['page_count'] * page_size)
+
+    os.replace(partial, output)
+    return len(chain)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up the VerseIndex database while it is in use')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--dir', default=BACKUP_DIR, help='backup directory')
+    parser.add_argument('--incremental', action='store_true', help='only store pages changed since the last snapshot')
+    parser.add_argument('--compress', action='store_true', help='gzip the snapshot')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='full snapshots to keep')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help='pages copied per step')
+    parser.add_argument('--sleep', type=float, default=DEFAULT_SLEEP, help='seconds between steps')
+    parser.add_argument('--list', action='store_true', help='list snapshots')
+    parser.add_argument('--restore', metavar='SNAPSHOT', help='restore a snapshot from --dir')
+    parser.add_argument('--output', help='where to write the restored database')
+    args = parser.parse_args()
+
+    if args.list:
+        for entry in load_manifest(args.dir)['snapshots']:
+            print(f"{entry['created_at']}  {entry['type']:<11}  {entry['bytes']:>12} bytes  {entry['file']}")
+        return 0
+
+    if args.restore:
+        if not args.output:
+            print("--output is required with --restore")
+            return 1
+        if os.path.exists(args.output):
+            print(f"{args.output} already exists; not overwriting it")
+            return 1
+        try:
+            steps = restore(args.dir, os.path.basename(args.restore), args.output)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Restored {args.output} from {steps} snapshot(s).")
+        return 0
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+
+    started = time.monotonic()
+
+    def progress(status, remaining, total):
+        print(f"\r  {total - remaining}/{total} pages", end='', flush=True)
+
+    entry = create_backup(args.database, args.dir, args.incremental, args.compress,
+                          args.keep, args.pages, args.sleep, progress)
+    print(f"\nWrote {entry['file']} ({entry['type']}, {entry['pages_written']} of "
+          f"{entry['page_count']} pages) in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
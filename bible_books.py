@@ -0,0 +1,336 @@
+"""
+Canonical Bible book table and scripture reference parser
+
+Every part of the app that needs a book name, abbreviation or chapter count
+should look it up here instead of keeping its own list.
+"""
+
+import re
+from collections import namedtuple
+
+Book = namedtuple('Book', ['number', 'name', 'abbreviation', 'chapters', 'testament', 'aliases'])
+
+# A resolved range of verses. end_verse is None when the range runs to the
+# end of end_chapter (whole-chapter references like "Rom 8").
+PassageRange = namedtuple('PassageRange', ['book', 'start_chapter', 'start_verse', 'end_chapter', 'end_verse'])
+
+# Highest verse number used when a range runs to the end of a chapter
+MAX_VERSE = 999
+
+# (name, abbreviation used in tag positions, chapter count, extra aliases)
+# The abbreviation is what the client writes into "Gen 1:1.0" style
+# positions, so it must never change for an existing book.
+_BOOK_DATA = [
+    # Old Testament
+    ('Genesis', 'Gen', 50, ['Ge', 'Gn']),
+    ('Exodus', 'Ex', 40, ['Exo', 'Exod']),
+    ('Leviticus', 'Lev', 27, ['Le', 'Lv']),
+    ('Numbers', 'Num', 36, ['Nu', 'Nm', 'Nb']),
+    ('Deuteronomy', 'Deut', 34, ['Dt', 'De']),
+    ('Joshua', 'Josh', 24, ['Jos', 'Jsh']),
+    ('Judges', 'Judg', 21, ['Jdg', 'Jg', 'Jdgs']),
+    ('Ruth', 'Ruth', 4, ['Rth', 'Ru']),
+    ('1 Samuel', '1 Sam', 31, ['1 Sa', '1 Sm', '1 S']),
+    ('2 Samuel', '2 Sam', 24, ['2 Sa', '2 Sm', '2 S']),
+    ('1 Kings', '1 Kgs', 22, ['1 Ki', '1 Kin', '1 K']),
+    ('2 Kings', '2 Kgs', 25, ['2 Ki', '2 Kin', '2 K']),
+    ('1 Chronicles', '1 Chr', 29, ['1 Ch', '1 Chron']),
+    ('2 Chronicles', '2 Chr', 36, ['2 Ch', '2 Chron']),
+    ('Ezra', 'Ezra', 10, ['Ezr']),
+    ('Nehemiah', 'Neh', 13, ['Ne']),
+    ('Esther', 'Esth', 10, ['Est', 'Es']),
+    ('Job', 'Job', 42, ['Jb']),
+    ('Psalms', 'Ps', 150, ['Psalm', 'Psa', 'Pss', 'Psm']),
+    ('Proverbs', 'Prov', 31, ['Pro', 'Prv', 'Pr']),
+    ('Ecclesiastes', 'Eccl', 12, ['Ecc', 'Eccles', 'Qoh']),
+    ('Song of Songs', 'Song', 8, ['Song of Solomon', 'Canticles', 'SOS', 'Sng']),
+    ('Isaiah', 'Isa', 66, ['Is']),
+    ('Jeremiah', 'Jer', 52, ['Je', 'Jr']),
+    ('Lamentations', 'Lam', 5, ['La']),
+    ('Ezekiel', 'Ezek', 48, ['Eze', 'Ezk']),
+    ('Daniel', 'Dan', 12, ['Da', 'Dn']),
+    ('Hosea', 'Hos', 14, ['Ho']),
+    ('Joel', 'Joel', 3, ['Jl']),
+    ('Amos', 'Amos', 9, ['Am']),
+    ('Obadiah', 'Obad', 1, ['Ob']),
+    ('Jonah', 'Jonah', 4, ['Jnh', 'Jon']),
+    ('Micah', 'Mic', 7, ['Mc']),
+    ('Nahum', 'Nah', 3, ['Na']),
+    ('Habakkuk', 'Hab', 3, ['Hb']),
+    ('Zephaniah', 'Zeph', 3, ['Zep', 'Zp']),
+    ('Haggai', 'Hag', 2, ['Hg']),
+    ('Zechariah', 'Zech', 14, ['Zec', 'Zc']),
+    ('Malachi', 'Mal', 4, ['Ml']),
+    # New Testament
+    ('Matthew', 'Matt', 28, ['Mt', 'Mat']),
+    ('Mark', 'Mark', 16, ['Mk', 'Mrk', 'Mr']),
+    ('Luke', 'Luke', 24, ['Lk', 'Luk']),
+    ('John', 'John', 21, ['Jn', 'Jhn']),
+    ('Acts', 'Acts', 28, ['Ac', 'Act']),
+    ('Romans', 'Rom', 16, ['Ro', 'Rm']),
+    ('1 Corinthians', '1 Cor', 16, ['1 Co']),
+    ('2 Corinthians', '2 Cor', 13, ['2 Co']),
+    ('Galatians', 'Gal', 6, ['Ga']),
+    ('Ephesians', 'Eph', 6, ['Ephes']),
+    ('Philippians', 'Phil', 4, ['Php']),
+    ('Colossians', 'Col', 4, ['Co']),
+    ('1 Thessalonians', '1 Thess', 5, ['1 Th', '1 Thes']),
+    ('2 Thessalonians', '2 Thess', 3, ['2 Th', '2 Thes']),
+    ('1 Timothy', '1 Tim', 6, ['1 Ti']),
+    ('2 Timothy', '2 Tim', 4, ['2 Ti']),
+    ('Titus', 'Titus', 3, ['Tit']),
+    ('Philemon', 'Phlm', 1, ['Philem', 'Phm']),
+    ('Hebrews', 'Heb', 13, []),
+    ('James', 'James', 5, ['Jas', 'Jm']),
+    ('1 Peter', '1 Pet', 5, ['1 Pe', '1 Pt', '1 P']),
+    ('2 Peter', '2 Pet', 3, ['2 Pe', '2 Pt', '2 P']),
+    ('1 John', '1 John', 5, ['1 Jn', '1 Jhn', '1 Jo']),
+    ('2 John', '2 John', 1, ['2 Jn', '2 Jhn', '2 Jo']),
+    ('3 John', '3 John', 1, ['3 Jn', '3 Jhn', '3 Jo']),
+    ('Jude', 'Jude', 1, ['Jd']),
+    ('Revelation', 'Rev', 22, ['Re', 'Rv', 'Apocalypse']),
+]
+
+OLD_TESTAMENT_BOOKS = 39
+
+BOOKS = [
+    Book(index + 1, name, abbr, chapters, 'OT' if index < OLD_TESTAMENT_BOOKS else 'NT', tuple(aliases))
+    for index, (name, abbr, chapters, aliases) in enumerate(_BOOK_DATA)
+]
+
+BOOKS_BY_NAME = {book.name: book for book in BOOKS}
+BOOKS_BY_ABBREVIATION = {book.abbreviation: book for book in BOOKS}
+
+# Leading ordinals written as words or roman numerals ("First John", "II Kings")
+_ORDINALS = {
+    'first': '1', '1st': '1', 'i': '1',
+    'second': '2', '2nd': '2', 'ii': '2',
+    'third': '3', '3rd': '3', 'iii': '3',
+}
+
+
+def _normalize(text):
+    """Fold a book name or alias to the key used by the alias trie"""
+    words = text.lower().replace('.', ' ').split()
+    if len(words) > 1 and words[0] in _ORDINALS:
+        words[0] = _ORDINALS[words[0]]
+    return ''.join(words)
+
+
+class _TrieNode:
+    __slots__ = ('children', 'book', 'reachable')
+
+    def __init__(self):
+        self.children = {}
+        self.book = None          # Book whose alias ends exactly here
+        self.reachable = set()    # Book numbers of every alias passing through
+
+
+def _build_trie():
+    """Compile every book name and alias into a character trie"""
+    root = _TrieNode()
+    for book in BOOKS:
+        for alias in (book.name, book.abbreviation) + book.aliases:
+            node = root
+            for char in _normalize(alias):
+                node = node.children.setdefault(char, _TrieNode())
+                node.reachable.add(book.number)
+            node.book = book
+    return root
+
+
+_TRIE = _build_trie()
+
+
+def find_book(text):
+    """
+    Resolve a book name, abbreviation or unambiguous prefix to a Book.
+
+    Exact aliases win over prefixes, so "Phil" is Philippians even though it
+    is also a prefix of Philemon. Returns None when the text is unknown or
+    ambiguous (e.g. "Jud" could be Judges or Jude).
+    """
+    node = _TRIE
+    for char in _normalize(text):
+        node = node.children.get(char)
+        if node is None:
+            return None
+    if node.book is not None:
+        return node.book
+    if len(node.reachable) == 1:
+        return BOOKS[next(iter(node.reachable)) - 1]
+    return None
+
+
+def book_abbreviation(book_name):
+    """Get the position-string abbreviation for a book name"""
+    book = BOOKS_BY_NAME.get(book_name) or find_book(book_name)
+    if book:
+        return book.abbreviation
+    return book_name[:4]
+
+
+def canonical_book_name(book_name):
+    """Map an alias such as "Song of Solomon" to the name stored in scripture"""
+    book = BOOKS_BY_NAME.get(book_name) or find_book(book_name)
+    return book.name if book else book_name
+
+
+def book_number(book_name):
+    """Canonical number (1-66) of a stored or aliased book name, or None"""
+    book = BOOKS_BY_NAME.get(book_name) or find_book(book_name)
+    return book.number if book else None
+
+
+# "<book> <location>" where the book may start with a number ("1 Jn") and the
+# location is everything from the first chapter digit onwards
+_SEGMENT_RE = re.compile(r'^\s*(?P<book>(?:[1-3]\s*)?[^\W\d_][^\d:;,]*)?(?P<location>\d[^;]*)?$')
+_PART_RE = re.compile(r'^(\d+)(?::(\d+))?(?:\s*[-–—]\s*(\d+)(?::(\d+))?)?$')
+
+
+def _make_range(book, start_chapter, start_verse, end_chapter, end_verse, reference):
+    if start_chapter < 1 or end_chapter > book.chapters:
+        raise ValueError(f'{book.name} has {book.chapters} chapter{"s" if book.chapters != 1 else ""}: "{reference}"')
+    if (end_chapter, end_verse or MAX_VERSE) < (start_chapter, start_verse):
+        raise ValueError(f'Range ends before it starts: "{reference}"')
+    return PassageRange(book.name, start_chapter, start_verse, end_chapter, end_verse)
+
+
+def parse_reference(reference):
+    """
+    Parse a scripture reference into a list of PassageRange.
+
+    Accepts any mix of whole chapters, chapter ranges, verses and verse
+    ranges, e.g. "Jn 3:16-4:2; Rom 8", "Gen 1:1, 3-5; 2", "1 Cor 13".
+    Segments are separated by ";" and may omit the book to reuse the
+    previous one. Commas continue within the current book and chapter.
+    Raises ValueError for unknown books or malformed locations.
+    """
+    ranges = []
+    book = None
+
+    for segment in reference.split(';'):
+        if not segment.strip():
+            continue
+
+        match = _SEGMENT_RE.match(segment)
+        if not match or not match.group('location'):
+            raise ValueError(f'Missing chapter in "{segment.strip()}"')
+
+        book_text = (match.group('book') or '').strip()
+        if book_text:
+            book = find_book(book_text)
+            if book is None:
+                raise ValueError(f'Unknown or ambiguous book "{book_text}"')
+        elif book is None:
+            raise ValueError(f'No book given for "{segment.strip()}"')
+
+        chapter = None
+        verse_mode = False
+        for part in match.group('location').split(','):
+            part = part.strip()
+            parsed = _PART_RE.match(part)
+            if not parsed:
+                raise ValueError(f'Malformed location "{part}"')
+            first, first_verse, second, second_verse = (
+                int(value) if value else None for value in parsed.groups()
+            )
+
+            if first_verse is None and (verse_mode or book.chapters == 1) and second_verse is None:
+                # Bare verse numbers: "Jn 3:16, 18-20" or single-chapter "Jude 3"
+                if chapter is None:
+                    chapter = 1
+                ranges.append(_make_range(book, chapter, first, chapter, second or first, part))
+                verse_mode = True
+            elif first_verse is None and second_verse is None:
+                # Whole chapters: "Rom 8" or "Rom 8-9"
+                ranges.append(_make_range(book, first, 1, second or first, None, part))
+                chapter = second or first
+                verse_mode = False
+            elif first_verse is None:
+                # "3-4:2" runs from the start of chapter 3
+                ranges.append(_make_range(book, first, 1, second, second_verse, part))
+                chapter = second
+                verse_mode = True
+            elif second_verse is None:
+                # "3:16" or "3:16-18"
+                ranges.append(_make_range(book, first, first_verse, first, second or first_verse, part))
+                chapter = first
+                verse_mode = True
+            else:
+                # "3:16-4:2"
+                ranges.append(_make_range(book, first, first_verse, second, second_verse, part))
+                chapter = second
+                verse_mode = True
+
+    if not ranges:
+        raise ValueError('Empty reference')
+    return ranges
+
+
+def format_range(passage):
+    """Format a PassageRange back into a readable reference"""
+    start = f'{passage.start_chapter}:{passage.start_verse}'
+    if passage.end_verse is None:
+        if passage.start_verse == 1:
+            if passage.start_chapter == passage.end_chapter:
+                return f'{passage.book} {passage.start_chapter}'
+            return f'{passage.book} {passage.start_chapter}-{passage.end_chapter}'
+        return f'{passage.book} {start}-{passage.end_chapter}:end'
+    if passage.start_chapter == passage.end_chapter:
+        if passage.start_verse == passage.end_verse:
+            return f'{passage.book} {start}'
+        return f'{passage.book} {start}-{passage.end_verse}'
+    return f'{passage.book} {start}-{passage.end_chapter}:{passage.end_verse}'
+
+
+def chapters_between(start_book, start_chapter, end_book, end_chapter):
+    """(Book, chapter) for every chapter from the start to the end, inclusive, in canonical order"""
+    for book in BOOKS[start_book.number - 1:end_book.number]:
+        first = start_chapter if book is start_book else 1
+        last = end_chapter if book is end_book else book.chapters
+        for chapter in range(first, last + 1):
+            yield book, chapter
+
+
+# Tag positions look like "Gen 1:18.8" (book abbreviation chapter:verse.word)
+_POSITION_RE = re.compile(r'^\s*(.+?)\s+(\d+):(\d+)\.(\d+)\s*$')
+
+
+def position_key(book_number, chapter, verse, word=0):
+    """
+    Pack a word position into one integer that sorts in canonical order.
+
+    Each of chapter, verse and word gets three decimal digits, which is
+    plenty (Psalms has 150 chapters, Psalm 119 has 176 verses).
+    """
+    return ((book_number * 1000 + chapter) * 1000 + verse) * 1000 + word
+
+
+def parse_position(position):
+    """Parse "Gen 1:1.0" into (Book, chapter, verse, word), or None"""
+    match = _POSITION_RE.match(position or '')
+    if not match:
+        return None
+    abbr = match.group(1)
+    book = BOOKS_BY_ABBREVIATION.get(abbr) or find_book(abbr)
+    if book is None:
+        return None
+    return book, int(match.group(2)), int(match.group(3)), int(match.group(4))
+
+
+def position_string_key(position):
+    """Numeric key for a position string, or None if it can't be parsed"""
+    parsed = parse_position(position)
+    if parsed is None:
+        return None
+    book, chapter, verse, word = parsed
+    return position_key(book.number, chapter, verse, word)
+
+
+def format_position(key):
+    """Turn a numeric position key back into a "Gen 1:1.0" string"""
+    key, word = divmod(key, 1000)
+    key, verse = divmod(key, 1000)
+    book_number, chapter = divmod(key, 1000)
+    return f'{BOOKS[book_number - 1].abbreviation} {chapter}:{verse}.{word}'
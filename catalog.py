@@ -0,0 +1,109 @@
+"""
+Book/chapter/verse-count catalog of the loaded scripture
+
+scripture_catalog holds one row per (version, book, chapter) with the number
+of verses loaded for it. Triggers on scripture keep it in step with inserts,
+deletes and rows moving between chapters, so every loader (the app, the
+download scripts, sample data, manifest re-fetches) maintains it without
+extra code, and the navigator never has to scan scripture.
+"""
+
+from bible_books import BOOKS, book_number
+
+CATALOG_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS scripture_catalog (
+        version_id INTEGER NOT NULL,
+        book TEXT NOT NULL,
+        chapter INTEGER NOT NULL,
+        verse_count INTEGER NOT NULL,
+        PRIMARY KEY (version_id, book, chapter)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS scripture_catalog_insert
+    AFTER INSERT ON scripture
+    BEGIN
+        INSERT INTO scripture_catalog (version_id, book, chapter, verse_count)
+        VALUES (NEW.version_id, NEW.book, NEW.chapter, 1)
+        ON CONFLICT (version_id, book, chapter) DO UPDATE SET verse_count = verse_count + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS scripture_catalog_delete
+    AFTER DELETE ON scripture
+    BEGIN
+        UPDATE scripture_catalog SET verse_count = verse_count - 1
+        WHERE version_id = OLD.version_id AND book = OLD.book AND chapter = OLD.chapter;
+        DELETE FROM scripture_catalog
+        WHERE version_id = OLD.version_id AND book = OLD.book AND chapter = OLD.chapter AND verse_count <= 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS scripture_catalog_move
+    AFTER UPDATE OF version_id, book, chapter ON scripture
+    BEGIN
+        UPDATE scripture_catalog SET verse_count = verse_count - 1
+        WHERE version_id = OLD.version_id AND book = OLD.book AND chapter = OLD.chapter;
+        DELETE FROM scripture_catalog
+        WHERE version_id = OLD.version_id AND book = OLD.book AND chapter = OLD.chapter AND verse_count <= 0;
+        INSERT INTO scripture_catalog (version_id, book, chapter, verse_count)
+        VALUES (NEW.version_id, NEW.book, NEW.chapter, 1)
+        ON CONFLICT (version_id, book, chapter) DO UPDATE SET verse_count = verse_count + 1;
+    END
+    ''',
+]
+
+
+def ensure_catalog(conn):
+    """Create scripture_catalog and its triggers, filling it if it is missing rows"""
+    for statement in CATALOG_SCHEMA:
+        conn.execute(statement)
+    catalogued = conn.execute('SELECT COALESCE(SUM(verse_count), 0) FROM scripture_catalog').fetchone()[0]
+    if catalogued != conn.execute('SELECT COUNT(*) FROM scripture').fetchone()[0]:
+        rebuild_catalog(conn)
+
+
+def rebuild_catalog(conn):
+    """Recompute scripture_catalog from scripture"""
+    conn.execute('DELETE FROM scripture_catalog')
+    conn.execute('''
+        INSERT INTO scripture_catalog (version_id, book, chapter, verse_count)
+        SELECT version_id, book, chapter, COUNT(*) FROM scripture
+        GROUP BY version_id, book, chapter
+    ''')
+
+
+def _book_order(book):
+    number = book_number(book)
+    return (number is None, number or 0, book)
+
+
+def version_catalog(conn, version_id=None):
+    """
+    Loaded books in canonical order, each with its chapters and their verse
+    counts. Without a version_id a chapter counts the most verses any
+    version has for it.
+    """
+    query = 'SELECT book, chapter, MAX(verse_count) FROM scripture_catalog'
+    params = []
+    if version_id is not None:
+        query += ' WHERE version_id = ?'
+        params.append(version_id)
+    query += ' GROUP BY book, chapter ORDER BY book, chapter'
+
+    chapters_by_book = {}
+    for book, chapter, verse_count in conn.execute(query, params):
+        chapters_by_book.setdefault(book, []).append({'chapter': chapter, 'verses': verse_count})
+
+    catalog = []
+    for name in sorted(chapters_by_book, key=_book_order):
+        number = book_number(name)
+        book = BOOKS[number - 1] if number else None
+        catalog.append({
+            'name': name,
+            'abbreviation': book.abbreviation if book else name[:4],
+            'testament': book.testament if book else None,
+            'chapters': chapters_by_book[name]
+        })
+    return catalog
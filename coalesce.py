@@ -0,0 +1,111 @@
+"""
+Single-flight request coalescing and admission control
+
+When a chapter link is shared, hundreds of identical reads can arrive at
+once. SingleFlight lets the first request for a key (the leader) do the
+work while identical requests that arrive before it finishes wait for, and
+share, its result. AdmissionLimiter bounds how many leaders run queries at
+the same time; callers queue for a free slot for a limited time, and once
+the queue is full or the wait runs out they get Overloaded, which the app
+turns into a 503 with Retry-After rather than piling up more threads.
+"""
+
+import threading
+from contextlib import contextmanager
+
+DEFAULT_MAX_CONCURRENT = 16
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_TIMEOUT = 5.0
+
+
+class Overloaded(Exception):
+    """Raised when no slot frees up in time or the wait queue is full"""
+
+
+class AdmissionLimiter:
+    """Counting semaphore with a bounded wait queue and a wait timeout"""
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, max_queue=DEFAULT_MAX_QUEUE,
+                 timeout=DEFAULT_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the block"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded('Too many requests waiting')
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise Overloaded('Timed out waiting for a free slot')
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Run one computation per key at a time and share it with concurrent callers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, compute, timeout=None):
+        """
+        Return (result, shared) for key, computing it only if no identical
+        call is already running. Errors from the leader are raised in every
+        caller. A follower that waits longer than timeout gets Overloaded.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.followers += 1
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise Overloaded('Timed out waiting for an identical request')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Later arrivals start a fresh computation and see fresh data
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Merge overlapping or adjacent tags that share a topic and version
+
+Users often tag the same passage to the same topic several times with
+slightly different word bounds. For each (topic, version) this sorts the
+tags by numeric start position and merges any that overlap or touch in one
+linear sweep, keeping the earliest tag of each run and widening it to cover
+the merged range.
+
+Usage:
+    python compact_tags.py [--topic-id N] [--version WEB] [--dry-run]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+from migrations import run_migrations
+
+DATABASE = 'verseindex.db'
+
+# Rows updated or deleted per transaction
+DEFAULT_BATCH_SIZE = 1000
+
+
+def plan_merges(tags):
+    """
+    Sweep tags sorted by (start_key, end_key) and work out the merges.
+
+    tags are (id, start_key, end_key, start_position, end_position) tuples.
+    Two tags merge when the second starts at or before the word right after
+    the first ends. Returns (updates, deletes): updates are parameters for
+    widening the kept tag, deletes are ids of tags folded into it.
+    """
+    updates = []
+    deletes = []
+    current = None  # [id, start_key, end_key, start_position, end_position, widened]
+
+    def flush():
+        if current and current[5]:
+            updates.append((current[3], current[4], current[1], current[2], current[0]))
+
+    for tag_id, start_key, end_key, start_position, end_position in tags:
+        if current is not None and start_key <= current[2] + 1:
+            deletes.append(tag_id)
+            if end_key > current[2]:
+                current[2] = end_key
+                current[4] = end_position
+                current[5] = True
+            continue
+        flush()
+        current = [tag_id, start_key, end_key, start_position, end_position, False]
+    flush()
+
+    return updates, deletes
+
+
+def _apply(conn, updates, deletes):
+    if updates:
+        conn.executemany('''
+            UPDATE scripture_tags
+            SET start_position = ?, end_position = ?, start_key = ?, end_key = ?
+            WHERE id = ?
+        ''', updates)
+    if deletes:
+        conn.executemany('DELETE FROM scripture_tags WHERE id = ?', [(i,) for i in deletes])
+    conn.commit()
+
+
+def compact_tags(database=DATABASE, topic_id=None, version=None,
+                 batch_size=DEFAULT_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Compact tags for every (topic, version), or only the ones given.
+
+    Changes are committed in batches of roughly batch_size rows so other
+    writers are never locked out for long. Tags without a topic or with an
+    unparseable position are left alone. progress, if given, is called
+    with (groups_done, groups_total). Returns a stats dict.
+    """
+    conn = sqlite3.connect(database)
+    stats = {'groups': 0, 'tags_scanned': 0, 'rows_removed': 0, 'rows_updated': 0}
+
+    try:
+        query = '''
+            SELECT DISTINCT topic_id, version FROM scripture_tags
+            WHERE topic_id IS NOT NULL AND start_key IS NOT NULL
+        '''
+        params = []
+        if topic_id is not None:
+            query += ' AND topic_id = ?'
+            params.append(topic_id)
+        if version is not None:
+            query += ' AND version = ?'
+            params.append(version)
+        groups = conn.execute(query, params).fetchall()
+
+        pending_updates = []
+        pending_deletes = []
+        for index, (group_topic, group_version) in enumerate(groups, 1):
+            tags = conn.execute('''
+                SELECT id, start_key, end_key, start_position, end_position
+                FROM scripture_tags
+                WHERE topic_id = ? AND version = ?
+                  AND start_key IS NOT NULL AND end_key >= start_key
+                ORDER BY start_key, end_key, id
+            ''', (group_topic, group_version)).fetchall()
+
+            updates, deletes = plan_merges(tags)
+            stats['groups'] += 1
+            stats['tags_scanned'] += len(tags)
+            stats['rows_removed'] += len(deletes)
+            stats['rows_updated'] += len(updates)
+
+            if not dry_run:
+                pending_updates.extend(updates)
+                pending_deletes.extend(deletes)
+                if len(pending_updates) + len(pending_deletes) >= batch_size:
+                    _apply(conn, pending_updates, pending_deletes)
+                    pending_updates, pending_deletes = [], []
+
+            if progress:
+                progress(index, len(groups))
+
+        if not dry_run:
+            _apply(conn, pending_updates, pending_deletes)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge overlapping tags per topic and version')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--topic-id', type=int)
+    parser.add_argument('--version', help='version abbreviation, e.g. WEB')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+
+    # Tags need their numeric position keys (migration 3) before sorting
+    run_migrations(args.database)
+
+    stats = compact_tags(args.database, args.topic_id, args.version,
+                         batch_size=args.batch_size, dry_run=args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    print(f"Scanned {stats['tags_scanned']} tags in {stats['groups']} topic/version groups")
+    print(f"{action} {stats['rows_removed']} tags, widened {stats['rows_updated']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
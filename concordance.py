@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Concordance: inverted word index with positional postings
+
+For every version, each normalized word maps to the sorted list of places it
+occurs. A place is the word's position key (see bible_books.position_key),
+so it converts straight back to the "Gen 1:1.3" position strings tags use.
+Words are split exactly like the client does (runs of non-whitespace), so
+word indexes line up with what the UI shows.
+
+Postings are stored as delta-encoded varints in one BLOB per
+(version, word). A full build replaces them; verses added afterwards are
+indexed into concordance_pending right away and folded in on the next
+build, so lookups are never missing new text.
+
+Usage:
+    python concordance.py [--version-id N]   # rebuild the index
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import string
+import sys
+
+from bible_books import BOOKS, book_number, format_position, position_key
+from migrations import run_migrations
+from text_store import ChapterTextCache
+
+DATABASE = 'verseindex.db'
+
+_WORD_RE = re.compile(r'\S+')
+_STRIP = string.punctuation + '“”‘’«»—–…'
+
+
+def normalize_word(word):
+    """Case-fold a word and trim surrounding punctuation ("world," -> "world")"""
+    return word.strip(_STRIP).casefold()
+
+
+def tokenize(text):
+    """Yield (word_index, normalized_word) using the client's word split"""
+    for index, match in enumerate(_WORD_RE.finditer(text)):
+        word = normalize_word(match.group())
+        if word:
+            yield index, word
+
+
+def encode_postings(keys):
+    """Delta-encode ascending position keys as LEB128 varints"""
+    out = bytearray()
+    previous = 0
+    for key in keys:
+        delta = key - previous
+        previous = key
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data):
+    """Inverse of encode_postings"""
+    keys = []
+    previous = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += value
+            keys.append(previous)
+            value = shift = 0
+    return keys
+
+
+def index_verse(conn, scripture_id, version_id, book, chapter, verse, text):
+    """Add one newly inserted verse to the pending postings (caller commits)"""
+    number = book_number(book)
+    if number is None:
+        return
+    conn.executemany('''
+        INSERT INTO concordance_pending (version_id, word, position_key, scripture_id)
+        VALUES (?, ?, ?, ?)
+    ''', [
+        (version_id, word, position_key(number, chapter, verse, index), scripture_id)
+        for index, word in tokenize(text)
+    ])
+
+
+def build_concordance(database=DATABASE, version_id=None, verbose=False, progress=None):
+    """
+    Rebuild postings for one version or all of them.
+
+    Each version is read in one pass and written in one transaction. Verses
+    added while a build runs stay in concordance_pending because only
+    pending rows up to the highest scripture id that was read are cleared.
+    progress, if given, is called with (versions_done, versions_total).
+    Returns {version_id: number_of_distinct_words}.
+    """
+    conn = sqlite3.connect(database)
+    results = {}
+    try:
+        if version_id is None:
+            version_ids = [row[0] for row in conn.execute('SELECT id FROM bible_versions ORDER BY id')]
+        else:
+            version_ids = [version_id]
+
+        for vid in version_ids:
+            max_id = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM scripture WHERE version_id = ?', (vid,)
+            ).fetchone()[0]
+
+            postings = {}
+            verses = 0
+            texts = ChapterTextCache(max_chapters=8)
+            cursor = conn.execute('''
+                SELECT book, chapter, verse, text FROM scripture
+                WHERE version_id = ? AND id <= ?
+            ''', (vid, max_id))
+            for book, chapter, verse, text in cursor:
+                number = book_number(book)
+                if number is None:
+                    continue
+                text = texts.text(conn, vid, book, chapter, verse, text)
+                base = position_key(number, chapter, verse)
+                for index, word in tokenize(text):
+                    postings.setdefault(word, []).append(base + index)
+                verses += 1
+
+            rows = []
+            for word, keys in postings.items():
+                keys.sort()
+                rows.append((vid, word, len(keys), encode_postings(keys)))
+
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM concordance_postings WHERE version_id = ?', (vid,))
+            conn.executemany('''
+                INSERT INTO concordance_postings (version_id, word, occurrences, postings)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            conn.execute(
+                'DELETE FROM concordance_pending WHERE version_id = ? AND scripture_id <= ?',
+                (vid, max_id)
+            )
+            conn.commit()
+
+            results[vid] = len(rows)
+            if verbose:
+                print(f"Version {vid}: {verses} verses, {len(rows)} distinct words")
+            if progress:
+                progress(len(results), len(version_ids))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return results
+
+
+def lookup(conn, word, version_id=None):
+    """
+    Get every occurrence of a word, grouped by version.
+
+    Returns a list of {version_id, keys} with keys sorted in canonical order,
+    merging built postings with any pending ones.
+    """
+    normalized = normalize_word(word)
+    query = 'SELECT version_id, postings FROM concordance_postings WHERE word = ?'
+    pending_query = 'SELECT version_id, position_key FROM concordance_pending WHERE word = ?'
+    params = [normalized]
+    if version_id is not None:
+        query += ' AND version_id = ?'
+        pending_query += ' AND version_id = ?'
+        params.append(version_id)
+
+    keys_by_version = {}
+    for vid, postings in conn.execute(query, params):
+        keys_by_version[vid] = decode_postings(postings)
+
+    pending = {}
+    for vid, key in conn.execute(pending_query, params):
+        pending.setdefault(vid, set()).add(key)
+    for vid, keys in pending.items():
+        merged = set(keys_by_version.get(vid, []))
+        merged.update(keys)
+        keys_by_version[vid] = sorted(merged)
+
+    return [{'version_id': vid, 'keys': keys} for vid, keys in sorted(keys_by_version.items())]
+
+
+def counts_by_book(keys):
+    """Count occurrences per book for a sorted key list, in canonical order"""
+    counts = {}
+    for key in keys:
+        number = key // 1_000_000_000
+        counts[number] = counts.get(number, 0) + 1
+    return [
+        {'book': BOOKS[number - 1].name, 'abbreviation': BOOKS[number - 1].abbreviation, 'count': count}
+        for number, count in sorted(counts.items())
+    ]
+
+
+def occurrence(key):
+    """Describe one posting as a position string plus its parts"""
+    rest, word = divmod(key, 1000)
+    rest, verse = divmod(rest, 1000)
+    number, chapter = divmod(rest, 1000)
+    return {
+        'position': format_position(key),
+        'book': BOOKS[number - 1].name,
+        'chapter': chapter,
+        'verse': verse,
+        'word_index': word,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the concordance word index')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--version-id', type=int)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+
+    run_migrations(args.database)
+    build_concordance(args.database, args.version_id, verbose=True)
+    print("Concordance rebuilt.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
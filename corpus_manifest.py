@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Per-chapter content hashes for integrity checks and incremental sync
+
+chapter_manifest stores the verse count and a SHA-256 of the text of every
+(version, book, chapter). Chapter hashes roll up into one hash per book and
+one per version (a two-level Merkle tree), so two copies of a version can be
+compared top down: equal version hashes mean nothing to do, and otherwise
+only books whose hash differs need their chapters compared.
+
+Without a reference, verify checks every book has the canonical number of
+chapters, which catches downloads that stopped early. With a reference
+manifest (a JSON file written by export, or the /api/manifest URL of another
+VerseIndex server) it lists the chapters that are missing, extra or
+different, and --refetch downloads just those chapters again.
+
+Usage:
+    python corpus_manifest.py refresh [--version WEB]
+    python corpus_manifest.py export --version WEB --output web-manifest.json
+    python corpus_manifest.py verify --version WEB [--reference web-manifest.json|URL] [--refetch [--source URL]]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+import requests
+
+import concordance
+from bible_books import BOOKS_BY_NAME, book_number
+from migrations import run_migrations
+from text_store import ChapterTextCache
+
+DATABASE = 'verseindex.db'
+
+
+def chapter_hash(verses):
+    """Hash of [(verse, text)] in verse order"""
+    digest = hashlib.sha256()
+    for verse, text in verses:
+        digest.update(f'{verse}\t{text}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _rollup(lines):
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(f'{line}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _book_order(book):
+    number = book_number(book)
+    return (number is None, number or 0, book)
+
+
+def update_chapter(conn, version_id, book, chapter, texts=None):
+    """Recompute the manifest row of one chapter (call inside the writing transaction)"""
+    texts = texts or ChapterTextCache(max_chapters=1)
+    verses = [
+        (verse, texts.text(conn, version_id, book, chapter, verse, text))
+        for verse, text in conn.execute('''
+            SELECT verse, text FROM scripture
+            WHERE version_id = ? AND book = ? AND chapter = ?
+            ORDER BY verse
+        ''', (version_id, book, chapter)).fetchall()
+    ]
+    if not verses:
+        conn.execute('DELETE FROM chapter_manifest WHERE version_id = ? AND book = ? AND chapter = ?',
+                     (version_id, book, chapter))
+        return
+    conn.execute('''
+        INSERT OR REPLACE INTO chapter_manifest (version_id, book, chapter, verse_count, hash)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (version_id, book, chapter, len(verses), chapter_hash(verses)))
+
+
+def refresh_manifest(database, version_id=None, verbose=False):
+    """
+    Recompute every chapter hash of one or all versions.
+
+    Returns {version_id: number of chapters whose entry changed}.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    results = {}
+    try:
+        if version_id is None:
+            version_ids = [row[0] for row in conn.execute('SELECT id FROM bible_versions ORDER BY id')]
+        else:
+            version_ids = [version_id]
+
+        for vid in version_ids:
+            conn.execute('BEGIN IMMEDIATE')
+            texts = ChapterTextCache(max_chapters=8)
+            chapters = {}
+            for book, chapter, verse, text in conn.execute('''
+                SELECT book, chapter, verse, text FROM scripture
+                WHERE version_id = ?
+                ORDER BY book, chapter, verse
+            ''', (vid,)).fetchall():
+                text = texts.text(conn, vid, book, chapter, verse, text)
+                chapters.setdefault((book, chapter), []).append((verse, text))
+
+            old = {
+                (book, chapter): (count, digest)
+                for book, chapter, count, digest in conn.execute(
+                    'SELECT book, chapter, verse_count, hash FROM chapter_manifest WHERE version_id = ?', (vid,))
+            }
+            new = {key: (len(verses), chapter_hash(verses)) for key, verses in chapters.items()}
+
+            conn.execute('DELETE FROM chapter_manifest WHERE version_id = ?', (vid,))
+            conn.executemany('''
+                INSERT INTO chapter_manifest (version_id, book, chapter, verse_count, hash)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(vid, book, chapter, count, digest) for (book, chapter), (count, digest) in new.items()])
+            conn.execute('COMMIT')
+
+            changed = sum(1 for key in set(old) | set(new) if old.get(key) != new.get(key))
+            results[vid] = changed
+            if verbose:
+                print(f"Version {vid}: {len(new)} chapters, {changed} changed")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return results
+
+
+def version_manifest(conn, version_id, abbreviation):
+    """The manifest of a version as a nested dict with book and version hashes"""
+    books = {}
+    for book, chapter, count, digest in conn.execute('''
+        SELECT book, chapter, verse_count, hash FROM chapter_manifest
+        WHERE version_id = ?
+        ORDER BY book, chapter
+    ''', (version_id,)):
+        books.setdefault(book, {})[str(chapter)] = {'verses': count, 'hash': digest}
+
+    manifest = {'version': abbreviation, 'books': {}}
+    for book in sorted(books, key=_book_order):
+        chapters = books[book]
+        manifest['books'][book] = {
+            'hash': _rollup(f"{chapter}\t{entry['verses']}\t{entry['hash']}" for chapter, entry in chapters.items()),
+            'chapters': chapters,
+        }
+    manifest['hash'] = _rollup(f"{book}\t{entry['hash']}" for book, entry in manifest['books'].items())
+    return manifest
+
+
+def diff_manifests(local, reference):
+    """[(book, chapter, problem)] where problem is missing, extra, verse_count or content"""
+    if local['hash'] == reference['hash']:
+        return []
+    differences = []
+    for book in sorted(set(local['books']) | set(reference['books']), key=_book_order):
+        ours = local['books'].get(book)
+        theirs = reference['books'].get(book)
+        if ours and theirs and ours['hash'] == theirs['hash']:
+            continue
+        ours = ours['chapters'] if ours else {}
+        theirs = theirs['chapters'] if theirs else {}
+        for chapter in sorted(set(ours) | set(theirs), key=int):
+            if chapter not in ours:
+                differences.append((book, int(chapter), 'missing'))
+            elif chapter not in theirs:
+                differences.append((book, int(chapter), 'extra'))
+            elif ours[chapter]['verses'] != theirs[chapter]['verses']:
+                differences.append((book, int(chapter), 'verse_count'))
+            elif ours[chapter]['hash'] != theirs[chapter]['hash']:
+                differences.append((book, int(chapter), 'content'))
+    return differences
+
+
+def check_completeness(local, books=None):
+    """[(book, chapter, 'missing')] for chapters absent from books that have been started"""
+    differences = []
+    for book in books or local['books']:
+        canonical = BOOKS_BY_NAME.get(book)
+        if canonical is None:
+            continue
+        present = local['books'].get(book, {}).get('chapters', {})
+        differences.extend(
+            (book, chapter, 'missing')
+            for chapter in range(1, canonical.chapters + 1) if str(chapter) not in present
+        )
+    return differences
+
+
+def load_reference(location, abbreviation):
+    """Read a reference manifest from a JSON file or a VerseIndex server URL"""
+    if location.startswith(('http://', 'https://')):
+        url = location.rstrip('/')
+        if '/api/manifest' not in url:
+            url += '/api/manifest'
+        response = requests.get(url, params={'version': abbreviation}, timeout=60)
+        response.raise_for_status()
+        return response.json()
+    with open(location) as f:
+        return json.load(f)
+
+
+def fetch_chapter(book, chapter, abbreviation, source=None):
+    """[(verse, text)] for a chapter from another VerseIndex server or bible-api.com"""
+    if source:
+        response = requests.get(f"{source.rstrip('/')}/api/compare/{book}/{chapter}",
+                                params={'versions': abbreviation}, timeout=30)
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        return [
+            (row['verse'], row['texts'][abbreviation]['text'])
+            for row in response.json()['rows'] if row['texts'].get(abbreviation)
+        ]
+
+    from download_bible import fetch_book_chapter
+    data = fetch_book_chapter(book, chapter, abbreviation.lower())
+    if not data or not data.get('verses'):
+        return []
+    return [
+        (int(verse['verse']), verse['text'].strip())
+        for verse in data['verses'] if int(verse.get('chapter', chapter)) == chapter and verse.get('text')
+    ]
+
+
+def apply_chapter(conn, version_id, book, chapter, verses):
+    """Insert missing verses and correct changed ones; returns rows written"""
+    texts = ChapterTextCache(max_chapters=1)
+    existing = {
+        verse: texts.text(conn, version_id, book, chapter, verse, text)
+        for verse, text in conn.execute('''
+            SELECT verse, text FROM scripture
+            WHERE version_id = ? AND book = ? AND chapter = ?
+        ''', (version_id, book, chapter)).fetchall()
+    }
+    written = 0
+    for verse, text in verses:
+        if verse not in existing:
+            verse_id = conn.execute('''
+                INSERT INTO scripture (version_id, book, chapter, verse, text)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (version_id, book, chapter, verse, text)).lastrowid
+            concordance.index_verse(conn, verse_id, version_id, book, chapter, verse, text)
+            written += 1
+        elif existing[verse] != text:
+            conn.execute('''
+                UPDATE scripture SET text = ?
+                WHERE version_id = ? AND book = ? AND chapter = ? AND verse = ?
+            ''', (text, version_id, book, chapter, verse))
+            written += 1
+    update_chapter(conn, version_id, book, chapter)
+    return written
+
+
+def _version(conn, abbreviation):
+    return conn.execute(
+        'SELECT id, abbreviation FROM bible_versions WHERE abbreviation = ?', (abbreviation,)
+    ).fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chapter hashes, integrity checks and incremental sync')
+    parser.add_argument('--database', default=DATABASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    refresh = commands.add_parser('refresh', help='recompute chapter hashes')
+    refresh.add_argument('--version', help='version abbreviation (default: all)')
+
+    export = commands.add_parser('export', help='write a version manifest as JSON')
+    export.add_argument('--version', required=True)
+    export.add_argument('--output', required=True)
+
+    verify = commands.add_parser('verify', help='list chapters that are incomplete or differ from a reference')
+    verify.add_argument('--version', required=True)
+    verify.add_argument('--reference', help='manifest JSON file or VerseIndex server URL')
+    verify.add_argument('--refetch', action='store_true', help='download the chapters that differ')
+    verify.add_argument('--source', help='VerseIndex server to re-fetch from (default: bible-api.com)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+    run_migrations(args.database)
+
+    conn = sqlite3.connect(args.database)
+    version = _version(conn, args.version) if args.version else None
+    conn.close()
+    if args.version and version is None:
+        print(f"Unknown version: {args.version}")
+        return 1
+
+    if args.command == 'refresh':
+        refresh_manifest(args.database, version[0] if version else None, verbose=True)
+        return 0
+
+    conn = sqlite3.connect(args.database)
+    local = version_manifest(conn, *version)
+    conn.close()
+
+    if args.command == 'export':
+        with open(args.output, 'w') as f:
+            json.dump(local, f, indent=1)
+        print(f"Wrote {sum(len(b['chapters']) for b in local['books'].values())} chapters to {args.output} "
+              f"(version hash {local['hash'][:16]})")
+        return 0
+
+    if args.reference:
+        try:
+            reference = load_reference(args.reference, version[1])
+        except (OSError, ValueError, requests.RequestException) as e:
+            print(f"Could not read reference manifest: {e}")
+            return 1
+        differences = diff_manifests(local, reference)
+    else:
+        differences = check_completeness(local)
+
+    if not differences:
+        print(f"{version[1]}: all chapters match (version hash {local['hash'][:16]})")
+        return 0
+    for book, chapter, problem in differences:
+        print(f"  {book} {chapter}: {problem}")
+    print(f"{len(differences)} chapter(s) differ")
+    if not args.refetch:
+        return 1
+
+    conn = sqlite3.connect(args.database)
+    fixed = 0
+    for book, chapter, problem in differences:
+        if problem == 'extra':
+            continue
+        try:
+            verses = fetch_chapter(book, chapter, version[1], args.source)
+        except requests.RequestException as e:
+            print(f"  {book} {chapter}: fetch failed ({e})")
+            continue
+        if not verses:
+            print(f"  {book} {chapter}: not available from the source")
+            continue
+        written = apply_chapter(conn, version[0], book, chapter, verses)
+        conn.commit()
+        fixed += 1
+        print(f"  {book} {chapter}: {written} verse(s) written")
+    conn.close()
+    print(f"Re-fetched {fixed} chapter(s); run concordance.py if verse texts were corrected")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
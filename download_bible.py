@@ -6,7 +6,6 @@ and save them to the database
 import sqlite3
 import requests
 import time
-import re
 import sys
 import os
 
@@ -16,6 +15,8 @@ DATABASE = 'verseindex.db'
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 try:
     from app import init_db
+    from bible_books import BOOKS_BY_NAME, canonical_book_name, parse_reference
+    from corpus_manifest import update_chapter
 except ImportError:
     print("Error: Could not import init_db from app.py")
     sys.exit(1)
@@ -64,13 +65,11 @@ def init_versions():
 def parse_bible_verse(reference, text):
     """Parse Bible reference to extract book, chapter, verse"""
     # Reference format: "Genesis 1:1" or "Exodus 2:3"
-    match = re.match(r'(\w+(?:\s+\w+)?)\s+(\d+):(\d+)', reference)
-    if match:
-        book = match.group(1)
-        chapter = int(match.group(2))
-        verse = int(match.group(3))
-        return book, chapter, verse, text
-    return None, None, None, text
+    try:
+        passage = parse_reference(reference)[0]
+    except ValueError:
+        return None, None, None, text
+    return passage.book, passage.start_chapter, passage.start_verse, text
 
 def fetch_book_chapter(book, chapter, version='web'):
     """Fetch a chapter from bible-api.com"""
@@ -101,6 +100,7 @@ def save_verses_to_db(verses_data, version_id, book_name):
     
     saved_count = 0
     error_count = 0
+    chapters = set()
     
     if not verses_data or 'verses' not in verses_data:
         conn.close()
@@ -109,7 +109,7 @@ def save_verses_to_db(verses_data, version_id, book_name):
     for verse_data in verses_data['verses']:
         try:
             # bible-api.com returns verses in this format
-            book = verse_data.get('book_name', book_name)
+            book = canonical_book_name(verse_data.get('book_name', book_name))
             chapter = int(verse_data.get('chapter', 0))
             verse_num = int(verse_data.get('verse', 0))
             text = verse_data.get('text', '')
@@ -121,6 +121,7 @@ def save_verses_to_db(verses_data, version_id, book_name):
                         VALUES (?, ?, ?, ?, ?)
                     ''', (version_id, book, chapter, verse_num, text.strip()))
                     saved_count += 1
+                    chapters.add((book, chapter))
                 except sqlite3.IntegrityError:
                     # Verse already exists, skip
                     error_count += 1
@@ -129,6 +130,8 @@ def save_verses_to_db(verses_data, version_id, book_name):
             print(f"Error processing verse: {e}")
             error_count += 1
     
+    for book, chapter in chapters:
+        update_chapter(conn, version_id, book, chapter)
     conn.commit()
     conn.close()
     return saved_count, error_count
@@ -153,13 +156,7 @@ def download_bible_versions():
     ]
     
     total_chapters = {book: 0 for book in BOOKS_TO_DOWNLOAD}
-    
-    # Get chapter counts (approximate - Genesis has 50, Exodus has 40)
-    # We'll try to fetch and see what's available
-    chapter_counts = {
-        'Genesis': 50,
-        'Exodus': 40
-    }
+    missing_chapters = []
     
     for version_abbr, version_id, version_name in versions_to_download:
         print(f"\n=== Downloading {version_name} ===")
@@ -167,7 +164,9 @@ def download_bible_versions():
         for book in BOOKS_TO_DOWNLOAD:
             print(f"\nDownloading {book}...")
             book_chapters = 0
-            max_chapters = chapter_counts.get(book, 50)
+            # Use the canonical chapter count rather than stopping at the first
+            # chapter that fails, so one bad response can't truncate a book
+            max_chapters = BOOKS_BY_NAME[book].chapters
             
             for chapter in range(1, max_chapters + 1):
                 print(f"  Chapter {chapter}...", end=' ', flush=True)
@@ -196,8 +195,7 @@ def download_bible_versions():
                                 time.sleep(2)  # Longer delay after retry
                                 continue
                     print(f"✗ Not found or error")
-                    # If chapter not found, likely reached the end
-                    break
+                    missing_chapters.append(f"{version_name} {book} {chapter}")
                 
                 # Be nice to the API - longer delay to avoid rate limits
                 time.sleep(2)
@@ -209,6 +207,11 @@ def download_bible_versions():
     print("\nSummary:")
     for book in BOOKS_TO_DOWNLOAD:
         print(f"  {book}: {total_chapters[book]} chapters")
+    if missing_chapters:
+        print(f"\n{len(missing_chapters)} chapter(s) could not be downloaded:")
+        for chapter in missing_chapters:
+            print(f"  {chapter}")
+        print("Retry them with: python corpus_manifest.py verify --version <VERSION> --refetch")
 
 if __name__ == '__main__':
     download_bible_versions()
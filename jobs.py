@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Background jobs for long maintenance tasks
+
+Concordance rebuilds, chapter imports, migrations, tag compaction,
+auto-tagging, tag depth sweeps, related topic refreshes, manifest refreshes
+and backups are queued as rows in the jobs table and run in a pool of worker
+processes, off the request path. Each job type has its own concurrency limit,
+counted across every process sharing the database, so a second concordance
+build waits for the first while a backup can run beside it. Jobs report
+progress as (done, total) units, from which job_status() derives a
+percentage, a rate and an ETA.
+
+Cancelling a queued job drops it. A running job stops at its next progress
+report (jobs without progress reports can only be cancelled while queued).
+Because the queue lives in the database, jobs submitted from the command line
+are picked up by a running app, and a job whose process died is marked
+failed the next time a scheduler starts.
+
+Usage:
+    python jobs.py submit concordance [--param version_id=1]
+    python jobs.py list [--status running]
+    python jobs.py show ID
+    python jobs.py cancel ID
+    python jobs.py worker [--workers N]    # run queued jobs without the app
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+import auto_tag
+import backup
+import concordance
+import corpus_manifest
+import tag_depth
+import topic_graph
+from bible_books import canonical_book_name
+from compact_tags import compact_tags
+from migrations import run_migrations
+
+DATABASE = 'verseindex.db'
+DEFAULT_WORKERS = 2
+# Seconds between scans for jobs queued by other processes
+DEFAULT_POLL = 2.0
+# Progress is written at most this often (seconds) while a job runs
+PROGRESS_INTERVAL = 0.5
+# Pause between chapters fetched from bible-api.com, which rate-limits
+IMPORT_DELAY = 2.0
+
+# SQLite expression for the current time with milliseconds, so rates are
+# meaningful for short jobs
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class JobContext:
+    """What a running job sees: its database and a progress reporter"""
+
+    def __init__(self, database, job_id):
+        self.database = database
+        self.job_id = job_id
+        self._reported = 0.0
+
+    def progress(self, done, total=None):
+        """Record progress; raises JobCancelled once the job has been cancelled"""
+        now = time.monotonic()
+        if now - self._reported < PROGRESS_INTERVAL and (total is None or done < total):
+            return
+        self._reported = now
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            with conn:
+                conn.execute(f'''
+                    UPDATE jobs SET done = ?, total = COALESCE(?, total), updated_at = {NOW}
+                    WHERE id = ?
+                ''', (done, total, self.job_id))
+            cancelled = conn.execute(
+                'SELECT cancel_requested FROM jobs WHERE id = ?', (self.job_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if cancelled:
+            raise JobCancelled()
+
+
+def _concordance(ctx, version_id=None):
+    return concordance.build_concordance(ctx.database, version_id, progress=ctx.progress)
+
+
+def _compact_tags(ctx, topic_id=None, version=None, dry_run=False):
+    return compact_tags(ctx.database, topic_id=topic_id, version=version, dry_run=dry_run,
+                        progress=ctx.progress)
+
+
+def _auto_tag(ctx, rule_id=None):
+    return auto_tag.run_rules(ctx.database, rule_id, progress=ctx.progress)
+
+
+def _manifest(ctx, version_id=None):
+    return corpus_manifest.refresh_manifest(ctx.database, version_id)
+
+
+def _tag_depth(ctx, version=None, full=False):
+    return tag_depth.build_tag_depth(ctx.database, version, full=full, progress=ctx.progress)
+
+
+def _topic_graph(ctx, full=False):
+    return {'topics_recomputed': topic_graph.refresh_topic_graph(ctx.database, full=full)}
+
+
+def _migrate(ctx):
+    return {'applied': run_migrations(ctx.database, verbose=False, progress=ctx.progress)}
+
+
+def _backup(ctx, backup_dir=backup.BACKUP_DIR, incremental=False, compress=False, keep=backup.DEFAULT_KEEP):
+    return backup.create_backup(
+        ctx.database, backup_dir, incremental=incremental, compress=compress, keep=keep,
+        progress=lambda status, remaining, total: ctx.progress(total - remaining, total))
+
+
+def _import(ctx, version, books=None, source=None):
+    """Fetch every chapter missing from a version's books (default: the books it has started)"""
+    if isinstance(books, str):
+        books = books.split(',')
+    books = [canonical_book_name(book.strip()) for book in books or []]
+    conn = sqlite3.connect(ctx.database)
+    try:
+        row = conn.execute('SELECT id, abbreviation FROM bible_versions WHERE abbreviation = ?',
+                           (version,)).fetchone()
+        if row is None:
+            raise ValueError(f'Unknown version: {version}')
+        local = corpus_manifest.version_manifest(conn, *row)
+        missing = corpus_manifest.check_completeness(local, books)
+
+        stats = {'chapters_missing': len(missing), 'chapters_imported': 0, 'verses_written': 0,
+                 'unavailable': []}
+        for index, (book, chapter, _) in enumerate(missing):
+            ctx.progress(index, len(missing))
+            try:
+                verses = corpus_manifest.fetch_chapter(book, chapter, row[1], source)
+            except requests.RequestException as e:
+                stats['unavailable'].append(f'{book} {chapter}: {e}')
+                continue
+            if verses:
+                stats['verses_written'] += corpus_manifest.apply_chapter(conn, row[0], book, chapter, verses)
+                conn.commit()
+                stats['chapters_imported'] += 1
+            else:
+                stats['unavailable'].append(f'{book} {chapter}')
+            if not source:
+                time.sleep(IMPORT_DELAY)
+        ctx.progress(len(missing), len(missing))
+    finally:
+        conn.close()
+    return stats
+
+
+# run(ctx, **params) does the work. limit is how many jobs of the type may
+# run at once. changes says what a finished job may have modified
+# ('annotations', 'scripture' or None), so the app can drop cached reads.
+JobType = namedtuple('JobType', ['run', 'limit', 'changes'])
+
+JOB_TYPES = {
+    'concordance': JobType(_concordance, 1, None),
+    'compact_tags': JobType(_compact_tags, 1, 'annotations'),
+    'auto_tag': JobType(_auto_tag, 1, 'annotations'),
+    'manifest': JobType(_manifest, 1, None),
+    'migrate': JobType(_migrate, 1, 'scripture'),
+    'backup': JobType(_backup, 1, None),
+    'import': JobType(_import, 1, 'scripture'),
+    'tag_depth': JobType(_tag_depth, 1, None),
+    'topic_graph': JobType(_topic_graph, 1, None),
+}
+
+
+def _execute(database, job_id, job_type, params):
+    """Run one job in a pool process; returns (status, result, error)"""
+    ctx = JobContext(database, job_id)
+    try:
+        result = JOB_TYPES[job_type].run(ctx, **params)
+    except JobCancelled:
+        return 'cancelled', None, None
+    except Exception as e:
+        return 'failed', None, f'{type(e).__name__}: {e}'
+    return 'succeeded', result, None
+
+
+def submit_job(database, job_type, params=None):
+    """Queue a job and return its id. Raises ValueError for an unknown type."""
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {job_type} (expected one of {', '.join(sorted(JOB_TYPES))})")
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        job_id = conn.execute(f'''
+            INSERT INTO jobs (type, params, created_at, updated_at) VALUES (?, ?, {NOW}, {NOW})
+        ''', (job_type, json.dumps(params or {}))).lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    return job_id
+
+
+def cancel_job(database, job_id):
+    """
+    Cancel a queued job at once, or ask a running one to stop. Returns the
+    job's status afterwards, or None if there is no such job.
+    """
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        with conn:
+            conn.execute(f'''
+                UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = {NOW}, updated_at = {NOW}
+                WHERE id = ? AND status = 'queued'
+            ''', (job_id,))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+_JOB_QUERY = f'''
+    SELECT *, (julianday(COALESCE(finished_at, {NOW})) - julianday(started_at)) * 86400 AS elapsed
+    FROM jobs
+'''
+
+
+def _describe(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    elapsed = job.pop('elapsed')
+    job['seconds'] = round(elapsed, 3) if elapsed is not None else None
+    job['percent'] = round(100.0 * job['done'] / job['total'], 1) if job['total'] else None
+    job['rate'] = round(job['done'] / elapsed, 3) if elapsed and job['done'] else None
+    job['eta_seconds'] = None
+    if job['status'] == 'running' and job['rate'] and job['total']:
+        job['eta_seconds'] = round((job['total'] - job['done']) / job['rate'], 1)
+    return job
+
+
+def job_status(conn, job_id):
+    """A job with its progress, rate (units per second) and ETA, or None"""
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(_JOB_QUERY + ' WHERE id = ?', (job_id,)).fetchone()
+    return _describe(row) if row else None
+
+
+def list_jobs(conn, status=None, job_type=None, limit=50):
+    """Most recent jobs first, optionally filtered by status and/or type"""
+    conn.row_factory = sqlite3.Row
+    query = _JOB_QUERY + ' WHERE 1=1'
+    params = []
+    if status:
+        query += ' AND status = ?'
+        params.append(status)
+    if job_type:
+        query += ' AND type = ?'
+        params.append(job_type)
+    query += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    return [_describe(row) for row in conn.execute(query, params)]
+
+
+def is_pending(conn, job_type):
+    """True while a job of the type is queued or running"""
+    return conn.execute(
+        "SELECT 1 FROM jobs WHERE type = ? AND status IN ('queued', 'running') LIMIT 1", (job_type,)
+    ).fetchone() is not None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobScheduler:
+    """Starts queued jobs on a process pool, within each type's concurrency limit"""
+
+    def __init__(self, database=DATABASE, workers=DEFAULT_WORKERS, poll=DEFAULT_POLL):
+        self.database = database
+        self.workers = workers
+        self.poll = poll
+        self._pool = None
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(job_type, status, result) after each job finishes"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Fail jobs whose process died, then start dispatching"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            conn = sqlite3.connect(self.database, timeout=30)
+            try:
+                with conn:
+                    for job_id, pid in conn.execute("SELECT id, pid FROM jobs WHERE status = 'running'").fetchall():
+                        if pid is None or not _process_alive(pid):
+                            conn.execute(f'''
+                                UPDATE jobs SET status = 'failed', error = 'Interrupted: its process exited',
+                                       finished_at = {NOW}, updated_at = {NOW}
+                                WHERE id = ?
+                            ''', (job_id,))
+            finally:
+                conn.close()
+            self._pool = self._new_pool()
+            self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+            self._thread.start()
+
+    def _new_pool(self):
+        # spawn, not fork: the app process has writer and scheduler threads
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, job_type, params=None):
+        job_id = submit_job(self.database, job_type, params)
+        self._wake.set()
+        return job_id
+
+    def idle(self):
+        with self._lock:
+            return not self._running
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            try:
+                self._dispatch()
+            except sqlite3.Error as e:
+                print(f"Job scheduler: {e}", file=sys.stderr)
+
+    def _dispatch(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            running = dict(conn.execute(
+                "SELECT type, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY type").fetchall())
+            queued = conn.execute("SELECT id, type, params FROM jobs WHERE status = 'queued' ORDER BY id").fetchall()
+            for job_id, job_type, params in queued:
+                with self._lock:
+                    if len(self._running) >= self.workers:
+                        return
+                job = JOB_TYPES.get(job_type)
+                if job is None:
+                    with conn:
+                        conn.execute(f'''
+                            UPDATE jobs SET status = 'failed', error = 'Unknown job type',
+                                   finished_at = {NOW}, updated_at = {NOW}
+                            WHERE id = ?
+                        ''', (job_id,))
+                    continue
+                if running.get(job_type, 0) >= job.limit:
+                    continue
+                # Claim the job; another scheduler may have taken it first
+                with conn:
+                    claimed = conn.execute(f'''
+                        UPDATE jobs SET status = 'running', pid = ?, started_at = {NOW}, updated_at = {NOW}
+                        WHERE id = ? AND status = 'queued'
+                    ''', (os.getpid(), job_id)).rowcount
+                if not claimed:
+                    continue
+                running[job_type] = running.get(job_type, 0) + 1
+                with self._lock:
+                    pool = self._pool
+                    future = pool.submit(_execute, self.database, job_id, job_type, json.loads(params))
+                    self._running[job_id] = future
+                future.add_done_callback(functools.partial(self._finished, job_id, job_type, pool))
+        finally:
+            conn.close()
+
+    def _finished(self, job_id, job_type, pool, future):
+        try:
+            status, result, error = future.result()
+        except Exception as e:
+            status, result, error = 'failed', None, f'{type(e).__name__}: {e}'
+            if isinstance(e, BrokenProcessPool):
+                # A worker process died and took the pool with it
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = self._new_pool()
+
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            with conn:
+                conn.execute(f'''
+                    UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = {NOW}, updated_at = {NOW}
+                    WHERE id = ?
+                ''', (status, json.dumps(result, default=str) if result is not None else None, error, job_id))
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._running.pop(job_id, None)
+        for callback in self._listeners:
+            callback(job_type, status, result)
+        self._wake.set()
+
+
+def _parse_param(text):
+    """key=value, with the value read as JSON when it parses (numbers, true, lists)"""
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'expected key=value, got {text!r}')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def _print_job(job):
+    progress = f"{job['done']}/{job['total']}" if job['total'] else str(job['done'])
+    line = f"{job['id']:5d}  {job['type']:<13} {job['status']:<10} {progress:>12}"
+    if job['percent'] is not None:
+        line += f"  {job['percent']:5.1f}%"
+    if job['rate']:
+        line += f"  {job['rate']}/s"
+    if job['eta_seconds'] is not None:
+        line += f"  eta {job['eta_seconds']}s"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue, inspect and run background maintenance jobs')
+    parser.add_argument('--database', default=DATABASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='queue a job')
+    submit.add_argument('type', choices=sorted(JOB_TYPES))
+    submit.add_argument('--param', action='append', type=_parse_param, default=[],
+                        help='job parameter as key=value (repeatable)')
+
+    listing = commands.add_parser('list', help='list recent jobs')
+    listing.add_argument('--status', choices=('queued', 'running') + FINISHED)
+    listing.add_argument('--limit', type=int, default=20)
+
+    show = commands.add_parser('show', help='show one job')
+    show.add_argument('id', type=int)
+
+    cancel = commands.add_parser('cancel', help='cancel a queued or running job')
+    cancel.add_argument('id', type=int)
+
+    worker = commands.add_parser('worker', help='run queued jobs, then exit when the queue is empty')
+    worker.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+    run_migrations(args.database, verbose=False)
+
+    if args.command == 'submit':
+        job_id = submit_job(args.database, args.type, dict(args.param))
+        print(f"Queued job {job_id}.")
+    elif args.command == 'list':
+        conn = sqlite3.connect(args.database)
+        for job in list_jobs(conn, args.status, limit=args.limit):
+            _print_job(job)
+        conn.close()
+    elif args.command == 'show':
+        conn = sqlite3.connect(args.database)
+        job = job_status(conn, args.id)
+        conn.close()
+        if job is None:
+            print(f"No job {args.id}")
+            return 1
+        print(json.dumps(job, indent=2))
+    elif args.command == 'cancel':
+        status = cancel_job(args.database, args.id)
+        if status is None:
+            print(f"No job {args.id}")
+            return 1
+        print(f"Job {args.id}: {status}")
+    else:
+        scheduler = JobScheduler(args.database, args.workers, poll=0.5)
+        scheduler.add_listener(lambda job_type, status, result: print(f"{job_type}: {status}"))
+        scheduler.start()
+        conn = sqlite3.connect(args.database)
+        try:
+            while True:
+                time.sleep(1)
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                for job in list_jobs(conn, 'running'):
+                    _print_job(job)
+                if not queued and scheduler.idle():
+                    break
+        finally:
+            conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
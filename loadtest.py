@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Load test that replays browsing sessions against a running VerseIndex app
+
+Each simulated reader makes the same requests, in the same order, that
+static/js/app.js makes when someone opens the page and reads a chapter:
+books and versions, the version's catalog for the navigator, the chapter's
+verses, its tags and topics, its per-verse topic bitsets, and the tags
+again. Editors do the same and then search for a topic, create one and tag
+a few words. Their writes go to a separate workspace ("loadtest" by default),
+so the shared annotations are left alone.
+
+Concurrency is stepped up stage by stage. After each stage the script prints
+throughput, error rate and latency percentiles per step. At the end it says
+where throughput stopped scaling.
+
+Usage:
+    python app.py &
+    python loadtest.py --url http://localhost:5001 --stages 1,5,10,25,50 --duration 20
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_URL = 'http://localhost:5001'
+DEFAULT_STAGES = '1,5,10,25,50'
+DEFAULT_DURATION = 20
+DEFAULT_EDITORS = 0.1
+
+# Stop stepping up once throughput gains less than this between stages
+SATURATION_GAIN = 1.10
+
+
+class Recorder:
+    """Thread-safe latency and error log, bucketed by step name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.sessions = 0
+
+    def record(self, step, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Session:
+    """One simulated user with its own HTTP connection pool"""
+
+    # Book name -> position abbreviation, filled in by discover_catalog
+    catalog_abbreviations = {}
+
+    def __init__(self, base_url, recorder, catalog, editor=False, workspace=None):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.catalog = catalog
+        self.editor = editor
+        self.http = requests.Session()
+        if workspace:
+            self.http.headers['X-Workspace'] = workspace
+
+    def call(self, step, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=30, **kwargs)
+            # A 400 on a write is an expected conflict (topic already exists)
+            ok = response.status_code < 400 or (method == 'POST' and response.status_code == 400)
+            body = response.json() if ok and response.headers.get('Content-Type', '').startswith('application/json') else None
+        except (requests.RequestException, ValueError):
+            ok, body = False, None
+        self.recorder.record(step, time.perf_counter() - started, ok)
+        return body
+
+    def read_chapter(self):
+        """The request sequence of page load + selectBook + selectChapter"""
+        book, chapters, version_id, version = random.choice(self.catalog)
+        chapter = random.choice(chapters)
+        params = {'version_id': version_id}
+        chapter_params = {'book': book, 'chapter': chapter, 'version_id': version_id}
+
+        self.call('page', 'GET', '/')
+        self.call('books', 'GET', '/api/books')
+        self.call('versions', 'GET', '/api/versions')
+        self.call('catalog', 'GET', '/api/catalog', params=params)
+        verses = self.call('verses', 'GET', f'/api/scripture/book/{book}',
+                           params={'chapter': chapter, 'version_id': version_id}) or []
+        self.call('tags', 'GET', '/api/scripture/tags', params=chapter_params)
+        self.call('chapter_topics', 'GET', '/api/scripture/topics', params=chapter_params)
+        # buildTopicToVersesMap: the chapter's topic bitsets, then the tags again
+        self.call('topic_bitsets', 'GET', '/api/scripture/topic-bitsets', params=chapter_params)
+        self.call('tags', 'GET', '/api/scripture/tags', params=chapter_params)
+        return book, chapter, version, verses
+
+    def edit(self, book, chapter, version, verses):
+        """Search for a topic, create it if needed and tag a few words"""
+        if not verses:
+            return
+        name = f'Load test {random.randint(1, 50)}'
+        self.call('topic_suggest', 'GET', '/api/topics/suggest', params={'q': name[:6], 'limit': 20})
+        created = self.call('create_topic', 'POST', '/api/topics', json={'name': name})
+        topic_id = created.get('id') if created else None
+        if topic_id is None:
+            topics = self.call('topics', 'GET', '/api/topics') or []
+            topic_id = next((t['id'] for t in topics if t['name'] == name), None)
+
+        verse = random.choice(verses)
+        abbreviation = self.catalog_abbreviations.get(book, book[:4])
+        start = random.randint(0, 3)
+        self.call('create_tag', 'POST', '/api/scripture/tags', json={
+            'topic_id': topic_id,
+            'version': version,
+            'start_position': f"{abbreviation} {chapter}:{verse['verse']}.{start}",
+            'end_position': f"{abbreviation} {chapter}:{verse['verse']}.{start + 2}",
+        })
+
+    def run(self, stop_at):
+        while time.monotonic() < stop_at:
+            book, chapter, version, verses = self.read_chapter()
+            if self.editor:
+                self.edit(book, chapter, version, verses)
+            self.recorder.session_done()
+
+
+def discover_catalog(base_url):
+    """Find (book, chapters, version_id, version) combinations that have text"""
+    base_url = base_url.rstrip('/')
+    books = requests.get(base_url + '/api/books', timeout=30).json()
+    versions = requests.get(base_url + '/api/versions', timeout=30).json()
+    Session.catalog_abbreviations = {book['name']: book['abbreviation'] for book in books}
+
+    catalog = []
+    for version in versions:
+        loaded = requests.get(base_url + '/api/catalog', params={'version_id': version['id']}, timeout=30).json()
+        for book in loaded:
+            chapters = [entry['chapter'] for entry in book['chapters']]
+            catalog.append((book['name'], chapters, version['id'], version['abbreviation']))
+    return catalog
+
+
+def run_stage(base_url, catalog, users, duration, editor_share, workspace):
+    recorder = Recorder()
+    editors = int(round(users * editor_share))
+    stop_at = time.monotonic() + duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        for index in range(users):
+            session = Session(base_url, recorder, catalog, editor=index < editors,
+                              workspace=workspace if index < editors else None)
+            pool.submit(session.run, stop_at)
+    return recorder, time.perf_counter() - started, editors
+
+
+def print_stage(users, editors, recorder, elapsed):
+    total = sum(len(values) for values in recorder.latencies.values())
+    errors = sum(recorder.errors.values())
+    throughput = total / elapsed if elapsed else 0
+    print(f"\n=== {users} users ({editors} editors): {total} requests in {elapsed:.1f}s, "
+          f"{throughput:.1f} req/s, {recorder.sessions / elapsed:.2f} sessions/s, "
+          f"errors {errors} ({100.0 * errors / total if total else 0:.2f}%)")
+    print(f"  {'step':<16}{'count':>8}{'err%':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, values in recorder.latencies.items():
+        values.sort()
+        step_errors = recorder.errors.get(step, 0)
+        print(f"  {step:<16}{len(values):>8}{100.0 * step_errors / len(values):>8.2f}"
+              f"{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+    return throughput, (errors / total if total else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay browsing sessions at increasing concurrency')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--stages', default=DEFAULT_STAGES, help='comma separated user counts')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds per stage')
+    parser.add_argument('--editors', type=float, default=DEFAULT_EDITORS, help='share of users that also write')
+    parser.add_argument('--workspace', default='loadtest', help='workspace editors write to')
+    args = parser.parse_args()
+
+    try:
+        catalog = discover_catalog(args.url)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not reach {args.url}: {e}")
+        return 1
+    if not catalog:
+        print("No scripture found; add some data first.")
+        return 1
+    print(f"Replaying sessions over {len(catalog)} book/version combinations at {args.url}")
+    if args.editors:
+        # Workspaces are created by their first write; editors read theirs too
+        requests.post(args.url.rstrip('/') + '/api/topics', json={'name': 'Load test 1'},
+                      headers={'X-Workspace': args.workspace}, timeout=30)
+
+    results = []
+    for users in [int(n) for n in args.stages.split(',') if n.strip()]:
+        recorder, elapsed, editors = run_stage(args.url, catalog, users, args.duration,
+                                               args.editors, args.workspace)
+        throughput, error_rate = print_stage(users, editors, recorder, elapsed)
+        results.append((users, throughput, error_rate))
+
+    print("\n=== Summary")
+    saturation = None
+    for (users, throughput, error_rate), previous in zip(results, [None] + results[:-1]):
+        note = ''
+        if saturation is None and previous and (throughput < previous[1] * SATURATION_GAIN or error_rate > 0.01):
+            saturation = previous[0]
+            note = '  <- throughput stopped scaling'
+        print(f"  {users:>5} users  {throughput:>9.1f} req/s  {100 * error_rate:>6.2f}% errors{note}")
+    if saturation is not None:
+        print(f"Saturation point: about {saturation} concurrent users")
+    else:
+        print("No saturation within the tested stages")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
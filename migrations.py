@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migration runner
+
+Each migration is a numbered step recorded in the schema_version table once
+it has been applied, so running this repeatedly only applies what is
+pending. Large data copies run in chunks that each commit on their own and
+record how far they got, so an interrupted run picks up where it stopped
+instead of starting over (and never holds one long exclusive lock).
+
+Usage:
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending migrations
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+from bible_books import book_abbreviation, position_string_key
+from topic_tree import ensure_topic_tree
+
+DATABASE = 'verseindex.db'
+
+# Rows copied per transaction during data migrations
+DEFAULT_CHUNK_SIZE = 5000
+# Verses per chapter assumed when sizing per-chapter chunks
+CHAPTER_CHUNK_VERSES = 50
+
+# Ordered list of (version, name, function); filled by @migration below
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register a migration step. Steps run in version order."""
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return register
+
+
+class MigrationContext:
+    """State handed to each migration step"""
+
+    def __init__(self, conn, version, chunk_size, verbose):
+        self.conn = conn
+        self.version = version
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def report(self, label, done, total):
+        if self.verbose:
+            print(f"  {label}: {done}/{total} rows", flush=True)
+
+
+def ensure_migration_tables(conn):
+    """Create the bookkeeping tables used by the runner"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Resume point for chunked copies: the last source key copied so far
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migration_progress (
+            version INTEGER PRIMARY KEY,
+            last_key INTEGER NOT NULL,
+            rows_done INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def table_exists(conn, table):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def process_in_chunks(ctx, label, select_sql, handle, total=None, chunk_size=None):
+    """
+    Run handle(rows) over the rows of select_sql one chunk per transaction.
+
+    select_sql takes (last_key, limit) parameters and must return rows
+    ordered by a unique integer key in the first column. Progress is
+    committed with each chunk so a rerun continues after the last key.
+    Returns the number of rows read by this run.
+    """
+    conn = ctx.conn
+    row = conn.execute(
+        'SELECT last_key, rows_done FROM schema_migration_progress WHERE version = ?',
+        (ctx.version,)
+    ).fetchone()
+    last_key, done = row if row else (0, 0)
+    if done:
+        ctx.log(f"  Resuming {label} after {done} rows")
+
+    read = 0
+    while True:
+        rows = conn.execute(select_sql, (last_key, chunk_size or ctx.chunk_size)).fetchall()
+        if not rows:
+            break
+
+        handle(rows)
+
+        last_key = rows[-1][0]
+        done += len(rows)
+        read += len(rows)
+        conn.execute('''
+            INSERT OR REPLACE INTO schema_migration_progress (version, last_key, rows_done)
+            VALUES (?, ?, ?)
+        ''', (ctx.version, last_key, done))
+        conn.commit()
+        ctx.report(label, done, total if total is not None else '?')
+
+    return read
+
+
+def copy_in_chunks(ctx, label, select_sql, insert_sql, transform=None, total=None):
+    """
+    Copy rows from select_sql into insert_sql one chunk per transaction.
+
+    select_sql is as for process_in_chunks. transform maps a source row to
+    insert parameters, or None to skip the row. Returns (rows_read,
+    rows_skipped) for this run.
+    """
+    skipped = 0
+
+    def insert(rows):
+        nonlocal skipped
+        params = rows if transform is None else [transform(r) for r in rows]
+        params = [p for p in params if p is not None]
+        skipped += len(rows) - len(params)
+        if params:
+            ctx.conn.executemany(insert_sql, params)
+
+    read = process_in_chunks(ctx, label, select_sql, insert, total)
+    return read, skipped
+
+
+def applied_versions(conn):
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+
+def run_migrations(database=DATABASE, chunk_size=DEFAULT_CHUNK_SIZE, verbose=True, progress=None):
+    """
+    Apply every pending migration in order. Returns the versions applied.
+    progress, if given, is called with (migrations_done, migrations_pending).
+    """
+    conn = sqlite3.connect(database)
+    applied = []
+    try:
+        ensure_migration_tables(conn)
+        done = applied_versions(conn)
+        pending = [migration for migration in MIGRATIONS if migration[0] not in done]
+
+        for version, name, step in pending:
+            if verbose:
+                print(f"Applying migration {version}: {name}...")
+
+            step(MigrationContext(conn, version, chunk_size, verbose))
+
+            # Record the version in the same transaction as the step's
+            # final statements so a crash can't leave it half-recorded
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            conn.execute('DELETE FROM schema_migration_progress WHERE version = ?', (version,))
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+            applied.append(version)
+            if progress:
+                progress(len(applied), len(pending))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return applied
+
+
+# ---------------------------------------------------------------------------
+# Migration steps
+# ---------------------------------------------------------------------------
+
+SCRIPTURE_COLUMNS = 'id, version_id, book, chapter, verse, text, format_type, created_at'
+
+
+@migration(1, 'remove paragraph_number and poetry_line_number from scripture')
+def remove_scripture_layout_columns(ctx):
+    """Rebuild scripture without the old layout columns"""
+    conn = ctx.conn
+    columns = table_columns(conn, 'scripture')
+    if 'paragraph_number' not in columns and 'poetry_line_number' not in columns:
+        ctx.log("  Columns already removed or never existed.")
+        return
+
+    # The rebuilt table doubles as the resume point: whatever is already in
+    # it has been copied, so each chunk starts after its highest id.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scripture_rebuild (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version_id INTEGER NOT NULL,
+            book TEXT NOT NULL,
+            chapter INTEGER NOT NULL,
+            verse INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            format_type TEXT DEFAULT 'paragraph',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (version_id) REFERENCES bible_versions (id) ON DELETE CASCADE,
+            UNIQUE(version_id, book, chapter, verse)
+        )
+    ''')
+
+    total = conn.execute('SELECT COUNT(*) FROM scripture').fetchone()[0]
+    copied = conn.execute('SELECT COUNT(*) FROM scripture_rebuild').fetchone()[0]
+    while True:
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM scripture_rebuild').fetchone()[0]
+        cursor = conn.execute(f'''
+            INSERT INTO scripture_rebuild ({SCRIPTURE_COLUMNS})
+            SELECT {SCRIPTURE_COLUMNS} FROM scripture
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, ctx.chunk_size))
+        conn.commit()
+        if cursor.rowcount <= 0:
+            break
+        copied += cursor.rowcount
+        ctx.report('scripture', copied, total)
+
+    conn.execute('BEGIN')
+    conn.execute('DROP TABLE scripture')
+    conn.execute('ALTER TABLE scripture_rebuild RENAME TO scripture')
+
+
+@migration(2, 'convert scripture_highlights to scripture_tags')
+def highlights_to_tags(ctx):
+    """Convert scripture_id/word_index highlights to position-string tags"""
+    conn = ctx.conn
+    if not table_exists(conn, 'scripture_highlights'):
+        ctx.log("  No scripture_highlights table found. Migration not needed.")
+        return
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scripture_tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_id INTEGER,
+            version TEXT NOT NULL,
+            start_position TEXT NOT NULL,
+            end_position TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Databases converted by the old one-shot migrate_to_tags.py already have
+    # their tags; only copy when nothing is there yet or a previous run of
+    # this step left a resume point.
+    started = conn.execute(
+        'SELECT 1 FROM schema_migration_progress WHERE version = ?', (ctx.version,)
+    ).fetchone()
+    has_tags = conn.execute('SELECT 1 FROM scripture_tags LIMIT 1').fetchone()
+    if has_tags and not started:
+        ctx.log("  scripture_tags already populated. Skipping copy.")
+        return
+
+    version_map = dict(conn.execute('SELECT id, abbreviation FROM bible_versions'))
+    total = conn.execute('SELECT COUNT(*) FROM scripture_highlights').fetchone()[0]
+
+    def to_tag(row):
+        (highlight_id, topic_id, start_word, end_word, created_at,
+         start_book, start_chapter, start_verse, start_version_id,
+         end_book, end_chapter, end_verse, end_version_id) = row
+        # Use start version, fallback to end version
+        version_id = start_version_id or end_version_id
+        if not version_id:
+            ctx.log(f"  Warning: Highlight {highlight_id} has no version, skipping...")
+            return None
+        return (
+            topic_id,
+            version_map.get(version_id, 'WEB'),
+            f"{book_abbreviation(start_book)} {start_chapter}:{start_verse}.{start_word}",
+            f"{book_abbreviation(end_book)} {end_chapter}:{end_verse}.{end_word}",
+            created_at,
+        )
+
+    migrated, skipped = copy_in_chunks(
+        ctx, 'scripture_highlights',
+        '''
+            SELECT h.id, h.topic_id, h.start_word_index, h.end_word_index, h.created_at,
+                   s1.book, s1.chapter, s1.verse, s1.version_id,
+                   s2.book, s2.chapter, s2.verse, s2.version_id
+            FROM scripture_highlights h
+            JOIN scripture s1 ON h.start_scripture_id = s1.id
+            JOIN scripture s2 ON h.end_scripture_id = s2.id
+            WHERE h.id > ?
+            ORDER BY h.id
+            LIMIT ?
+        ''',
+        '''
+            INSERT INTO scripture_tags (topic_id, version, start_position, end_position, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''',
+        transform=to_tag,
+        total=total,
+    )
+    ctx.log(f"  Migrated: {migrated - skipped} tags, skipped: {skipped}")
+    ctx.log("  Note: The old scripture_highlights table has been preserved.")
+
+
+@migration(3, 'add numeric start_key/end_key to scripture_tags')
+def add_tag_position_keys(ctx):
+    """Backfill sortable integer keys for tag start/end positions"""
+    conn = ctx.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scripture_tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_id INTEGER,
+            version TEXT NOT NULL,
+            start_position TEXT NOT NULL,
+            end_position TEXT NOT NULL,
+            start_key INTEGER,
+            end_key INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
+        )
+    ''')
+    columns = table_columns(conn, 'scripture_tags')
+    if 'start_key' not in columns:
+        conn.execute('ALTER TABLE scripture_tags ADD COLUMN start_key INTEGER')
+    if 'end_key' not in columns:
+        conn.execute('ALTER TABLE scripture_tags ADD COLUMN end_key INTEGER')
+
+    total = conn.execute('SELECT COUNT(*) FROM scripture_tags WHERE start_key IS NULL').fetchone()[0]
+    copy_in_chunks(
+        ctx, 'scripture_tags',
+        '''
+            SELECT id, start_position, end_position FROM scripture_tags
+            WHERE id > ? AND start_key IS NULL
+            ORDER BY id
+            LIMIT ?
+        ''',
+        'UPDATE scripture_tags SET start_key = ?, end_key = ? WHERE id = ?',
+        transform=lambda row: (position_string_key(row[1]), position_string_key(row[2]), row[0]),
+        total=total,
+    )
+
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scripture_tags_topic_key
+        ON scripture_tags (topic_id, version, start_key)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scripture_tags_version_key
+        ON scripture_tags (version, start_key)
+    ''')
+
+
+@migration(4, 'add concordance postings tables')
+def add_concordance_tables(ctx):
+    """Tables for the inverted word index built by concordance.py"""
+    conn = ctx.conn
+    # One delta-encoded postings list per (version, normalized word)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS concordance_postings (
+            version_id INTEGER NOT NULL,
+            word TEXT NOT NULL,
+            occurrences INTEGER NOT NULL,
+            postings BLOB NOT NULL,
+            PRIMARY KEY (version_id, word)
+        )
+    ''')
+    # Words from verses added since the last build, one row per occurrence
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS concordance_pending (
+            version_id INTEGER NOT NULL,
+            word TEXT NOT NULL,
+            position_key INTEGER NOT NULL,
+            scripture_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_concordance_pending_word
+        ON concordance_pending (word, version_id)
+    ''')
+
+
+@migration(5, 'add related topic tables')
+def add_topic_graph_tables(ctx):
+    """Tables for the co-occurrence neighbours built by topic_graph.py"""
+    conn = ctx.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS topic_related (
+            topic_id INTEGER NOT NULL,
+            related_topic_id INTEGER NOT NULL,
+            shared_verses INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (topic_id, related_topic_id)
+        )
+    ''')
+    # Fingerprint of each topic's tags and links as of the last refresh
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS topic_graph_state (
+            topic_id INTEGER PRIMARY KEY,
+            fingerprint TEXT NOT NULL
+        )
+    ''')
+
+
+@migration(6, 'add tag_rules table')
+def add_tag_rules(ctx):
+    """Phrase/regex rules applied across the corpus by auto_tag.py"""
+    conn = ctx.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tag_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_id INTEGER NOT NULL,
+            pattern TEXT NOT NULL,
+            is_regex INTEGER NOT NULL DEFAULT 0,
+            version TEXT,
+            book TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
+        )
+    ''')
+
+
+@migration(7, 'add topic hierarchy and closure table')
+def add_topic_hierarchy(ctx):
+    """topics.parent_id plus the trigger-maintained topic_closure table"""
+    ensure_topic_tree(ctx.conn)
+
+
+@migration(8, 'add compressed chapter text tables')
+def add_chapter_text_tables(ctx):
+    """Storage for versions compressed by text_store.py"""
+    conn = ctx.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS text_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version_id INTEGER NOT NULL,
+            dictionary BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # One zstd frame per chapter holding the JSON [[verse, text], ...] list
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chapter_text (
+            version_id INTEGER NOT NULL,
+            book TEXT NOT NULL,
+            chapter INTEGER NOT NULL,
+            dictionary_id INTEGER,
+            data BLOB NOT NULL,
+            PRIMARY KEY (version_id, book, chapter)
+        )
+    ''')
+
+
+@migration(9, 'add chapter_manifest table')
+def add_chapter_manifest(ctx):
+    """Per-chapter verse counts and content hashes kept by corpus_manifest.py"""
+    conn = ctx.conn
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chapter_manifest (
+            version_id INTEGER NOT NULL,
+            book TEXT NOT NULL,
+            chapter INTEGER NOT NULL,
+            verse_count INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (version_id, book, chapter)
+        ) WITHOUT ROWID
+    ''')
+
+    # Hash the chapters already present, a few at a time (each keyed by its
+    # first verse id); ChapterTextCache reads compressed ones
+    from corpus_manifest import update_chapter
+    from text_store import ChapterTextCache
+    texts = ChapterTextCache(max_chapters=8)
+
+    def hash_chapters(rows):
+        for _, version_id, book, chapter in rows:
+            update_chapter(conn, version_id, book, chapter, texts)
+
+    total = conn.execute(
+        'SELECT COUNT(*) FROM (SELECT DISTINCT version_id, book, chapter FROM scripture)'
+    ).fetchone()[0]
+    hashed = process_in_chunks(ctx, 'chapters hashed', '''
+        SELECT MIN(id) AS first_id, version_id, book, chapter FROM scripture
+        GROUP BY version_id, book, chapter
+        HAVING first_id > ?
+        ORDER BY first_id
+        LIMIT ?
+    ''', hash_chapters, total, chunk_size=max(1, ctx.chunk_size // CHAPTER_CHUNK_VERSES))
+    ctx.log(f"  hashed {hashed} chapters")
+
+
+@migration(10, 'add scripture_catalog table')
+def add_scripture_catalog(ctx):
+    """Per-chapter verse counts for the navigator, kept by triggers on scripture"""
+    from catalog import ensure_catalog
+    ensure_catalog(ctx.conn)
+    chapters = ctx.conn.execute('SELECT COUNT(*) FROM scripture_catalog').fetchone()[0]
+    ctx.log(f"  catalogued {chapters} chapters")
+
+
+@migration(11, 'add jobs table')
+def add_jobs(ctx):
+    """Background job queue and progress used by jobs.py"""
+    ctx.conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'queued',
+            done INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            pid INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    ctx.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, type)')
+
+
+@migration(12, 'add tag_depth tables')
+def add_tag_depth(ctx):
+    """Run-length tag coverage depth per version, built by tag_depth.py"""
+    ctx.conn.execute('''
+        CREATE TABLE IF NOT EXISTS tag_depth (
+            version TEXT NOT NULL,
+            start_key INTEGER NOT NULL,
+            end_key INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (version, start_key)
+        ) WITHOUT ROWID
+    ''')
+    ctx.conn.execute('CREATE INDEX IF NOT EXISTS idx_tag_depth_start ON tag_depth (start_key)')
+    ctx.conn.execute('CREATE INDEX IF NOT EXISTS idx_tag_depth_depth ON tag_depth (depth)')
+    ctx.conn.execute('''
+        CREATE TABLE IF NOT EXISTS tag_depth_state (
+            version TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            max_depth INTEGER NOT NULL,
+            built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def print_status(database):
+    conn = sqlite3.connect(database)
+    ensure_migration_tables(conn)
+    applied = dict(conn.execute('SELECT version, applied_at FROM schema_version'))
+    progress = dict(conn.execute('SELECT version, rows_done FROM schema_migration_progress'))
+    conn.close()
+
+    for version, name, _ in MIGRATIONS:
+        if version in applied:
+            state = f"applied {applied[version]}"
+        elif version in progress:
+            state = f"interrupted after {progress[version]} rows"
+        else:
+            state = "pending"
+        print(f"{version:4d}  {name} ({state})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply VerseIndex schema migrations')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print("Database doesn't exist. It will be created on first run.")
+        return 0
+
+    if args.status:
+        print_status(args.database)
+        return 0
+
+    try:
+        applied = run_migrations(args.database, chunk_size=args.chunk_size)
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        import traceback
+        traceback.print_exc()
+        print("Rerun to resume from the last committed chunk.")
+        return 1
+
+    if applied:
+        print(f"Applied {len(applied)} migration(s).")
+    else:
+        print("Database is up to date.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
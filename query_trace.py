@@ -0,0 +1,247 @@
+"""
+Per-request SQL tracing with repeated-statement (N+1) detection
+
+When tracing is on, get_db() wraps its connection so every statement run
+through it is recorded with its normalized text (literals and IN/VALUES
+lists collapsed), elapsed time and row count. Statements are grouped per
+request and per page load: the client tags each request with an
+X-Page-Load id, so one chapter open that fires a request per verse shows
+up as one page load running the same statement dozens of times.
+
+A statement is flagged once it runs more than the threshold number of times
+within a request, or across the requests of a page load.
+"""
+
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+DEFAULT_REPEAT_THRESHOLD = 10
+MAX_TRACES = 200
+MAX_PAGE_LOADS = 100
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_RE = re.compile(r'(VALUES\s*\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Collapse a statement to its shape: literals and lists become ?"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _SPACE_RE.sub(' ', sql).strip()
+    sql = _LIST_RE.sub('(?...)', sql)
+    return _VALUES_RE.sub(r'\1', sql)
+
+
+class RequestTrace:
+    """Statements run while handling one request"""
+
+    def __init__(self, method, path, page_load=None, route=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route = route or path
+        self.page_load = page_load
+        self.started = time.time()
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def record(self, sql, seconds, rows):
+        with self._lock:
+            self.statements.append({'sql': normalize(sql), 'ms': seconds * 1000, 'rows': rows})
+
+    def counts(self):
+        return Counter(statement['sql'] for statement in self.statements)
+
+    def summary(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        counts = self.counts()
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'page_load': self.page_load,
+            'queries': len(self.statements),
+            'distinct_queries': len(counts),
+            'total_ms': round(sum(s['ms'] for s in self.statements), 3),
+            'repeated': [
+                {'sql': sql, 'count': count}
+                for sql, count in counts.most_common() if count > threshold
+            ],
+        }
+
+    def details(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        data = self.summary(threshold)
+        data['statements'] = [dict(s, ms=round(s['ms'], 3)) for s in self.statements]
+        return data
+
+
+class TraceStore:
+    """Recent request traces plus running per-page-load statement counts"""
+
+    def __init__(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._traces = deque(maxlen=MAX_TRACES)
+        self._by_id = {}
+        self._page_loads = OrderedDict()
+
+    def add(self, trace):
+        """Store a finished trace; returns statements repeated across its page load"""
+        with self._lock:
+            if len(self._traces) == self._traces.maxlen:
+                self._by_id.pop(self._traces[0].id, None)
+            self._traces.append(trace)
+            self._by_id[trace.id] = trace
+
+            if not trace.page_load:
+                return []
+            page = self._page_loads.pop(trace.page_load, None) or {
+                'requests': 0, 'queries': 0, 'counts': Counter(), 'routes': Counter()
+            }
+            page['requests'] += 1
+            page['queries'] += len(trace.statements)
+            page['counts'].update(trace.counts())
+            page['routes'][f'{trace.method} {trace.route}'] += 1
+            self._page_loads[trace.page_load] = page
+            while len(self._page_loads) > MAX_PAGE_LOADS:
+                self._page_loads.popitem(last=False)
+            return [
+                {'sql': sql, 'count': count}
+                for sql, count in page['counts'].most_common() if count > self.threshold
+            ]
+
+    def get(self, trace_id):
+        with self._lock:
+            trace = self._by_id.get(trace_id)
+        return trace.details(self.threshold) if trace else None
+
+    def recent(self, limit=50):
+        with self._lock:
+            traces = list(self._traces)[-limit:]
+        return [trace.summary(self.threshold) for trace in reversed(traces)]
+
+    def page_load(self, page_id):
+        with self._lock:
+            page = self._page_loads.get(page_id)
+            if page is None:
+                return None
+            return {
+                'page_load': page_id,
+                'requests': page['requests'],
+                'queries': page['queries'],
+                'routes': dict(page['routes'].most_common()),
+                'repeated': [
+                    {'sql': sql, 'count': count}
+                    for sql, count in page['counts'].most_common() if count > self.threshold
+                ],
+            }
+
+
+class TracedCursor:
+    """Cursor proxy that times statements and counts the rows they return"""
+
+    def __init__(self, cursor, trace):
+        self._cursor = cursor
+        self._trace = trace
+        self._pending = None  # [sql, seconds, rows] of the statement being fetched
+
+    def _flush(self):
+        if self._pending is not None:
+            self._trace.record(*self._pending)
+            self._pending = None
+
+    def _timed(self, method, sql, *args):
+        self._flush()
+        started = time.perf_counter()
+        method(sql, *args)
+        elapsed = time.perf_counter() - started
+        if self._cursor.description is None:
+            # Not a SELECT: record now with the rows it changed
+            self._trace.record(sql, elapsed, max(self._cursor.rowcount, 0))
+        else:
+            self._pending = [sql, elapsed, 0]
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self._timed(self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(self._cursor.executemany, sql, seq_of_parameters)
+
+    def _fetched(self, started, rows):
+        if self._pending is not None:
+            self._pending[1] += time.perf_counter() - started
+            self._pending[2] += rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(started, len(rows))
+        self._flush()
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                self._flush()
+                return
+            yield row
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """Connection proxy whose cursors and execute() calls are traced"""
+
+    def __init__(self, conn, trace):
+        self._conn = conn
+        self._trace = trace
+        self._cursors = []
+
+    def cursor(self, *args):
+        cursor = TracedCursor(self._conn.cursor(*args), self._trace)
+        self._cursors.append(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor._flush()
+        self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self._conn, name, value)
@@ -0,0 +1,147 @@
+"""
+In-process LRU cache for read responses, invalidated by dependency tags
+
+Each entry is stored with the dependency tags it was computed from, such as
+('topics',) or ('chapter', 'John', 3). Write routes invalidate the tags they
+touch, which drops every entry that depends on them. The cache is bounded
+by entry count and by total bytes (least recently used entries go first),
+and entries also expire after a TTL, which bounds staleness for writes made
+outside the app (scripts, the CLI tools).
+
+Every tag has a generation number that invalidation bumps. A reader takes a
+snapshot of its tags' generations before running its queries and the entry
+is only stored if none of them changed meanwhile, so a write that lands
+while a read is in flight can never leave the old result cached.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 300
+
+
+class ResultCache:
+    """LRU of (value, size) entries with per-tag invalidation"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires, tags)
+        self._keys_by_tag = {}
+        self._generations = {}
+        self._epoch = 0
+        self._listeners = []
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def configure(self, max_entries, max_bytes, ttl):
+        """Change the limits in place, evicting whatever no longer fits"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get(self, key):
+        """The cached value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def snapshot(self, tags):
+        """Generations of tags, to hand back to put()"""
+        with self._lock:
+            return self._epoch, tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def put(self, key, value, size, tags, snapshot):
+        """Store value unless one of its tags was invalidated since snapshot"""
+        tags = tuple(tags)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if snapshot != (self._epoch, tuple(self._generations.get(tag, 0) for tag in tags)):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl, tags)
+            self.bytes += size
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def invalidate(self, *tags):
+        """Drop every entry that depends on any of tags"""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in self._keys_by_tag.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+        self._notify(tags)
+
+    def clear(self):
+        """Drop everything, e.g. after a bulk change"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.bytes = 0
+        self._notify(None)
+
+    def add_listener(self, callback):
+        """Call callback(tags) after every invalidation; tags is None after clear()"""
+        self._listeners.append(callback)
+
+    def _notify(self, tags):
+        for callback in self._listeners:
+            callback(tags)
+
+    def _remove(self, key):
+        value, size, expires, tags = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
@@ -4,33 +4,52 @@ let currentBook = null;
 let currentChapter = null;
 let currentVersionId = null;
 let availableVersions = [];
+let bookAbbreviations = {}; // Book name -> position abbreviation, from /api/books
+let booksReady = null; // Promise of loadBooks(); tags can't be created until it succeeds
+let bookCatalog = []; // Loaded books with their chapters and verse counts, from /api/catalog
 
-// Standard Protestant Bible books in order
-const BIBLE_BOOKS = [
-    // Old Testament
-    'Genesis', 'Exodus', 'Leviticus', 'Numbers', 'Deuteronomy',
-    'Joshua', 'Judges', 'Ruth', '1 Samuel', '2 Samuel',
-    '1 Kings', '2 Kings', '1 Chronicles', '2 Chronicles', 'Ezra',
-    'Nehemiah', 'Esther', 'Job', 'Psalms', 'Proverbs',
-    'Ecclesiastes', 'Song of Songs', 'Isaiah', 'Jeremiah', 'Lamentations',
-    'Ezekiel', 'Daniel', 'Hosea', 'Joel', 'Amos',
-    'Obadiah', 'Jonah', 'Micah', 'Nahum', 'Habakkuk',
-    'Zephaniah', 'Haggai', 'Zechariah', 'Malachi',
-    // New Testament
-    'Matthew', 'Mark', 'Luke', 'John', 'Acts',
-    'Romans', '1 Corinthians', '2 Corinthians', 'Galatians', 'Ephesians',
-    'Philippians', 'Colossians', '1 Thessalonians', '2 Thessalonians', '1 Timothy',
-    '2 Timothy', 'Titus', 'Philemon', 'Hebrews', 'James',
-    '1 Peter', '2 Peter', '1 John', '2 John', '3 John',
-    'Jude', 'Revelation'
-];
-
-// Load Bible navigator on page load
+// Tag every request with an id for this page load, so server-side query
+// tracing can group the requests one page view makes
+const PAGE_LOAD_ID = Math.random().toString(36).slice(2, 14);
+const nativeFetch = window.fetch.bind(window);
+window.fetch = (resource, options = {}) => {
+    const headers = new Headers(options.headers || {});
+    headers.set('X-Page-Load', PAGE_LOAD_ID);
+    return nativeFetch(resource, { ...options, headers });
+};
+
+// Load Bible navigator on page load (after the default version is chosen)
 document.addEventListener('DOMContentLoaded', () => {
-    loadVersions();
-    renderBibleNavigator();
+    booksReady = loadBooks();
+    loadVersions().then(renderBibleNavigator);
 });
 
+// Load the canonical book table used for position abbreviations (false if it failed)
+async function loadBooks() {
+    try {
+        const response = await fetch('/api/books');
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const books = await response.json();
+        books.forEach(book => {
+            bookAbbreviations[book.name] = book.abbreviation;
+        });
+        return true;
+    } catch (error) {
+        console.error('Error loading books:', error);
+        return false;
+    }
+}
+
+// Wait for the book table, loading it again if the page-load request failed
+async function ensureBooks() {
+    if (!(await booksReady)) {
+        booksReady = loadBooks();
+    }
+    return booksReady;
+}
+
 // Load available Bible versions
 async function loadVersions() {
     try {
@@ -67,78 +86,88 @@ function changeVersion() {
     const selector = document.getElementById('version-selector');
     currentVersionId = selector.value ? parseInt(selector.value) : null;
     
-    // If a book and chapter are currently selected, reload them
-    if (currentBook && currentChapter) {
-        selectChapter(currentBook, currentChapter);
-    } else if (currentBook) {
-        // Just book selected, reload chapters
-        selectBook(currentBook);
-    }
+    // Reload the catalog for the new version, then the current book and chapter
+    renderBibleNavigator().then(() => {
+        if (currentBook && currentChapter) {
+            selectChapter(currentBook, currentChapter);
+        } else if (currentBook) {
+            // Just book selected, reload chapters
+            selectBook(currentBook);
+        }
+    });
 }
 
-// Render the Bible navigator (all books)
-function renderBibleNavigator() {
+// Render the Bible navigator (every book loaded in the current version)
+async function renderBibleNavigator() {
     const navigator = document.getElementById('bible-navigator');
     
-    navigator.innerHTML = BIBLE_BOOKS.map((book, index) => {
-        const isOT = index < 39; // Old Testament has 39 books
+    try {
+        let url = '/api/catalog';
+        if (currentVersionId) {
+            url += `?version_id=${currentVersionId}`;
+        }
+        const response = await fetch(url);
+        bookCatalog = await response.json();
+    } catch (error) {
+        console.error('Error loading catalog:', error);
+        navigator.innerHTML = '<p class="error">Failed to load books. Please try again.</p>';
+        return;
+    }
+    
+    if (bookCatalog.length === 0) {
+        navigator.innerHTML = '<p class="placeholder">No scripture loaded for this version.</p>';
+        return;
+    }
+    
+    navigator.innerHTML = bookCatalog.map(book => {
+        const isOT = book.testament === 'OT';
         return `
             <div class="book-item ${isOT ? 'old-testament' : 'new-testament'}" 
-                 onclick="selectBook('${book}')">
-                ${book}
+                 title="${book.chapters.length} chapter${book.chapters.length !== 1 ? 's' : ''}"
+                 onclick="selectBook('${book.name}')">
+                ${book.name}
             </div>
         `;
     }).join('');
 }
 
 // Select a book
-async function selectBook(bookName) {
+function selectBook(bookName) {
     currentBook = bookName;
     currentChapter = null;
     currentVerseId = null;
     selectedTagRange = null; // Clear selected tag when selecting a book
     
-    try {
-        // Get chapters for this book (filter by version if selected)
-        let url = `/api/scripture/book/${encodeURIComponent(bookName)}/chapters`;
-        if (currentVersionId) {
-            url += `?version_id=${currentVersionId}`;
-        }
-        const response = await fetch(url);
-        const chapters = await response.json();
-        
-        if (chapters.length === 0) {
-            document.getElementById('middle-pane-title').textContent = bookName;
-            document.getElementById('scripture-content').innerHTML = 
-                `<p class="placeholder">No scripture found for ${bookName}. You can add verses for this book.</p>`;
-            document.getElementById('topics-content').innerHTML = 
-                '<p class="placeholder">Select a scripture verse to see related topics</p>';
-            return;
-        }
-        
-        // Hide Bible navigator
-        document.getElementById('bible-navigator').style.display = 'none';
-        
-        // Update middle pane
+    // Chapters come from the catalog loaded with the navigator
+    const book = bookCatalog.find(entry => entry.name === bookName);
+    const chapters = book ? book.chapters.map(entry => entry.chapter) : [];
+    
+    if (chapters.length === 0) {
         document.getElementById('middle-pane-title').textContent = bookName;
         document.getElementById('scripture-content').innerHTML = 
-            '<p class="placeholder">Select a chapter to view scripture</p>';
-        
-        // Clear topics
+            `<p class="placeholder">No scripture found for ${bookName}. You can add verses for this book.</p>`;
         document.getElementById('topics-content').innerHTML = 
             '<p class="placeholder">Select a scripture verse to see related topics</p>';
-        
-        // Show chapters
-        renderChapters(bookName, chapters);
-        
-        // Update active state
-        updateActiveBook(bookName);
-        
-    } catch (error) {
-        console.error('Error loading chapters:', error);
-        document.getElementById('scripture-content').innerHTML = 
-            '<p class="error">Failed to load chapters. Please try again.</p>';
+        return;
     }
+    
+    // Hide Bible navigator
+    document.getElementById('bible-navigator').style.display = 'none';
+    
+    // Update middle pane
+    document.getElementById('middle-pane-title').textContent = bookName;
+    document.getElementById('scripture-content').innerHTML = 
+        '<p class="placeholder">Select a chapter to view scripture</p>';
+    
+    // Clear topics
+    document.getElementById('topics-content').innerHTML = 
+        '<p class="placeholder">Select a scripture verse to see related topics</p>';
+    
+    // Show chapters
+    renderChapters(bookName, chapters);
+    
+    // Update active state
+    updateActiveBook(bookName);
 }
 
 // Render chapters for selected book
@@ -581,14 +610,19 @@ async function showSelection() {
     
     // Get verse details to display book, chapter, verse
     try {
-        const startVerseResponse = await fetch(`/api/scripture/${normalizedStart.verseId}`);
-        const startVerse = await startVerseResponse.json();
-        
-        const endVerseResponse = await fetch(`/api/scripture/${normalizedEnd.verseId}`);
-        const endVerse = await endVerseResponse.json();
+        const versesById = await fetchVerses([normalizedStart.verseId, normalizedEnd.verseId]);
+        const startVerse = versesById.get(normalizedStart.verseId);
+        const endVerse = versesById.get(normalizedEnd.verseId);
         
+        // Positions need the real abbreviations; don't offer to save without them
+        await ensureBooks();
         const startAbbr = getBookAbbreviation(startVerse.book);
         const endAbbr = getBookAbbreviation(endVerse.book);
+        if (!startAbbr || !endAbbr) {
+            document.getElementById('selection-content').innerHTML =
+                '<p class="error">Could not load the book list. Please reload the page to create highlights.</p>';
+            return;
+        }
         
         // Convert to 1-based display (wordIndex is 0-based internally)
         const startDisplayWordIndex = normalizedStart.wordIndex + 1;
@@ -597,21 +631,17 @@ async function showSelection() {
         // Format: Gen 1:1.1 - Gen 1:2.5 (1-based display)
         const selectionText = `${startAbbr} ${startVerse.chapter}:${startVerse.verse}.${startDisplayWordIndex} - ${endAbbr} ${endVerse.chapter}:${endVerse.verse}.${endDisplayWordIndex}`;
         
-        // Get topics for selection pane
-        const topicsResponse = await fetch('/api/topics');
-        const topics = await topicsResponse.json();
+        // Get the most used topics for the picker; typing narrows them down
+        const topics = await fetchTopicSuggestions('');
         
         const selectionContent = document.getElementById('selection-content');
         selectionContent.innerHTML = `
             <div class="selection-display">
                 <div class="selection-reference">${selectionText}</div>
                 <label class="selection-label">Link to Topic (optional):</label>
+                <input type="text" id="topic-search" class="new-topic-input" placeholder="Search topics..." oninput="searchTopics()" />
                 <select id="highlight-topic-select" class="selection-topic-select" onchange="toggleNewTopicInput()">
-                    <option value="">No topic</option>
-                    <option value="__new__">+ Create New Topic</option>
-                    ${topics.map(topic => 
-                        `<option value="${topic.id}">${topic.name}</option>`
-                    ).join('')}
+                    ${renderTopicOptions(topics)}
                 </select>
                 <div id="new-topic-form" class="new-topic-form" style="display: none;">
                     <label class="selection-label">Topic Name:</label>
@@ -633,6 +663,55 @@ async function showSelection() {
 }
 
 
+// Number of topics shown in the selection pane picker
+const TOPIC_SUGGESTION_LIMIT = 20;
+let topicSearchTimeout = null;
+
+// Fetch the best matching topics for a name prefix
+async function fetchTopicSuggestions(query) {
+    const response = await fetch(`/api/topics/suggest?q=${encodeURIComponent(query)}&limit=${TOPIC_SUGGESTION_LIMIT}`);
+    return await response.json();
+}
+
+// Build the options for the topic picker
+function renderTopicOptions(topics) {
+    return `
+        <option value="">No topic</option>
+        <option value="__new__">+ Create New Topic</option>
+        ${topics.map(topic => 
+            `<option value="${topic.id}">${escapeHtml(topic.name)}</option>`
+        ).join('')}
+    `;
+}
+
+// Refresh the topic picker as the user types (debounced)
+function searchTopics() {
+    if (topicSearchTimeout) {
+        clearTimeout(topicSearchTimeout);
+    }
+    topicSearchTimeout = setTimeout(async () => {
+        const input = document.getElementById('topic-search');
+        const select = document.getElementById('highlight-topic-select');
+        if (!input || !select) return;
+        
+        try {
+            const topics = await fetchTopicSuggestions(input.value);
+            const previous = select.value;
+            select.innerHTML = renderTopicOptions(topics);
+            // Keep the current choice if it is still in the list, otherwise
+            // preselect the best match
+            if (Array.from(select.options).some(option => option.value === previous) && previous !== '') {
+                select.value = previous;
+            } else if (topics.length > 0 && input.value.trim()) {
+                select.value = topics[0].id;
+            }
+            toggleNewTopicInput();
+        } catch (error) {
+            console.error('Error searching topics:', error);
+        }
+    }, 150);
+}
+
 // Toggle new topic input form
 function toggleNewTopicInput() {
     const select = document.getElementById('highlight-topic-select');
@@ -647,6 +726,11 @@ function toggleNewTopicInput() {
 
 // Create tag (highlight)
 async function createHighlight(startVerseId, startWordIndex, endVerseId, endWordIndex) {
+    if (!(await ensureBooks())) {
+        alert('Could not load the book list. Please try again.');
+        return;
+    }
+    
     const topicSelect = document.getElementById('highlight-topic-select');
     let topicId = topicSelect.value;
     
@@ -690,11 +774,9 @@ async function createHighlight(startVerseId, startWordIndex, endVerseId, endWord
     
     // Get verse details to create position strings
     try {
-        const startVerseResponse = await fetch(`/api/scripture/${startVerseId}`);
-        const startVerse = await startVerseResponse.json();
-        
-        const endVerseResponse = await fetch(`/api/scripture/${endVerseId}`);
-        const endVerse = await endVerseResponse.json();
+        const versesById = await fetchVerses([startVerseId, endVerseId]);
+        const startVerse = versesById.get(startVerseId);
+        const endVerse = versesById.get(endVerseId);
         
         // Get current version abbreviation
         const version = availableVersions.find(v => v.id === currentVersionId);
@@ -706,6 +788,10 @@ async function createHighlight(startVerseId, startWordIndex, endVerseId, endWord
         // Create position strings (word index is 0-based)
         const startPosition = createPosition(startVerse.book, startVerse.chapter, startVerse.verse, startWordIndex);
         const endPosition = createPosition(endVerse.book, endVerse.chapter, endVerse.verse, endWordIndex);
+        if (!startPosition || !endPosition) {
+            alert(`Unknown book: ${startPosition ? endVerse.book : startVerse.book}`);
+            return;
+        }
         
         // Create the tag
         const response = await fetch('/api/scripture/tags', {
@@ -842,6 +928,28 @@ document.addEventListener('dragstart', (event) => {
     }
 }, true);
 
+// Above this many ids the lookup is POSTed instead of put in the query string
+const MAX_GET_VERSE_IDS = 200;
+
+// Fetch several verses in one request; returns Map<verseId, verse>
+async function fetchVerses(verseIds) {
+    const uniqueIds = Array.from(new Set(verseIds));
+    let response;
+    if (uniqueIds.length > MAX_GET_VERSE_IDS) {
+        response = await fetch('/api/scripture/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ ids: uniqueIds })
+        });
+    } else {
+        response = await fetch(`/api/scripture?ids=${uniqueIds.join(',')}`);
+    }
+    const verses = await response.json();
+    return new Map(verses.map(verse => [verse.id, verse]));
+}
+
 // Display content in middle pane
 function displayScriptureContent(html) {
     document.getElementById('scripture-content').innerHTML = html;
@@ -887,8 +995,7 @@ async function selectVerse(verseId) {
     
     try {
         // Get verse details
-        const verseResponse = await fetch(`/api/scripture/${verseId}`);
-        const verse = await verseResponse.json();
+        const verse = (await fetchVerses([verseId])).get(verseId);
         
         // Get related topics
         const topicsResponse = await fetch(`/api/scripture/${verseId}/topics`);
@@ -914,7 +1021,9 @@ async function selectVerse(verseId) {
 
 // Store all chapter topics and verse-to-topic mapping
 let allChapterTopics = [];
-let topicToVersesMap = new Map(); // Map<topicId, Set<verseId>>
+let topicBitIndex = new Map(); // Map<topicId, bit position> from /api/scripture/topic-bitsets
+let verseTopicBits = new Map(); // Map<verseId, BigInt> - topics covering each verse, one bit per topic
+let visibleTopicBits = 0n; // OR of verseTopicBits over the visible verses
 let topicToHighlightsMap = new Map(); // Map<topicId, Array<highlight>> - stores highlight details for formatting
 let visibleVerseIds = new Set();
 let topicsIntersectionObserver = null;
@@ -927,16 +1036,10 @@ function displayTopics(topics, filterByVisibility = false) {
     // If filtering by visibility, only show topics for visible verses
     let topicsToShow = topics;
     if (filterByVisibility) {
+        // Show topic if its bit is set for any visible verse
         topicsToShow = topics.filter(topic => {
-            const topicVerses = topicToVersesMap.get(topic.id);
-            if (!topicVerses || topicVerses.size === 0) return false;
-            // Show topic if any of its verses are visible
-            for (const verseId of topicVerses) {
-                if (visibleVerseIds.has(verseId)) {
-                    return true;
-                }
-            }
-            return false;
+            const bit = topicBitIndex.get(topic.id);
+            return bit !== undefined && ((visibleTopicBits >> BigInt(bit)) & 1n) === 1n;
         });
     }
     
@@ -989,29 +1092,9 @@ function displayTopics(topics, filterByVisibility = false) {
     }
 }
 
-// Get book abbreviation helper function
+// Get the position abbreviation of a book, or null if the book table doesn't have it
 function getBookAbbreviation(bookName) {
-    const abbrevs = {
-        'Genesis': 'Gen', 'Exodus': 'Ex', 'Leviticus': 'Lev', 'Numbers': 'Num',
-        'Deuteronomy': 'Deut', 'Joshua': 'Josh', 'Judges': 'Judg', 'Ruth': 'Ruth',
-        '1 Samuel': '1 Sam', '2 Samuel': '2 Sam', '1 Kings': '1 Kgs', '2 Kings': '2 Kgs',
-        '1 Chronicles': '1 Chr', '2 Chronicles': '2 Chr', 'Ezra': 'Ezra',
-        'Nehemiah': 'Neh', 'Esther': 'Esth', 'Job': 'Job', 'Psalms': 'Ps',
-        'Proverbs': 'Prov', 'Ecclesiastes': 'Eccl', 'Song of Songs': 'Song',
-        'Isaiah': 'Isa', 'Jeremiah': 'Jer', 'Lamentations': 'Lam', 'Ezekiel': 'Ezek',
-        'Daniel': 'Dan', 'Hosea': 'Hos', 'Joel': 'Joel', 'Amos': 'Amos',
-        'Obadiah': 'Obad', 'Jonah': 'Jonah', 'Micah': 'Mic', 'Nahum': 'Nah',
-        'Habakkuk': 'Hab', 'Zephaniah': 'Zeph', 'Haggai': 'Hag', 'Zechariah': 'Zech',
-        'Malachi': 'Mal', 'Matthew': 'Matt', 'Mark': 'Mark', 'Luke': 'Luke',
-        'John': 'John', 'Acts': 'Acts', 'Romans': 'Rom', '1 Corinthians': '1 Cor',
-        '2 Corinthians': '2 Cor', 'Galatians': 'Gal', 'Ephesians': 'Eph',
-        'Philippians': 'Phil', 'Colossians': 'Col', '1 Thessalonians': '1 Thess',
-        '2 Thessalonians': '2 Thess', '1 Timothy': '1 Tim', '2 Timothy': '2 Tim',
-        'Titus': 'Titus', 'Philemon': 'Phlm', 'Hebrews': 'Heb', 'James': 'James',
-        '1 Peter': '1 Pet', '2 Peter': '2 Pet', '1 John': '1 John', '2 John': '2 John',
-        '3 John': '3 John', 'Jude': 'Jude', 'Revelation': 'Rev'
-    };
-    return abbrevs[bookName] || bookName.substring(0, 4);
+    return bookAbbreviations[bookName] || null;
 }
 
 // Parse position string "Gen 1:1.0" into {bookAbbr, chapter, verse, wordIndex}
@@ -1031,20 +1114,10 @@ function parsePosition(positionString) {
 // Create position string from verse and word index (word index is 0-based)
 function createPosition(bookName, chapter, verse, wordIndex) {
     const bookAbbr = getBookAbbreviation(bookName);
+    if (!bookAbbr) return null;
     return `${bookAbbr} ${chapter}:${verse}.${wordIndex}`;
 }
 
-// Check if a verse matches a position string
-function verseMatchesPosition(verse, positionString) {
-    const pos = parsePosition(positionString);
-    if (!pos) return false;
-    
-    const verseBookAbbr = getBookAbbreviation(verse.book);
-    return verseBookAbbr === pos.bookAbbr && 
-           verse.chapter === pos.chapter && 
-           verse.verse === pos.verse;
-}
-
 // Load verse details for expanded topics
 async function loadVerseDetailsForTopics(topics) {
     for (const topic of topics) {
@@ -1124,20 +1197,16 @@ async function highlightTagRange(startPosition, endPosition) {
     
     // Get all verses in the current chapter to match positions
     const allVerses = Array.from(document.querySelectorAll('.verse-inline, .poetry-line'));
-    const verseDetailsMap = new Map();
+    const verseIds = allVerses
+        .map(verseEl => parseInt(verseEl.getAttribute('data-verse-id')))
+        .filter(verseId => verseId);
     
-    // First, fetch all verse details we need
-    for (const verseEl of allVerses) {
-        const verseId = parseInt(verseEl.getAttribute('data-verse-id'));
-        if (!verseId || verseDetailsMap.has(verseId)) continue;
-        
-        try {
-            const response = await fetch(`/api/scripture/${verseId}`);
-            const verse = await response.json();
-            verseDetailsMap.set(verseId, verse);
-        } catch (error) {
-            console.error(`Error loading verse ${verseId}:`, error);
-        }
+    // First, fetch all verse details we need in one request
+    let verseDetailsMap = new Map();
+    try {
+        verseDetailsMap = await fetchVerses(verseIds);
+    } catch (error) {
+        console.error('Error loading verses:', error);
     }
     
     // Now find and highlight words using the same logic as highlightWordsForTopic
@@ -1241,38 +1310,38 @@ let selectedTagRange = null; // Format: {startPosition, endPosition}
 
 // Build mapping from topics to verses
 async function buildTopicToVersesMap(topics, verses) {
-    topicToVersesMap.clear();
+    topicBitIndex.clear();
+    verseTopicBits.clear();
+    visibleTopicBits = 0n;
     topicToHighlightsMap.clear();
     
-    // Initialize map with all topics
     topics.forEach(topic => {
-        topicToVersesMap.set(topic.id, new Set());
         topicToHighlightsMap.set(topic.id, []);
     });
     
-    // Get verse-to-topic mappings from two sources:
-    // 1. scripture_topics table (direct links)
-    // 2. scripture_tags table (topics via tags)
+    if (!currentBook || !currentChapter) return;
     
-    // Get topics for each verse from scripture_topics
-    for (const verse of verses) {
-        try {
-            const topicsResponse = await fetch(`/api/scripture/${verse.id}/topics`);
-            const verseTopics = await topicsResponse.json();
-            verseTopics.forEach(topic => {
-                if (topicToVersesMap.has(topic.id)) {
-                    topicToVersesMap.get(topic.id).add(verse.id);
-                }
-            });
-        } catch (error) {
-            console.error(`Error loading topics for verse ${verse.id}:`, error);
+    // The server precomputes which topics cover each verse (direct links and
+    // tag spans) as one bitset per verse, so filtering is an OR of bitsets
+    try {
+        let url = `/api/scripture/topic-bitsets?book=${encodeURIComponent(currentBook)}&chapter=${currentChapter}`;
+        if (currentVersionId) {
+            url += `&version_id=${currentVersionId}`;
+        }
+        const response = await fetch(url);
+        const bitsets = await response.json();
+        
+        bitsets.topics.forEach((topic, bit) => topicBitIndex.set(topic.id, bit));
+        for (const verse of verses) {
+            const bits = bitsets.verses[verse.verse];
+            verseTopicBits.set(verse.id, bits ? BigInt('0x' + bits) : 0n);
         }
+    } catch (error) {
+        console.error('Error loading topic bitsets:', error);
     }
     
-    // Get tags and map topics to verses via tags
+    // Get tags for the expandable per-topic tag lists
     try {
-        if (!currentBook || !currentChapter) return;
-        
         let url = `/api/scripture/tags?book=${encodeURIComponent(currentBook)}&chapter=${currentChapter}`;
         if (currentVersionId) {
             url += `&version_id=${currentVersionId}`;
@@ -1281,54 +1350,8 @@ async function buildTopicToVersesMap(topics, verses) {
         const tags = await response.json();
         
         tags.forEach(tag => {
-            if (tag.topic_id) {
-                // Store tag details for formatting
-                if (topicToHighlightsMap.has(tag.topic_id)) {
-                    topicToHighlightsMap.get(tag.topic_id).push(tag);
-                }
-                
-                // Parse position strings to find which verses are in this tag range
-                const startPos = parsePosition(tag.start_position);
-                const endPos = parsePosition(tag.end_position);
-                
-                if (startPos && endPos) {
-                    // Add all verses that fall within this tag range
-                    for (const verse of verses) {
-                        if (verseMatchesPosition(verse, tag.start_position) ||
-                            verseMatchesPosition(verse, tag.end_position)) {
-                            // This verse is at the start or end of the tag
-                            if (topicToVersesMap.has(tag.topic_id)) {
-                                topicToVersesMap.get(tag.topic_id).add(verse.id);
-                            }
-                        } else {
-                            // Check if verse is between start and end positions
-                            const verseBookAbbr = getBookAbbreviation(verse.book);
-                            const startBookAbbr = startPos.bookAbbr;
-                            const endBookAbbr = endPos.bookAbbr;
-                            
-                            // Check if verse is in the same book and between start/end chapters/verses
-                            if (verseBookAbbr === startBookAbbr && verseBookAbbr === endBookAbbr) {
-                                const verseChapter = verse.chapter;
-                                const verseVerse = verse.verse;
-                                const startChapter = startPos.chapter;
-                                const startVerse = startPos.verse;
-                                const endChapter = endPos.chapter;
-                                const endVerse = endPos.verse;
-                                
-                                // Check if verse is between start and end
-                                if ((verseChapter === startChapter && verseChapter === endChapter && 
-                                     verseVerse >= startVerse && verseVerse <= endVerse) ||
-                                    (verseChapter === startChapter && verseVerse >= startVerse) ||
-                                    (verseChapter === endChapter && verseVerse <= endVerse) ||
-                                    (verseChapter > startChapter && verseChapter < endChapter)) {
-                                    if (topicToVersesMap.has(tag.topic_id)) {
-                                        topicToVersesMap.get(tag.topic_id).add(verse.id);
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
+            if (tag.topic_id && topicToHighlightsMap.has(tag.topic_id)) {
+                topicToHighlightsMap.get(tag.topic_id).push(tag);
             }
         });
     } catch (error) {
@@ -1380,6 +1403,10 @@ function checkVisibleVerses() {
     
     if (wasDifferent) {
         visibleVerseIds = newVisibleIds;
+        visibleTopicBits = 0n;
+        for (const verseId of visibleVerseIds) {
+            visibleTopicBits |= verseTopicBits.get(verseId) || 0n;
+        }
         
         // Update topics display based on visible verses
         displayTopics(allChapterTopics, true);
@@ -1610,20 +1637,16 @@ async function highlightWordsForTopic(tags) {
     
     // Get all verses in the current chapter to match positions
     const allVerses = Array.from(document.querySelectorAll('.verse-inline, .poetry-line'));
-    const verseDetailsMap = new Map();
+    const verseIds = allVerses
+        .map(verseEl => parseInt(verseEl.getAttribute('data-verse-id')))
+        .filter(verseId => verseId);
     
-    // First, fetch all verse details we need
-    for (const verseEl of allVerses) {
-        const verseId = parseInt(verseEl.getAttribute('data-verse-id'));
-        if (!verseId || verseDetailsMap.has(verseId)) continue;
-        
-        try {
-            const response = await fetch(`/api/scripture/${verseId}`);
-            const verse = await response.json();
-            verseDetailsMap.set(verseId, verse);
-        } catch (error) {
-            console.error(`Error loading verse ${verseId}:`, error);
-        }
+    // First, fetch all verse details we need in one request
+    let verseDetailsMap = new Map();
+    try {
+        verseDetailsMap = await fetchVerses(verseIds);
+    } catch (error) {
+        console.error('Error loading verses:', error);
     }
     
     // Now find and highlight words for each tag
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Word-level tag depth: how many tags cover each word
+
+A sweep over the numeric tag bounds of one version: every tag adds +1 at
+its start_key and -1 just after its end_key, and the running sum of those
+deltas in key order is the number of tags covering each word. Only keys
+where the depth changes are kept, so the result is a list of run-length
+segments (start_key, end_key, depth) stored in tag_depth, split at book
+boundaries. The deepest segments are the most annotated passages.
+
+Rebuilds are per version: tag_depth_state keeps a fingerprint of each
+version's tags and only versions whose tags changed are swept again. Uses
+numpy (unique + add.at + cumsum) when it is installed and an equivalent
+sorted-dict sweep otherwise.
+
+Usage:
+    python tag_depth.py [--version WEB] [--full]
+    python tag_depth.py --top 10 [--book John]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+from bible_books import BOOKS, PassageRange, find_book, format_position, format_range, position_key
+from migrations import run_migrations
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DATABASE = 'verseindex.db'
+
+# Keys of consecutive books are this far apart (see position_key)
+BOOK_SPAN = position_key(1, 0, 0)
+
+
+def depth_segments(starts, ends):
+    """
+    Run-length coverage depth of inclusive [start, end] key ranges:
+    [(start_key, end_key, depth)] in key order for every run with depth > 0
+    """
+    if not starts:
+        return []
+    if np is not None:
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        keys, inverse = np.unique(np.concatenate([starts, ends + 1]), return_inverse=True)
+        deltas = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(deltas, inverse, np.concatenate([np.ones(len(starts), dtype=np.int64),
+                                                   -np.ones(len(ends), dtype=np.int64)]))
+        # A tag ending where another starts leaves the depth unchanged
+        changes = deltas != 0
+        keys = keys[changes]
+        depths = np.cumsum(deltas[changes])
+        covered = np.nonzero(depths[:-1] > 0)[0]
+        return list(zip(keys[covered].tolist(), (keys[covered + 1] - 1).tolist(), depths[covered].tolist()))
+
+    deltas = {}
+    for start, end in zip(starts, ends):
+        deltas[start] = deltas.get(start, 0) + 1
+        deltas[end + 1] = deltas.get(end + 1, 0) - 1
+    keys = [key for key in sorted(deltas) if deltas[key]]
+    segments = []
+    depth = 0
+    for key, next_key in zip(keys, keys[1:]):
+        depth += deltas[key]
+        if depth > 0:
+            segments.append((key, next_key - 1, depth))
+    return segments
+
+
+def split_books(segments):
+    """Cut segments that cross from one book into the next"""
+    for start, end, depth in segments:
+        while start // BOOK_SPAN != end // BOOK_SPAN:
+            book_end = (start // BOOK_SPAN + 1) * BOOK_SPAN - 1
+            yield start, book_end, depth
+            start = book_end + 1
+        yield start, end, depth
+
+
+def load_fingerprints(conn):
+    """{version: fingerprint of its tag bounds}"""
+    return {
+        version: f'{count}:{max_id}:{start_sum}:{end_sum}'
+        for version, count, max_id, start_sum, end_sum in conn.execute('''
+            SELECT version, COUNT(*), MAX(id), SUM(start_key), SUM(end_key) FROM scripture_tags
+            WHERE version IS NOT NULL AND start_key IS NOT NULL AND end_key >= start_key
+            GROUP BY version
+        ''')
+    }
+
+
+def build_tag_depth(database=DATABASE, version=None, full=False, verbose=False, progress=None):
+    """
+    Bring tag_depth up to date for one version or all of them.
+
+    progress, if given, is called with (versions_done, versions_total).
+    Returns {version: number_of_segments} for the versions that were swept.
+    """
+    conn = sqlite3.connect(database)
+    results = {}
+    try:
+        fingerprints = load_fingerprints(conn)
+        stored = dict(conn.execute('SELECT version, fingerprint FROM tag_depth_state'))
+        versions = set(fingerprints) | set(stored)
+        if version is not None:
+            versions &= {version}
+        if not full:
+            versions = {v for v in versions if fingerprints.get(v) != stored.get(v)}
+
+        versions = sorted(versions)
+        for done, name in enumerate(versions):
+            if progress:
+                progress(done, len(versions))
+            starts, ends = [], []
+            for start_key, end_key in conn.execute('''
+                SELECT start_key, end_key FROM scripture_tags
+                WHERE version = ? AND start_key IS NOT NULL AND end_key >= start_key
+            ''', (name,)):
+                starts.append(start_key)
+                ends.append(end_key)
+            segments = list(split_books(depth_segments(starts, ends)))
+
+            conn.execute('DELETE FROM tag_depth WHERE version = ?', (name,))
+            conn.executemany('''
+                INSERT INTO tag_depth (version, start_key, end_key, depth) VALUES (?, ?, ?, ?)
+            ''', [(name, start, end, depth) for start, end, depth in segments])
+            conn.execute('DELETE FROM tag_depth_state WHERE version = ?', (name,))
+            if name in fingerprints:
+                conn.execute('''
+                    INSERT INTO tag_depth_state (version, fingerprint, max_depth) VALUES (?, ?, ?)
+                ''', (name, fingerprints[name], max((depth for _, _, depth in segments), default=0)))
+            conn.commit()
+            results[name] = len(segments)
+            if verbose:
+                print(f"  {name}: {len(starts)} tags, {len(segments)} segments")
+        if progress:
+            progress(len(versions), len(versions))
+        return results
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def hot_passages(conn, book=None, version=None, limit=20):
+    """
+    The deepest tag_depth segments, deepest (then longest) first, optionally
+    within one Book and one version abbreviation.
+    """
+    query = 'SELECT version, start_key, end_key, depth FROM tag_depth WHERE 1 = 1'
+    params = []
+    if book is not None:
+        query += ' AND start_key BETWEEN ? AND ?'
+        params.extend([position_key(book.number, 0, 0), position_key(book.number + 1, 0, 0) - 1])
+    if version is not None:
+        query += ' AND version = ?'
+        params.append(version)
+    query += ' ORDER BY depth DESC, end_key - start_key DESC, start_key LIMIT ?'
+    params.append(limit)
+    return [
+        {
+            'version': name,
+            'reference': _reference(start_key, end_key),
+            'start': format_position(start_key),
+            'end': format_position(end_key),
+            'start_key': start_key,
+            'end_key': end_key,
+            'depth': depth
+        }
+        for name, start_key, end_key, depth in conn.execute(query, params)
+    ]
+
+
+def _reference(start_key, end_key):
+    """Verse-level reference of a segment (segments never cross books)"""
+    book_key, start_verse = divmod(start_key // 1000, 1000)
+    book_number, start_chapter = divmod(book_key, 1000)
+    end_chapter, end_verse = divmod(end_key // 1000 % 1000000, 1000)
+    book = BOOKS[book_number - 1]
+    # Ending just before a chapter's first word, or cut at the end of the
+    # book, means running to the end of the chapter before
+    if end_chapter > book.chapters:
+        end_chapter, end_verse = book.chapters, None
+    elif end_verse == 0:
+        end_chapter, end_verse = end_chapter - 1, None
+    return format_range(PassageRange(book.name, start_chapter, start_verse, end_chapter, end_verse))
+
+
+_dirty = True
+_dirty_lock = threading.Lock()
+
+
+def mark_dirty():
+    """Note that tags changed since the last sweep"""
+    global _dirty
+    _dirty = True
+
+
+def take_dirty():
+    """True (once) if tags changed since the last call"""
+    global _dirty
+    with _dirty_lock:
+        dirty, _dirty = _dirty, False
+    return dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute per-word tag coverage depth')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--version', help='only this version abbreviation')
+    parser.add_argument('--full', action='store_true', help='sweep versions whose tags did not change too')
+    parser.add_argument('--top', type=int, metavar='N', help='print the N most annotated passages instead')
+    parser.add_argument('--book', help='with --top, only passages in this book')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+
+    run_migrations(args.database)
+    if args.top:
+        book = find_book(args.book) if args.book else None
+        if args.book and book is None:
+            print(f"Unknown book: {args.book}")
+            return 1
+        conn = sqlite3.connect(args.database)
+        for passage in hot_passages(conn, book, args.version, args.top):
+            print(f"{passage['depth']:4d}  {passage['version']:<6} {passage['start']} - {passage['end']}")
+        conn.close()
+        return 0
+
+    results = build_tag_depth(args.database, args.version, full=args.full, verbose=True)
+    print(f"Tag depth updated for {len(results)} version(s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
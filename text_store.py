@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Dictionary-compressed scripture text (optional storage mode)
+
+A version can be switched to compressed storage: the text of each chapter is
+serialized as one payload and compressed with a zstd dictionary trained on
+that version's chapters, and stored in chapter_text. The scripture rows stay
+(their ids are referenced by links and tags) with text set to ''. Readers
+pass rows through ChapterTextCache, which fills in empty texts from the
+chapter payload, decompressing each chapter once and keeping recently used
+chapters in memory. Verses added after compression are stored as plain text
+as usual and are returned unchanged.
+
+Requires the zstandard package (pip install zstandard) to compress, and to
+read versions that have been compressed.
+
+Usage:
+    python text_store.py status
+    python text_store.py compress --version WEB [--vacuum]
+    python text_store.py decompress --version WEB [--vacuum]
+    python text_store.py benchmark [--reads 2000] [--cache-mb 8]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # compressed storage is optional
+    zstandard = None
+
+from migrations import run_migrations
+
+DATABASE = 'verseindex.db'
+
+DEFAULT_MAX_CHAPTERS = 512
+DEFAULT_DICT_SIZE = 64 * 1024
+DEFAULT_LEVEL = 19
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError('Compressed scripture text needs the zstandard package (pip install zstandard)')
+
+
+def encode_chapter(verses):
+    """Serialize [(verse, text)] for one chapter"""
+    return json.dumps(verses, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_chapter(payload):
+    return {verse: text for verse, text in json.loads(payload.decode('utf-8'))}
+
+
+class ChapterTextCache:
+    """LRU of decompressed chapters, keyed by (version_id, book, chapter)"""
+
+    def __init__(self, max_chapters=DEFAULT_MAX_CHAPTERS):
+        self.max_chapters = max_chapters
+        self._lock = threading.Lock()
+        self._chapters = OrderedDict()
+        self._decompressors = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _decompressor(self, conn, dictionary_id):
+        decompressor = self._decompressors.get(dictionary_id)
+        if decompressor is None:
+            _require_zstandard()
+            dictionary = None
+            if dictionary_id is not None:
+                row = conn.execute(
+                    'SELECT dictionary FROM text_dictionaries WHERE id = ?', (dictionary_id,)
+                ).fetchone()
+                dictionary = zstandard.ZstdCompressionDict(bytes(row[0]))
+            decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            self._decompressors[dictionary_id] = decompressor
+        return decompressor
+
+    def chapter(self, conn, version_id, book, chapter):
+        """{verse: text} for a compressed chapter ({} if it is not compressed)"""
+        key = (version_id, book, chapter)
+        with self._lock:
+            texts = self._chapters.get(key)
+            if texts is not None:
+                self._chapters.move_to_end(key)
+                self.hits += 1
+                return texts
+            self.misses += 1
+
+        row = conn.execute('''
+            SELECT dictionary_id, data FROM chapter_text
+            WHERE version_id = ? AND book = ? AND chapter = ?
+        ''', key).fetchone()
+        if row is None:
+            return {}
+        dictionary_id, data = row[0], row[1]
+        with self._lock:
+            decompressor = self._decompressor(conn, dictionary_id)
+        texts = decode_chapter(decompressor.decompress(bytes(data)))
+
+        with self._lock:
+            self._chapters[key] = texts
+            while len(self._chapters) > self.max_chapters:
+                self._chapters.popitem(last=False)
+        return texts
+
+    def text(self, conn, version_id, book, chapter, verse, text):
+        """The verse text, from the chapter payload if the row's text is empty"""
+        if text:
+            return text
+        return self.chapter(conn, version_id, book, chapter).get(verse, text)
+
+    def fill(self, conn, rows):
+        """Fill in 'text' for verse dicts in place, one lookup per chapter; returns rows"""
+        chapters = {}
+        for row in rows:
+            if not row.get('text'):
+                key = (row['version_id'], row['book'], row['chapter'])
+                texts = chapters.get(key)
+                if texts is None:
+                    texts = chapters[key] = self.chapter(conn, *key)
+                row['text'] = texts.get(row['verse'], row.get('text'))
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._chapters.clear()
+            self._decompressors.clear()
+
+
+def _read_version(conn, version_id, cache):
+    """{(book, chapter): [(verse, text)]} for a version, whatever its storage"""
+    chapters = OrderedDict()
+    rows = conn.execute('''
+        SELECT book, chapter, verse, text FROM scripture
+        WHERE version_id = ?
+        ORDER BY book, chapter, verse
+    ''', (version_id,))
+    for book, chapter, verse, text in rows:
+        text = cache.text(conn, version_id, book, chapter, verse, text)
+        chapters.setdefault((book, chapter), []).append((verse, text))
+    return chapters
+
+
+def _delete_unused_dictionaries(conn, version_id):
+    conn.execute('''
+        DELETE FROM text_dictionaries
+        WHERE version_id = ? AND id NOT IN (
+            SELECT dictionary_id FROM chapter_text WHERE dictionary_id IS NOT NULL
+        )
+    ''', (version_id,))
+
+
+def compress_version(database, version_id, dict_size=DEFAULT_DICT_SIZE, level=DEFAULT_LEVEL, verbose=False):
+    """
+    Move a version's text into dictionary-compressed chapter payloads.
+
+    Returns stats: chapters, verses, plain_bytes, compressed_bytes,
+    dictionary_bytes.
+    """
+    _require_zstandard()
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        chapters = _read_version(conn, version_id, ChapterTextCache())
+        payloads = {key: encode_chapter(verses) for key, verses in chapters.items()}
+
+        dictionary = None
+        try:
+            dictionary = zstandard.train_dictionary(dict_size, list(payloads.values()), level=level)
+        except zstandard.ZstdError:
+            # Too little text to train on; compress without a dictionary
+            if verbose:
+                print("Not enough text to train a dictionary; compressing without one")
+
+        dictionary_id = None
+        if dictionary is not None:
+            dictionary_id = conn.execute(
+                'INSERT INTO text_dictionaries (version_id, dictionary) VALUES (?, ?)',
+                (version_id, dictionary.as_bytes())
+            ).lastrowid
+        compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+
+        compressed_bytes = 0
+        for (book, chapter), payload in payloads.items():
+            data = compressor.compress(payload)
+            compressed_bytes += len(data)
+            conn.execute('''
+                INSERT OR REPLACE INTO chapter_text (version_id, book, chapter, dictionary_id, data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (version_id, book, chapter, dictionary_id, data))
+        conn.execute("UPDATE scripture SET text = '' WHERE version_id = ?", (version_id,))
+        _delete_unused_dictionaries(conn, version_id)
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'chapters': len(payloads),
+        'verses': sum(len(verses) for verses in chapters.values()),
+        'plain_bytes': sum(len(text.encode('utf-8')) for verses in chapters.values() for _, text in verses),
+        'compressed_bytes': compressed_bytes,
+        'dictionary_bytes': len(dictionary.as_bytes()) if dictionary is not None else 0,
+    }
+
+
+def decompress_version(database, version_id):
+    """Move a version's text back into scripture.text. Returns verses restored."""
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cache = ChapterTextCache()
+        restored = 0
+        keys = conn.execute(
+            'SELECT book, chapter FROM chapter_text WHERE version_id = ?', (version_id,)
+        ).fetchall()
+        for book, chapter in keys:
+            texts = cache.chapter(conn, version_id, book, chapter)
+            for verse, text in texts.items():
+                restored += conn.execute('''
+                    UPDATE scripture SET text = ?
+                    WHERE version_id = ? AND book = ? AND chapter = ? AND verse = ? AND text = ''
+                ''', (text, version_id, book, chapter, verse)).rowcount
+        conn.execute('DELETE FROM chapter_text WHERE version_id = ?', (version_id,))
+        _delete_unused_dictionaries(conn, version_id)
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return restored
+
+
+def storage_status(conn):
+    """(abbreviation, verses, compressed chapters, payload bytes) per version"""
+    return conn.execute('''
+        SELECT bv.abbreviation,
+               (SELECT COUNT(*) FROM scripture s WHERE s.version_id = bv.id),
+               (SELECT COUNT(*) FROM chapter_text c WHERE c.version_id = bv.id),
+               (SELECT COALESCE(SUM(LENGTH(c.data)), 0) FROM chapter_text c WHERE c.version_id = bv.id)
+        FROM bible_versions bv
+        ORDER BY bv.id
+    ''').fetchall()
+
+
+def _version_id(conn, abbreviation):
+    row = conn.execute('SELECT id FROM bible_versions WHERE abbreviation = ?', (abbreviation,)).fetchone()
+    return row[0] if row else None
+
+
+def _table_pages(conn):
+    """{table or index name: pages} from the dbstat virtual table"""
+    return dict(conn.execute('SELECT name, COUNT(*) FROM dbstat GROUP BY name').fetchall())
+
+
+def _chapter_pages(conn, compressed):
+    """
+    Approximate pages each chapter read touches: the rows of each table a
+    read uses are laid out in storage order over that table's pages, so
+    small neighbouring chapters share pages as they do on disk.
+    """
+    pages = _table_pages(conn)
+    spans = {}
+    first_page = 0
+
+    def lay_out(table, sizes):
+        nonlocal first_page
+        table_pages = max(pages.get(table, 0), 1)
+        bytes_per_page = (sum(size for _, size in sizes) or 1) / table_pages
+        offset = 0
+        for key, size in sizes:
+            start = first_page + int(offset / bytes_per_page)
+            end = first_page + int((offset + max(size, 1) - 1) / bytes_per_page)
+            spans.setdefault(key, []).append((start, end - start + 1))
+            offset += size
+        first_page += table_pages
+
+    rows = conn.execute('''
+        SELECT version_id, book, chapter, SUM(LENGTH(text) + 40) FROM scripture
+        GROUP BY version_id, book, chapter ORDER BY MIN(id)
+    ''').fetchall()
+    lay_out('scripture', [((v, b, c), size) for v, b, c, size in rows])
+    if compressed:
+        rows = conn.execute('''
+            SELECT version_id, book, chapter, LENGTH(data) + 40 FROM chapter_text
+            ORDER BY version_id, book, chapter
+        ''').fetchall()
+        lay_out('chapter_text', [((v, b, c), size) for v, b, c, size in rows])
+    return spans
+
+
+def _simulate_page_cache(spans, trace, cache_pages):
+    """Hit rate of an LRU page cache of cache_pages over a chapter read trace"""
+    cache = OrderedDict()
+    hits = misses = 0
+    for key in trace:
+        for start, count in spans.get(key, []):
+            for page in range(start, start + count):
+                if page in cache:
+                    cache.move_to_end(page)
+                    hits += 1
+                else:
+                    misses += 1
+                    cache[page] = True
+                    if len(cache) > cache_pages:
+                        cache.popitem(last=False)
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def _time_reads(path, trace, cache_kb):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA cache_size = -{cache_kb}')
+    texts = ChapterTextCache(max_chapters=64)
+    latencies = []
+    for version_id, book, chapter in trace:
+        started = time.perf_counter()
+        rows = [dict(row) for row in conn.execute('''
+            SELECT * FROM scripture
+            WHERE version_id = ? AND book = ? AND chapter = ?
+            ORDER BY verse
+        ''', (version_id, book, chapter))]
+        texts.fill(conn, rows)
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    latencies.sort()
+    return latencies, texts
+
+
+def benchmark(database, reads=2000, cache_mb=8, seed=1):
+    """Compare plain and compressed storage of the same data; prints a report"""
+    _require_zstandard()
+    workdir = tempfile.mkdtemp(prefix='verseindex-bench-')
+    try:
+        plain = os.path.join(workdir, 'plain.db')
+        compressed = os.path.join(workdir, 'compressed.db')
+        source = sqlite3.connect(database)
+        for path in (plain, compressed):
+            target = sqlite3.connect(path)
+            source.backup(target)
+            target.close()
+        source.close()
+
+        run_migrations(plain, verbose=False)
+        run_migrations(compressed, verbose=False)
+        for path in (plain, compressed):
+            conn = sqlite3.connect(path)
+            for (version_id,) in conn.execute('SELECT id FROM bible_versions').fetchall():
+                if path == compressed:
+                    compress_version(path, version_id)
+                else:
+                    decompress_version(path, version_id)
+            conn.execute('VACUUM')
+            conn.close()
+
+        conn = sqlite3.connect(plain)
+        chapters = conn.execute('SELECT DISTINCT version_id, book, chapter FROM scripture').fetchall()
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        conn.close()
+        if not chapters:
+            print("No scripture to benchmark.")
+            return
+        rng = random.Random(seed)
+        trace = [tuple(rng.choice(chapters)) for _ in range(reads)]
+        cache_pages = cache_mb * 1024 * 1024 // page_size
+
+        print(f"{reads} random chapter reads over {len(chapters)} chapters, {cache_mb} MB page cache")
+        print(f"  {'storage':<12}{'db size':>12}{'page hits':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'text hits':>12}")
+        for label, path in (('plain', plain), ('compressed', compressed)):
+            conn = sqlite3.connect(path)
+            spans = _chapter_pages(conn, label == 'compressed')
+            conn.close()
+            hit_rate = _simulate_page_cache(spans, trace, cache_pages)
+            latencies, texts = _time_reads(path, trace, cache_mb * 1024)
+            text_hits = texts.hits / (texts.hits + texts.misses) if texts.hits + texts.misses else None
+
+            def pct(fraction):
+                return latencies[min(len(latencies) - 1, int(fraction * (len(latencies) - 1)))] * 1000
+
+            print(f"  {label:<12}{os.path.getsize(path) / 1024 / 1024:>10.2f}MB{100 * hit_rate:>11.1f}%"
+                  f"{pct(0.50):>10.3f}{pct(0.95):>10.3f}{pct(0.99):>10.3f}"
+                  f"{'-' if text_hits is None else f'{100 * text_hits:.1f}%':>12}")
+        print("Page hits model an LRU page cache of that size over the pages each read touches.")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dictionary-compressed scripture text storage')
+    parser.add_argument('--database', default=DATABASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('status', help='show which versions are compressed')
+
+    compress = commands.add_parser('compress', help='compress a version')
+    compress.add_argument('--version', required=True, help='version abbreviation, e.g. WEB')
+    compress.add_argument('--dict-size', type=int, default=DEFAULT_DICT_SIZE)
+    compress.add_argument('--level', type=int, default=DEFAULT_LEVEL)
+    compress.add_argument('--vacuum', action='store_true', help='reclaim the freed space afterwards')
+
+    decompress = commands.add_parser('decompress', help='store a version as plain text again')
+    decompress.add_argument('--version', required=True)
+    decompress.add_argument('--vacuum', action='store_true')
+
+    bench = commands.add_parser('benchmark', help='compare plain and compressed storage')
+    bench.add_argument('--reads', type=int, default=2000)
+    bench.add_argument('--cache-mb', type=int, default=8)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+    run_migrations(args.database)
+
+    try:
+        if args.command == 'status':
+            conn = sqlite3.connect(args.database)
+            for abbreviation, verses, chapters, size in storage_status(conn):
+                mode = f'compressed ({chapters} chapters, {size / 1024:.0f} KB)' if chapters else 'plain'
+                print(f"{abbreviation:<8}{verses:>8} verses  {mode}")
+            conn.close()
+        elif args.command == 'benchmark':
+            benchmark(args.database, args.reads, args.cache_mb)
+        else:
+            conn = sqlite3.connect(args.database)
+            version_id = _version_id(conn, args.version)
+            conn.close()
+            if version_id is None:
+                print(f"Unknown version: {args.version}")
+                return 1
+            if args.command == 'compress':
+                stats = compress_version(args.database, version_id, args.dict_size, args.level, verbose=True)
+                print(f"Compressed {stats['verses']} verses in {stats['chapters']} chapters: "
+                      f"{stats['plain_bytes'] / 1024:.0f} KB -> {stats['compressed_bytes'] / 1024:.0f} KB "
+                      f"(+{stats['dictionary_bytes'] / 1024:.0f} KB dictionary)")
+            else:
+                print(f"Restored {decompress_version(args.database, version_id)} verses")
+            if args.vacuum:
+                conn = sqlite3.connect(args.database)
+                conn.execute('VACUUM')
+                conn.close()
+    except RuntimeError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
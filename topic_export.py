@@ -0,0 +1,181 @@
+"""
+Streaming export of everything tagged under a topic
+
+Passages come from the topic's tags and linked verses, collapsed to whole
+verses (word bounds are per version, so they don't carry across
+translations) and deduplicated, in canonical order. They are read from one
+ordered cursor a batch at a time, and the text for each batch is fetched in
+a single ranged query for all requested versions, so memory use depends on
+the batch size rather than the size of the topic.
+"""
+
+import csv
+import io
+import json
+
+from bible_books import BOOKS, MAX_VERSE, PassageRange, format_range
+from text_store import ChapterTextCache
+
+FORMATS = {
+    'md': 'text/markdown',
+    'json': 'application/json',
+    'csv': 'text/csv',
+}
+
+# Passages whose text is fetched per query
+BATCH_SIZE = 200
+
+# Maps a stored book name to its canonical number inside SQL
+_BOOK_NUMBER_SQL = 'CASE s.book {} END'.format(
+    ' '.join(f"WHEN '{book.name}' THEN {book.number}" for book in BOOKS)
+)
+
+# Verse keys are position keys without the word: (book * 1000 + chapter) * 1000 + verse
+_PASSAGES_SQL = f'''
+    SELECT start_key / 1000 AS start_verse_key, end_key / 1000 AS end_verse_key
+    FROM scripture_tags
+    WHERE topic_id = ? AND start_key IS NOT NULL AND end_key >= start_key
+    UNION
+    SELECT key, key FROM (
+        SELECT ({_BOOK_NUMBER_SQL} * 1000 + s.chapter) * 1000 + s.verse AS key
+        FROM scripture_topics st
+        JOIN scripture s ON s.id = st.scripture_id
+        WHERE st.topic_id = ?
+    ) WHERE key IS NOT NULL
+    ORDER BY start_verse_key, end_verse_key
+'''
+
+
+def passage_ranges(start_verse_key, end_verse_key):
+    """Split a verse-key range into one PassageRange per book it touches"""
+    start_rest, start_verse = divmod(start_verse_key, 1000)
+    start_book, start_chapter = divmod(start_rest, 1000)
+    end_rest, end_verse = divmod(end_verse_key, 1000)
+    end_book, end_chapter = divmod(end_rest, 1000)
+
+    ranges = []
+    for number in range(start_book, end_book + 1):
+        book = BOOKS[number - 1]
+        first = (start_chapter, start_verse) if number == start_book else (1, 1)
+        if number == end_book:
+            ranges.append(PassageRange(book.name, first[0], first[1], end_chapter, end_verse))
+        else:
+            ranges.append(PassageRange(book.name, first[0], first[1], book.chapters, None))
+    return ranges
+
+
+def _fetch_texts(conn, batch, version_ids, chapter_texts):
+    """Return {passage_index: [verse rows]} for one batch of passages"""
+    values = []
+    params = []
+    for index, ranges in enumerate(batch):
+        for passage in ranges:
+            values.append('(?, ?, ?, ?, ?, ?)')
+            params.extend([
+                index, passage.book, passage.start_chapter, passage.start_verse,
+                passage.end_chapter, passage.end_verse or MAX_VERSE
+            ])
+    version_placeholders = ','.join('?' * len(version_ids))
+    params.extend(version_ids)
+
+    rows = conn.execute(f'''
+        WITH ranges(idx, book, start_chapter, start_verse, end_chapter, end_verse) AS (
+            VALUES {', '.join(values)}
+        )
+        SELECT r.idx, s.version_id, s.book, s.chapter, s.verse, s.text
+        FROM ranges r
+        JOIN scripture s ON s.book = r.book
+            AND (s.chapter, s.verse) >= (r.start_chapter, r.start_verse)
+            AND (s.chapter, s.verse) <= (r.end_chapter, r.end_verse)
+        WHERE s.version_id IN ({version_placeholders})
+        ORDER BY r.idx, s.version_id, s.chapter, s.verse
+    ''', params)
+
+    texts = {}
+    for index, version_id, book, chapter, verse, text in rows.fetchall():
+        text = chapter_texts.text(conn, version_id, book, chapter, verse, text)
+        texts.setdefault(index, []).append((version_id, book, chapter, verse, text))
+    return texts
+
+
+def iter_passages(conn, topic_id, version_ids, batch_size=BATCH_SIZE):
+    """
+    Yield (reference, {version_id: [(book, chapter, verse, text)]}) per passage.
+
+    Passages are read from one cursor with fetchmany so only one batch is
+    held at a time.
+    """
+    cursor = conn.execute(_PASSAGES_SQL, (topic_id, topic_id))
+    chapter_texts = ChapterTextCache(max_chapters=64)
+    while True:
+        keys = cursor.fetchmany(batch_size)
+        if not keys:
+            break
+        batch = [passage_ranges(start, end) for start, end in keys]
+        texts = _fetch_texts(conn, batch, version_ids, chapter_texts)
+        for index, ranges in enumerate(batch):
+            verses = {version_id: [] for version_id in version_ids}
+            for version_id, book, chapter, verse, text in texts.get(index, []):
+                verses[version_id].append((book, chapter, verse, text))
+            yield '; '.join(format_range(passage) for passage in ranges), verses
+
+
+def export_topic(connect, topic, versions, fmt, batch_size=BATCH_SIZE):
+    """
+    Generate the export of a topic piece by piece.
+
+    connect() opens the connection to read tags and text from (the shared
+    database, or a workspace with the corpus attached). topic is a dict with
+    id, name and description; versions is a list of (id, abbreviation) in
+    the order they should appear.
+    """
+    conn = connect()
+    try:
+        version_ids = [version_id for version_id, _ in versions]
+        abbreviations = dict(versions)
+        passages = iter_passages(conn, topic['id'], version_ids, batch_size)
+
+        if fmt == 'json':
+            yield json.dumps({
+                'topic': topic,
+                'versions': [abbr for _, abbr in versions]
+            })[:-1] + ', "passages": ['
+            for number, (reference, verses) in enumerate(passages):
+                yield (',' if number else '') + json.dumps({
+                    'reference': reference,
+                    'text': {
+                        abbreviations[version_id]: [
+                            {'book': book, 'chapter': chapter, 'verse': verse, 'text': text}
+                            for book, chapter, verse, text in rows
+                        ]
+                        for version_id, rows in verses.items()
+                    }
+                })
+            yield ']}\n'
+
+        elif fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['reference', 'version', 'book', 'chapter', 'verse', 'text'])
+            for reference, verses in passages:
+                for version_id, rows in verses.items():
+                    for book, chapter, verse, text in rows:
+                        writer.writerow([reference, abbreviations[version_id], book, chapter, verse, text])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+
+        else:
+            yield f"# {topic['name']}\n\n"
+            if topic.get('description'):
+                yield f"{topic['description']}\n\n"
+            for reference, verses in passages:
+                lines = [f'## {reference}\n']
+                for version_id, rows in verses.items():
+                    if rows:
+                        text = ' '.join(f'<sup>{verse}</sup> {text}' for _, _, verse, text in rows)
+                        lines.append(f'**{abbreviations[version_id]}** {text}\n')
+                yield '\n'.join(lines) + '\n'
+    finally:
+        conn.close()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Related topics from verse co-occurrence
+
+Builds a sparse verse x topic incidence matrix A from scripture_tags and
+scripture_topics (a verse is counted once however many versions tag it),
+then C = A^T A gives, for every pair of topics, how many verses they share;
+the diagonal is each topic's verse count. Similarity is the cosine
+C[i, j] / sqrt(C[i, i] * C[j, j]) and the best NEIGHBOURS per topic are
+stored in topic_related.
+
+Refreshes are incremental: topic_graph_state keeps a fingerprint of each
+topic's tags and verse links, and only topics whose fingerprint changed, plus
+topics that share verses with them or listed them before, are recomputed.
+Uses scipy.sparse when it is installed and an equivalent pure-Python
+column product otherwise.
+
+Usage:
+    python topic_graph.py [--full]
+"""
+
+import argparse
+import bisect
+import math
+import os
+import sqlite3
+import sys
+import threading
+
+from bible_books import book_number
+from migrations import run_migrations
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+DATABASE = 'verseindex.db'
+
+# Related topics stored per topic
+NEIGHBOURS = 20
+
+
+def _chapter_lengths(conn):
+    """Sorted (book_number * 1000 + chapter) keys and their last verse"""
+    lengths = {}
+    for book, chapter, last_verse in conn.execute(
+        'SELECT book, chapter, MAX(verse) FROM scripture GROUP BY book, chapter'
+    ):
+        number = book_number(book)
+        if number is not None:
+            key = number * 1000 + int(chapter)
+            lengths[key] = max(lengths.get(key, 0), int(last_verse))
+    keys = sorted(lengths)
+    return keys, [lengths[key] for key in keys]
+
+
+def verse_span(start_key, end_key, chapters):
+    """
+    Verse keys (position key // 1000) covered by a tag.
+
+    Tags within one chapter cover start..end verse. Tags that cross chapters
+    use the chapter lengths of the loaded text to fill the chapters between.
+    """
+    start, end = start_key // 1000, end_key // 1000
+    start_chapter, end_chapter = start // 1000, end // 1000
+    if start_chapter == end_chapter:
+        return range(start, end + 1)
+
+    keys, last_verses = chapters
+    verses = []
+    low = bisect.bisect_left(keys, start_chapter)
+    high = bisect.bisect_right(keys, end_chapter)
+    for chapter, last_verse in zip(keys[low:high], last_verses[low:high]):
+        first = start % 1000 if chapter == start_chapter else 1
+        last = end % 1000 if chapter == end_chapter else last_verse
+        verses.extend(range(chapter * 1000 + first, chapter * 1000 + last + 1))
+    return verses
+
+
+def load_incidence(conn):
+    """Return {topic_id: set of verse keys} for every topic with tags or links"""
+    chapters = _chapter_lengths(conn)
+    verses_by_topic = {}
+
+    for topic_id, start_key, end_key in conn.execute('''
+        SELECT topic_id, start_key, end_key FROM scripture_tags
+        WHERE topic_id IS NOT NULL AND start_key IS NOT NULL AND end_key >= start_key
+    '''):
+        verses_by_topic.setdefault(topic_id, set()).update(verse_span(start_key, end_key, chapters))
+
+    for topic_id, book, chapter, verse in conn.execute('''
+        SELECT st.topic_id, s.book, s.chapter, s.verse
+        FROM scripture_topics st
+        JOIN scripture s ON s.id = st.scripture_id
+    '''):
+        number = book_number(book)
+        if number is not None:
+            key = (number * 1000 + int(chapter)) * 1000 + int(verse)
+            verses_by_topic.setdefault(topic_id, set()).add(key)
+
+    return verses_by_topic
+
+
+def load_fingerprints(conn):
+    """Cheap per-topic summary of its tags and links; changes when either does"""
+    fingerprints = {}
+    for topic_id, count, total in conn.execute('''
+        SELECT topic_id, COUNT(*), TOTAL(start_key) + TOTAL(end_key)
+        FROM scripture_tags WHERE topic_id IS NOT NULL GROUP BY topic_id
+    '''):
+        fingerprints[topic_id] = f'{count}:{int(total)}'
+    for topic_id, count, total in conn.execute('''
+        SELECT topic_id, COUNT(*), TOTAL(scripture_id)
+        FROM scripture_topics GROUP BY topic_id
+    '''):
+        fingerprints[topic_id] = fingerprints.get(topic_id, '0:0') + f'|{count}:{int(total)}'
+    return fingerprints
+
+
+def cooccurrence(verses_by_topic, columns):
+    """
+    Shared verse counts between each topic in columns and every other topic.
+
+    This is the product A^T A[:, columns]. Returns {column: {topic_id: count}}
+    without the diagonal.
+    """
+    columns = [topic_id for topic_id in columns if verses_by_topic.get(topic_id)]
+    if not columns:
+        return {}
+
+    if sparse is not None:
+        topic_ids = list(verses_by_topic)
+        topic_index = {topic_id: i for i, topic_id in enumerate(topic_ids)}
+        verse_index = {}
+        rows, cols = [], []
+        for topic_id, verses in verses_by_topic.items():
+            for verse in verses:
+                rows.append(verse_index.setdefault(verse, len(verse_index)))
+                cols.append(topic_index[topic_id])
+        A = sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(verse_index), len(topic_ids))
+        )
+        product = (A.T @ A[:, [topic_index[t] for t in columns]]).tocsc()
+        result = {}
+        for j, topic_id in enumerate(columns):
+            column = product.getcol(j)
+            result[topic_id] = {
+                topic_ids[i]: int(count)
+                for i, count in zip(column.indices, column.data)
+                if topic_ids[i] != topic_id
+            }
+        return result
+
+    # Column product without scipy: walk each column's verses through the
+    # verse -> topics rows and count the topics met
+    topics_by_verse = {}
+    for topic_id, verses in verses_by_topic.items():
+        for verse in verses:
+            topics_by_verse.setdefault(verse, []).append(topic_id)
+    result = {}
+    for topic_id in columns:
+        counts = {}
+        for verse in verses_by_topic[topic_id]:
+            for other in topics_by_verse[verse]:
+                if other != topic_id:
+                    counts[other] = counts.get(other, 0) + 1
+        result[topic_id] = counts
+    return result
+
+
+def top_neighbours(topic_id, counts, verses_by_topic, limit=NEIGHBOURS):
+    """Rank co-occurring topics by cosine similarity, most similar first"""
+    size = len(verses_by_topic[topic_id])
+    scored = [
+        (count / math.sqrt(size * len(verses_by_topic[other])), count, other)
+        for other, count in counts.items()
+    ]
+    scored.sort(key=lambda item: (-item[0], -item[1], item[2]))
+    return scored[:limit]
+
+
+def refresh_topic_graph(database=DATABASE, full=False, verbose=False):
+    """
+    Bring topic_related up to date. Returns the number of topics recomputed.
+
+    With full=True every topic is recomputed, which also picks up tags whose
+    verse spans changed because chapters were imported after tagging.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        fingerprints = load_fingerprints(conn)
+        stored = dict(conn.execute('SELECT topic_id, fingerprint FROM topic_graph_state'))
+        if full:
+            changed = set(fingerprints) | set(stored)
+        else:
+            changed = {
+                topic_id for topic_id in set(fingerprints) | set(stored)
+                if fingerprints.get(topic_id) != stored.get(topic_id)
+            }
+        if not changed:
+            return 0
+
+        verses_by_topic = load_incidence(conn)
+        counts = cooccurrence(verses_by_topic, changed)
+
+        # Topics whose lists can move: the changed ones, anything sharing
+        # verses with them now, and anything that listed them before
+        affected = set(changed)
+        for column in counts.values():
+            affected.update(column)
+        affected.update(
+            topic_id for topic_id, related_id in
+            conn.execute('SELECT topic_id, related_topic_id FROM topic_related')
+            if related_id in changed
+        )
+        counts.update(cooccurrence(verses_by_topic, affected - changed))
+
+        rows = []
+        for topic_id in affected:
+            if topic_id in counts:
+                for score, shared, other in top_neighbours(topic_id, counts[topic_id], verses_by_topic):
+                    rows.append((topic_id, other, shared, score))
+
+        conn.execute('BEGIN')
+        conn.executemany('DELETE FROM topic_related WHERE topic_id = ?', [(t,) for t in affected])
+        conn.executemany('''
+            INSERT INTO topic_related (topic_id, related_topic_id, shared_verses, score)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        conn.executemany('DELETE FROM topic_graph_state WHERE topic_id = ?', [(t,) for t in changed])
+        conn.executemany('''
+            INSERT INTO topic_graph_state (topic_id, fingerprint) VALUES (?, ?)
+        ''', [(t, fingerprints[t]) for t in changed if t in fingerprints])
+        conn.commit()
+
+        if verbose:
+            print(f"{len(changed)} topics changed, {len(affected)} recomputed, "
+                  f"{len(rows)} related pairs stored")
+        return len(affected)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+_dirty = True
+_dirty_lock = threading.Lock()
+
+
+def mark_dirty():
+    """Note that tags or verse links changed since the last refresh"""
+    global _dirty
+    _dirty = True
+
+
+def take_dirty():
+    """True (once) if tags or verse links changed since the last call"""
+    global _dirty
+    with _dirty_lock:
+        dirty, _dirty = _dirty, False
+    return dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild related topics from verse co-occurrence')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--full', action='store_true', help='recompute every topic')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Database {args.database} not found!")
+        return 1
+
+    run_migrations(args.database)
+    refresh_topic_graph(args.database, full=args.full, verbose=True)
+    print("Related topics updated.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+In-memory prefix index for topic autocomplete
+
+Topic names are case-folded and kept in one sorted array, with an entry for
+the start of every word so "cov" finds both "Covenant" and "New Covenant".
+A prefix lookup is a pair of binary searches; the best matches by usage
+count are precomputed for every one- and two-character prefix, which are the
+only prefixes wide enough for ranking to cost anything.
+
+The index is rebuilt lazily: write routes call invalidate(), and the next
+lookup reloads from the database. max_age bounds staleness from writes made
+by other processes.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Prefixes this short get their top matches precomputed at build time
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+
+def fold(text):
+    return ' '.join(text.casefold().split())
+
+
+class TopicPrefixIndex:
+    """Sorted-array prefix index over topic names, ranked by usage"""
+
+    def __init__(self, loader, max_age=60):
+        # loader() returns an iterable of (topic_id, name, usage_count)
+        self._loader = loader
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._keys = []
+        self._entries = []
+        self._topics = {}
+        self._top = {}
+        self._rank = None
+
+    def invalidate(self):
+        """Drop the index so the next lookup rebuilds it"""
+        with self._lock:
+            self._built_at = None
+
+    def _stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self._max_age
+
+    def _build(self):
+        topics = {}
+        entries = []
+        for topic_id, name, usage in self._loader():
+            topics[topic_id] = {'id': topic_id, 'name': name, 'usage': usage}
+            folded = fold(name)
+            starts = [0] + [i + 1 for i, char in enumerate(folded) if char == ' ']
+            for start in starts:
+                entries.append((folded[start:], topic_id))
+        entries.sort()
+
+        # Rank key: most used first, then alphabetical
+        def rank(topic_id):
+            topic = topics[topic_id]
+            return (-topic['usage'], topic['name'].casefold(), topic_id)
+
+        top = {}
+        buckets = {}
+        for key, topic_id in entries:
+            for length in range(0, PRECOMPUTED_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    buckets.setdefault(key[:length], set()).add(topic_id)
+        for prefix, topic_ids in buckets.items():
+            top[prefix] = heapq.nsmallest(MAX_LIMIT, topic_ids, key=rank)
+
+        self._keys = [key for key, _ in entries]
+        self._entries = entries
+        self._topics = topics
+        self._top = top
+        self._rank = rank
+        self._built_at = time.monotonic()
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """Return up to limit topics whose name, or a word in it, starts with query"""
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        prefix = fold(query)
+
+        with self._lock:
+            if self._stale():
+                self._build()
+            topics = self._topics
+
+            if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+                ranked = self._top.get(prefix, [])
+            else:
+                low = bisect.bisect_left(self._keys, prefix)
+                high = bisect.bisect_left(self._keys, prefix + '\uffff', low)
+                matches = {topic_id for _, topic_id in self._entries[low:high]}
+                ranked = heapq.nsmallest(limit, matches, key=self._rank)
+
+            return [topics[topic_id] for topic_id in ranked[:limit]]
@@ -0,0 +1,145 @@
+"""
+Topic hierarchy backed by a closure table
+
+topics.parent_id gives each topic an optional parent. topic_closure holds one
+row per (ancestor, descendant) pair, including each topic paired with itself
+at depth 0, so a whole subtree is one indexed range scan on ancestor_id no
+matter how deep the hierarchy is. Triggers on topics keep the closure in
+step with inserts, parent changes and deletes, so every writer (the app,
+the write queue, scripts) maintains it without extra code. Moving a topic
+under itself or one of its descendants is rejected by a trigger.
+"""
+
+CLOSURE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS topic_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_topic_closure_descendant ON topic_closure (descendant_id, depth)',
+    'CREATE INDEX IF NOT EXISTS idx_topics_parent ON topics (parent_id)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS topic_closure_insert
+    AFTER INSERT ON topics
+    BEGIN
+        INSERT INTO topic_closure (ancestor_id, descendant_id, depth)
+        SELECT NEW.id, NEW.id, 0
+        UNION ALL
+        SELECT ancestor_id, NEW.id, depth + 1
+        FROM topic_closure WHERE descendant_id = NEW.parent_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS topic_closure_no_cycle
+    BEFORE UPDATE OF parent_id ON topics
+    WHEN NEW.parent_id IS NOT NULL AND EXISTS (
+        SELECT 1 FROM topic_closure
+        WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_id
+    )
+    BEGIN
+        SELECT RAISE(ABORT, 'A topic cannot be moved under itself or one of its descendants');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS topic_closure_move
+    AFTER UPDATE OF parent_id ON topics
+    WHEN NEW.parent_id IS NOT OLD.parent_id
+    BEGIN
+        -- Detach the subtree from its old ancestors...
+        DELETE FROM topic_closure
+        WHERE descendant_id IN (SELECT descendant_id FROM topic_closure WHERE ancestor_id = NEW.id)
+          AND ancestor_id NOT IN (SELECT descendant_id FROM topic_closure WHERE ancestor_id = NEW.id);
+        -- ...and attach it below every ancestor of the new parent
+        INSERT INTO topic_closure (ancestor_id, descendant_id, depth)
+        SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+        FROM topic_closure above, topic_closure below
+        WHERE above.descendant_id = NEW.parent_id AND below.ancestor_id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS topic_closure_reparent_children
+    BEFORE DELETE ON topics
+    BEGIN
+        UPDATE topics SET parent_id = OLD.parent_id WHERE parent_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS topic_closure_delete
+    AFTER DELETE ON topics
+    BEGIN
+        DELETE FROM topic_closure WHERE ancestor_id = OLD.id OR descendant_id = OLD.id;
+    END
+    ''',
+]
+
+
+def ensure_topic_tree(conn):
+    """Add topics.parent_id and the closure table/triggers if missing"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(topics)')}
+    if 'parent_id' not in columns:
+        conn.execute('ALTER TABLE topics ADD COLUMN parent_id INTEGER REFERENCES topics (id)')
+    for statement in CLOSURE_SCHEMA:
+        conn.execute(statement)
+    missing = conn.execute('''
+        SELECT COUNT(*) FROM topics t
+        WHERE NOT EXISTS (
+            SELECT 1 FROM topic_closure c WHERE c.ancestor_id = t.id AND c.descendant_id = t.id
+        )
+    ''').fetchone()[0]
+    if missing:
+        rebuild_closure(conn)
+
+
+def rebuild_closure(conn):
+    """Recompute topic_closure from topics.parent_id"""
+    conn.execute('DELETE FROM topic_closure')
+    conn.execute('''
+        WITH RECURSIVE walk (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM topics
+            UNION ALL
+            SELECT t.parent_id, walk.descendant_id, walk.depth + 1
+            FROM walk JOIN topics t ON t.id = walk.ancestor_id
+            WHERE t.parent_id IS NOT NULL
+        )
+        INSERT INTO topic_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM walk
+    ''')
+
+
+def topic_filter(column, include_descendants):
+    """
+    SQL condition matching column against one topic id parameter, or
+    against every topic in its subtree
+    """
+    if include_descendants:
+        return f'{column} IN (SELECT descendant_id FROM topic_closure WHERE ancestor_id = ?)'
+    return f'{column} = ?'
+
+
+def descendants(conn, topic_id, max_depth=None):
+    """(id, name, parent_id, depth) for every topic below topic_id, nearest first"""
+    query = '''
+        SELECT t.id, t.name, t.parent_id, c.depth
+        FROM topic_closure c
+        JOIN topics t ON t.id = c.descendant_id
+        WHERE c.ancestor_id = ? AND c.depth > 0
+    '''
+    params = [topic_id]
+    if max_depth is not None:
+        query += ' AND c.depth <= ?'
+        params.append(max_depth)
+    return conn.execute(query + ' ORDER BY c.depth, t.name', params).fetchall()
+
+
+def ancestors(conn, topic_id):
+    """(id, name, parent_id, depth) for every topic above topic_id, root last"""
+    return conn.execute('''
+        SELECT t.id, t.name, t.parent_id, c.depth
+        FROM topic_closure c
+        JOIN topics t ON t.id = c.ancestor_id
+        WHERE c.descendant_id = ? AND c.depth > 0
+        ORDER BY c.depth
+    ''', (topic_id,)).fetchall()
@@ -0,0 +1,81 @@
+"""
+Per-verse topic bitsets for a chapter
+
+A chapter's topics (from scripture_topics links and from scripture_tags
+spans, including spans that start or end in another chapter) are numbered
+in id order, and each verse gets an integer with bit i set when topic i
+covers it. Which topics touch a window of verses is then the OR of the
+window's bitsets, so viewport filtering is a set union instead of a scan
+over every tag and verse.
+"""
+
+from bible_books import MAX_VERSE, position_key
+
+
+def chapter_bitsets(conn, book, chapter, version_id=None):
+    """
+    (topic_ids, bitsets) for one chapter of a Book, where bitsets maps each
+    verse number to its topic bitset. Bit i stands for topic_ids[i].
+    """
+    query = 'SELECT DISTINCT verse FROM scripture WHERE book = ? AND chapter = ?'
+    params = [book.name, chapter]
+    version_abbr = None
+    if version_id is not None:
+        query += ' AND version_id = ?'
+        params.append(version_id)
+        row = conn.execute('SELECT abbreviation FROM bible_versions WHERE id = ?', (version_id,)).fetchone()
+        version_abbr = row[0] if row else None
+    verses = [row[0] for row in conn.execute(query, params)]
+
+    covered = []  # (topic_id, first_verse, last_verse)
+
+    query = '''
+        SELECT st.topic_id, s.verse
+        FROM scripture_topics st
+        JOIN scripture s ON st.scripture_id = s.id
+        WHERE s.book = ? AND s.chapter = ?
+    '''
+    params = [book.name, chapter]
+    if version_id is not None:
+        query += ' AND s.version_id = ?'
+        params.append(version_id)
+    covered.extend((topic_id, verse, verse) for topic_id, verse in conn.execute(query, params))
+
+    # Tags overlapping the chapter, clipped to it
+    chapter_start = position_key(book.number, chapter, 0)
+    chapter_end = position_key(book.number, chapter, MAX_VERSE, 999)
+    query = '''
+        SELECT topic_id, start_key, end_key FROM scripture_tags
+        WHERE topic_id IS NOT NULL AND start_key <= ? AND end_key >= ?
+    '''
+    params = [chapter_end, chapter_start]
+    if version_abbr:
+        query += ' AND version = ?'
+        params.append(version_abbr)
+    for topic_id, start_key, end_key in conn.execute(query, params):
+        first = max(start_key, chapter_start) // 1000 % 1000
+        last = min(end_key, chapter_end) // 1000 % 1000
+        covered.append((topic_id, first, last))
+
+    topic_ids = sorted({topic_id for topic_id, _, _ in covered})
+    bits = {topic_id: 1 << i for i, topic_id in enumerate(topic_ids)}
+    bitsets = {verse: 0 for verse in verses}
+    for topic_id, first, last in covered:
+        for verse in verses:
+            if first <= verse <= last:
+                bitsets[verse] |= bits[topic_id]
+    return topic_ids, bitsets
+
+
+def window_topics(topic_ids, bitsets, first_verse=1, last_verse=MAX_VERSE):
+    """Topic ids covering any verse from first_verse to last_verse"""
+    mask = 0
+    for verse, bitset in bitsets.items():
+        if first_verse <= verse <= last_verse:
+            mask |= bitset
+    return [topic_id for i, topic_id in enumerate(topic_ids) if mask >> i & 1]
+
+
+def encode_bitsets(bitsets):
+    """JSON form: verse number -> hex bitset (JavaScript reads it with BigInt('0x' + value))"""
+    return {str(verse): format(bitset, 'x') for verse, bitset in sorted(bitsets.items())}
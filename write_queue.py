@@ -0,0 +1,145 @@
+"""
+Group-commit write queue
+
+Request handlers hand small writes to a single background writer thread
+instead of each opening a connection and committing on its own. The writer
+takes everything that arrives within a few milliseconds of the first write
+and runs it in one transaction, so a burst of clicks costs one commit (one
+fsync) instead of one each, and writers never fight over the database lock.
+
+Each write runs inside its own savepoint: if it raises, only that write is
+rolled back and its caller gets the exception, while the rest of the batch
+still commits. Futures are resolved only after the batch has committed.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+# How long the writer waits for more writes after the first one arrives
+DEFAULT_WINDOW = 0.005
+MAX_BATCH = 500
+
+# Seconds a connection waits on a lock held by another process
+BUSY_TIMEOUT = 10
+
+# The writer thread exits after this many idle seconds and restarts on demand
+IDLE_TIMEOUT = 30
+
+
+class WriteQueue:
+    """Single-writer queue that batches writes into group commits"""
+
+    def __init__(self, database, window=DEFAULT_WINDOW, max_batch=MAX_BATCH, idle_timeout=IDLE_TIMEOUT):
+        self.database = database
+        self.window = window
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Running totals, so average batch size = writes / batches
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, write):
+        """
+        Queue write(conn) and return a Future for its return value.
+
+        write must not commit or roll back; the queue owns the transaction.
+        """
+        future = Future()
+        with self._lock:
+            self._queue.put((write, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+        return future
+
+    def execute(self, write, timeout=30):
+        """Submit a write and wait for its result (re-raising its error)"""
+        return self.submit(write).result(timeout)
+
+    def _collect(self):
+        """Wait for the next batch; None once the writer has been idle too long"""
+        try:
+            batch = [self._queue.get(timeout=self.idle_timeout)]
+        except queue.Empty:
+            with self._lock:
+                # submit() puts under the same lock, so nothing can slip in
+                # between this check and the thread being marked gone
+                if self._queue.empty():
+                    self._thread = None
+                    return None
+            batch = [self._queue.get_nowait()]
+
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.database, timeout=BUSY_TIMEOUT, isolation_level=None)
+        except Exception as e:
+            # Fail what is queued now; the next submit() starts a new writer
+            with self._lock:
+                self._thread = None
+                pending = []
+                while not self._queue.empty():
+                    pending.append(self._queue.get_nowait())
+            for _, future in pending:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                self._commit(conn, batch)
+        except BaseException:
+            with self._lock:
+                self._thread = None
+            raise
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT write')
+                try:
+                    outcomes.append((future, write(conn), None))
+                    conn.execute('RELEASE write')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    conn.execute('RELEASE write')
+                    outcomes.append((future, None, e))
+            conn.execute('COMMIT')
+            self.batches += 1
+            self.writes += len(outcomes)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)